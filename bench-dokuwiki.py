@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for the DokuWiki client in dokuwiki.py against the local
+stand-in from fake-dokuwiki.py.
+
+Starts the stand-in seeded with pages of a configurable size and latency,
+then reads and writes them one request at a time (single), in
+system.multicall batches (batched) and from a thread pool (concurrent).
+Each case runs in its own process so its peak RSS is the client's own.
+Reports pages/sec and p50/p99 request latency, written as JSON so runs
+from two revisions of the client can be compared with --compare.
+'''
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import resource
+import subprocess
+import importlib.util
+import multiprocessing
+import concurrent.futures
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOKUWIKI = os.path.join(HERE, 'dokuwiki.py')
+FAKE_DOKUWIKI = os.path.join(HERE, 'fake-dokuwiki.py')
+# pages/sec ratio below which --compare reports a regression
+REGRESSION_RATIO = 0.90
+
+
+def load_dokuwiki():
+    spec = importlib.util.spec_from_file_location('dokuwiki', DOKUWIKI)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_server(options):
+    '''
+    starts fake-dokuwiki.py on a free port, returns (process, url)
+    '''
+    proc = subprocess.Popen(
+        [sys.executable, FAKE_DOKUWIKI,
+         '--latency', str(options['latency']),
+         '--pages', str(options['pages']),
+         '--page-size', str(options['page_size']),
+         '--namespace', options['namespace']] +
+        (['--no-multicall'] if options['no_multicall'] else []),
+        stdout=subprocess.PIPE)
+    line = proc.stdout.readline().decode('utf-8').strip()
+    if not line.startswith('listening on '):
+        proc.kill()
+        raise RuntimeError("fake-dokuwiki.py didn't start: {}".format(line))
+    return proc, line[len('listening on '):]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_case(name, url, options, conn):
+    '''
+    runs one case in the current (forked) process and sends its
+    measurements down conn
+    '''
+    dw = load_dokuwiki()
+    mode, op = name.split('_')
+    wiki = dw.DokuWiki(url,
+                       pool_size=options['jobs'],
+                       max_calls=options['batch_size'])
+    text = ('benchmark page text.\n' * (options['page_size'] // 21 + 1))[:options['page_size']]
+    if op == 'get':
+        names = ['{}:page{}'.format(options['namespace'], n) for n in range(options['pages'])]
+    else:
+        names = ['{}:put{}'.format(options['namespace'], n) for n in range(options['pages'])]
+
+    latencies = []
+
+    def timed(function, *args):
+        start = time.time()
+        result = function(*args)
+        latencies.append(time.time() - start)
+        return result
+
+    def one(pagename):
+        if op == 'get':
+            return timed(wiki.get_page, pagename)
+        return timed(wiki.put_page, pagename, text)
+
+    start = time.time()
+    failed = 0
+    if mode == 'single':
+        for pagename in names:
+            one(pagename)
+    elif mode == 'batched':
+        size = options['batch_size']
+        for first in range(0, len(names), size):
+            batch = names[first:first + size]
+            if op == 'get':
+                _, errors = timed(wiki.get_pages, batch)
+            else:
+                _, errors = timed(wiki.put_pages, dict((pagename, text) for pagename in batch))
+            failed += len(errors)
+    elif mode == 'concurrent':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options['jobs']) as pool:
+            for future in [pool.submit(one, pagename) for pagename in names]:
+                try:
+                    future.result()
+                except dw.DokuWikiError:
+                    failed += 1
+    else:
+        raise ValueError("unknown case {}".format(name))
+
+    wall = time.time() - start
+    wiki.close()
+    conn.send({
+        "wall": wall,
+        "pages_per_sec": len(names) / wall if wall else None,
+        "requests": len(latencies),
+        "failed": failed,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+    conn.close()
+
+
+CASES = [
+    'single_get',
+    'batched_get',
+    'concurrent_get',
+    'single_put',
+    'batched_put',
+    'concurrent_put',
+]
+
+
+def measure(name, url, options, repeat):
+    '''
+    runs a case repeat times, each in a fresh process, and keeps the
+    fastest run
+    '''
+    context = multiprocessing.get_context('fork')
+    best = None
+    for _ in range(repeat):
+        parent, child = context.Pipe(duplex=False)
+        proc = context.Process(target=run_case, args=(name, url, options, child))
+        proc.start()
+        child.close()
+        result = parent.recv()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError("case {} failed with {}".format(name, proc.exitcode))
+        if best is None or result['wall'] < best['wall']:
+            best = result
+    return best
+
+
+def client_revision():
+    try:
+        return subprocess.check_output(
+            ['git', '-C', HERE, 'describe', '--always', '--dirty'],
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def compare(old, new):
+    '''
+    print the pages/sec ratio of every case in both result files; returns
+    the number of regressions
+    '''
+    regressions = 0
+    print("{:16} {:>10} {:>10} {:>7}".format('case', 'old', 'new', 'ratio'))
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['pages_per_sec']
+        after = result['pages_per_sec']
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio < REGRESSION_RATIO:
+            flag = ' REGRESSION'
+            regressions += 1
+        print("{:16} {:10.1f} {:10.1f} {:7.2f}{}".format(name, before, after, ratio, flag))
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Benchmark the DokuWiki client')
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--page-size', type=int, default=4096,
+                        help='characters per page')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds the stand-in adds to every request')
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='threads and pooled connections for concurrent cases')
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='pages per system.multicall for batched cases')
+    parser.add_argument('--no-multicall', action='store_true', default=False,
+                        help='stand-in without system.multicall')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--case', action='append', choices=CASES, default=None,
+                        help='case to run, can be repeated (default all)')
+    parser.add_argument('--output', type=str, default='bench-dokuwiki.json')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='results file from another revision to compare with')
+    params = parser.parse_args(args)
+
+    options = {
+        "pages": params.pages,
+        "page_size": params.page_size,
+        "latency": params.latency,
+        "jobs": params.jobs,
+        "batch_size": params.batch_size,
+        "no_multicall": params.no_multicall,
+        "namespace": 'bench',
+    }
+
+    server, url = start_server(options)
+    try:
+        results = {}
+        for name in params.case or CASES:
+            results[name] = measure(name, url, options, params.repeat)
+            print("{:16} {:8.1f} pages/s  p50 {:7.1f}ms  p99 {:7.1f}ms {:8} KiB peak".format(
+                name,
+                results[name]['pages_per_sec'],
+                results[name]['p50'] * 1000,
+                results[name]['p99'] * 1000,
+                results[name]['maxrss_kb']))
+    finally:
+        server.kill()
+        server.wait()
+
+    report = {
+        "revision": client_revision(),
+        "time": time.time(),
+        "options": options,
+        "results": results,
+    }
+    with io.open(params.output, 'w', encoding='utf-8') as out:
+        json.dump(report, out, indent=1, sort_keys=True)
+
+    if params.compare:
+        with io.open(params.compare, 'r', encoding='utf-8') as old:
+            if compare(json.load(old), report):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for git-deltas.py against throwaway synthetic repositories.
+
+Builds a local repo with a configurable number of upstream/x.y tags,
+commits per tag and -real override tags, then times the tag listing, the
+per-commit and per-range metadata paths and full upstream-deltas runs.
+Each case runs in its own process so its subprocess count and peak RSS
+are its own. Results are written as JSON so runs from two revisions of
+the tool can be compared with --compare.
+'''
+import os
+import sys
+import io
+import json
+import random
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import importlib.util
+import multiprocessing
+
+GIT_DELTAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'git-deltas.py')
+# wall time ratio above which --compare reports a regression
+REGRESSION_RATIO = 1.10
+
+
+def load_git_deltas():
+    spec = importlib.util.spec_from_file_location('git_deltas', GIT_DELTAS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_repo(path, tags, commits_per_tag, overrides, merge_every=0,
+              release_branches=False, skew=0):
+    '''
+    create a repo at path with one upstream/2.<n> tag every commits_per_tag
+    commits. the first overrides tags also get an upstream/2.<n>-real tag
+    one commit earlier. with merge_every, every merge_every'th commit is a
+    merge of a short side branch. with release_branches, every tag is a
+    release commit on a branch of its own, so no tag contains the next.
+    with skew, a third of the commits are dated up to skew seconds off,
+    so they can look older or newer than their parents.
+    '''
+    rng = random.Random(0)
+
+    def stamp(date):
+        if skew and rng.random() < 1 / 3:
+            return date + rng.randint(-skew, skew)
+        return date
+
+    subprocess.check_call(['git', 'init', '-q', path])
+    stream = io.StringIO()
+    mark = 0
+    # the last commit on master
+    head = 0
+    date = 1500000000
+    for tag in range(tags):
+        for commit in range(commits_per_tag):
+            mark += 1
+            date += 60
+            message = 'commit {} of upstream/2.{}'.format(commit, tag)
+            stream.write('commit refs/heads/master\n')
+            stream.write('mark :{}\n'.format(mark))
+            stamped = stamp(date)
+            stream.write('author Dev {0} <dev{0}@example.com> {1} +0000\n'.format(mark % 7, stamped))
+            stream.write('committer Dev {0} <dev{0}@example.com> {1} +0000\n'.format(mark % 7, stamped))
+            stream.write('data {}\n{}\n'.format(len(message), message))
+            if head:
+                stream.write('from :{}\n'.format(head))
+            stream.write('M 644 inline file\ndata {}\n{}\n\n'.format(len(str(mark)), mark))
+            if merge_every and mark > 2 and mark % merge_every == 0 and head:
+                # a side commit forked from the previous commit, merged back
+                base = mark
+                date += 60
+                stream.write('commit refs/heads/side\nmark :{}\n'.format(base + 1))
+                stream.write('committer Dev 0 <dev0@example.com> {} +0000\n'.format(stamp(date)))
+                stream.write('data 4\nside\nfrom :{}\n\n'.format(head))
+                date += 60
+                stream.write('commit refs/heads/master\nmark :{}\n'.format(base + 2))
+                stream.write('committer Dev 0 <dev0@example.com> {} +0000\n'.format(stamp(date)))
+                stream.write('data 5\nmerge\nfrom :{}\nmerge :{}\n\n'.format(base, base + 1))
+                mark = base + 2
+            head = mark
+        tagged = mark
+        if release_branches:
+            date += 60
+            tagged = mark + 1
+            message = 'release 2.{}'.format(tag)
+            stream.write('commit refs/heads/release-2.{}\nmark :{}\n'.format(tag, tagged))
+            stream.write('committer Dev 0 <dev0@example.com> {} +0000\n'.format(stamp(date)))
+            stream.write('data {}\n{}\nfrom :{}\n\n'.format(len(message), message, mark))
+            mark = tagged
+        stream.write('reset refs/tags/upstream/2.{}\nfrom :{}\n\n'.format(tag, tagged))
+        if tag < overrides and tagged > 1:
+            stream.write('reset refs/tags/upstream/2.{}-real\nfrom :{}\n\n'.format(
+                tag, tagged - 1))
+
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'],
+                   input=stream.getvalue().encode('utf-8'),
+                   check=True)
+    subprocess.check_call(['git', '-C', path, 'pack-refs', '--all'])
+
+
+class CountingPopen(subprocess.Popen):
+    count = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.count += 1
+        super().__init__(*args, **kwargs)
+
+
+def run_case(name, repo, options, conn):
+    '''
+    runs one case in the current (forked) process and sends its
+    measurements down conn
+    '''
+    subprocess.Popen = CountingPopen
+    os.chdir(repo)
+    gd = load_git_deltas()
+    devnull = io.open(os.devnull, 'w', encoding='utf-8')
+    sys.stderr = devnull
+
+    def deltas(**kwargs):
+        gd.git_deltas(
+            gd.git_checked_tag_list(gd.UPSTREAM_TAG_SCHEME)[0],
+            gd.make_formatter(options['format'], devnull),
+            **kwargs)
+
+    def cache(cold):
+        path = os.path.join(repo, '.git', 'bench-cache.sqlite')
+        if cold and os.path.exists(path):
+            os.remove(path)
+        return gd.CommitCache(path)
+
+    def first_range():
+        tags = gd.git_checked_tag_list(gd.UPSTREAM_TAG_SCHEME)[0]
+        return ["refs/tags/{}".format(tags[0]), "^refs/tags/{}".format(tags[1])]
+
+    setup = {}
+    if name == 'warm_cache_deltas':
+        # fill the cache outside of the measurement
+        c = cache(True)
+        deltas(cache=c)
+        c.close()
+    elif name == 'per_commit_metadata':
+        setup['shas'] = list(gd.lines_in_command(
+            ['git', 'rev-list', '--max-count={}'.format(options['sample'])] +
+            first_range()))
+
+    CountingPopen.count = 0
+    start = time.time()
+    rows = 0
+
+    if name == 'checked_tag_list':
+        rows = len(gd.git_checked_tag_list(gd.UPSTREAM_TAG_SCHEME)[0])
+    elif name == 'per_commit_metadata':
+        for sha in setup['shas']:
+            gd.git_pretty_commit(sha, as_list=True, stripped=True)
+            rows += 1
+    elif name == 'range_metadata':
+        for _ in gd.git_pretty_commits(first_range(), stripped=True):
+            rows += 1
+    elif name == 'deltas':
+        deltas()
+    elif name == 'cold_cache_deltas':
+        c = cache(True)
+        deltas(cache=c)
+        c.close()
+    elif name == 'warm_cache_deltas':
+        c = cache(False)
+        deltas(cache=c)
+        c.close()
+    elif name == 'graph_deltas':
+        deltas(graph=True)
+    elif name == 'parallel_deltas':
+        deltas(jobs=options['jobs'])
+    else:
+        raise ValueError("unknown case {}".format(name))
+
+    wall = time.time() - start
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    conn.send({
+        "wall": wall,
+        "subprocesses": CountingPopen.count,
+        "rows": rows,
+        "maxrss_kb": own.ru_maxrss,
+        "children_maxrss_kb": children.ru_maxrss,
+    })
+    conn.close()
+
+
+CASES = [
+    'checked_tag_list',
+    'per_commit_metadata',
+    'range_metadata',
+    'deltas',
+    'cold_cache_deltas',
+    'warm_cache_deltas',
+    'graph_deltas',
+    'parallel_deltas',
+]
+
+
+def measure(name, repo, options, repeat):
+    '''
+    runs a case repeat times, each in a fresh process, and keeps the
+    fastest run
+    '''
+    context = multiprocessing.get_context('fork')
+    best = None
+    for _ in range(repeat):
+        parent, child = context.Pipe(duplex=False)
+        proc = context.Process(target=run_case, args=(name, repo, options, child))
+        proc.start()
+        child.close()
+        result = parent.recv()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError("case {} failed with {}".format(name, proc.exitcode))
+        if best is None or result['wall'] < best['wall']:
+            best = result
+    return best
+
+
+def tool_revision():
+    try:
+        return subprocess.check_output(
+            ['git', '-C', os.path.dirname(GIT_DELTAS), 'describe', '--always', '--dirty'],
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def compare(old, new):
+    '''
+    print the wall time ratio of every case in both result files; returns
+    the number of regressions
+    '''
+    regressions = 0
+    print("{:24} {:>10} {:>10} {:>7}".format('case', 'old', 'new', 'ratio'))
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['wall']
+        after = result['wall']
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio > REGRESSION_RATIO:
+            flag = ' REGRESSION'
+            regressions += 1
+        print("{:24} {:10.3f} {:10.3f} {:7.2f}{}".format(name, before, after, ratio, flag))
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Benchmark git-deltas.py')
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--commits-per-tag', type=int, default=50)
+    parser.add_argument('--overrides', type=int, default=5,
+                        help='number of tags that also get a -real override')
+    parser.add_argument('--merge-every', type=int, default=0,
+                        help='make every n\'th commit a merge')
+    parser.add_argument('--release-branches', action='store_true', default=False,
+                        help='tag release commits on branches of their own')
+    parser.add_argument('--skew', type=int, default=0,
+                        help='date a third of the commits up to this many seconds off')
+    parser.add_argument('--sample', type=int, default=200,
+                        help='commits timed through the per-commit path')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--format', type=str, default='text')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--case', action='append', choices=CASES, default=None,
+                        help='case to run, can be repeated (default all)')
+    parser.add_argument('--repo', type=str, default=None,
+                        help='reuse (or create) the synthetic repo here')
+    parser.add_argument('--output', type=str, default='bench-git-deltas.json')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='results file from another revision to compare with')
+    params = parser.parse_args(args)
+
+    options = {
+        "tags": params.tags,
+        "commits_per_tag": params.commits_per_tag,
+        "overrides": params.overrides,
+        "merge_every": params.merge_every,
+        "release_branches": params.release_branches,
+        "skew": params.skew,
+        "sample": params.sample,
+        "jobs": params.jobs,
+        "format": params.format,
+    }
+
+    tmpdir = None
+    repo = params.repo
+    if repo is None:
+        tmpdir = tempfile.mkdtemp(prefix='bench-git-deltas-')
+        repo = os.path.join(tmpdir, 'repo')
+    try:
+        if not os.path.exists(repo):
+            print("STATUS creating repo {}".format(repo))
+            make_repo(repo, params.tags, params.commits_per_tag,
+                      params.overrides, params.merge_every,
+                      params.release_branches, params.skew)
+
+        results = {}
+        for name in params.case or CASES:
+            results[name] = measure(name, repo, options, params.repeat)
+            print("{:24} {:8.3f}s {:6} subprocesses {:8} KiB peak".format(
+                name,
+                results[name]['wall'],
+                results[name]['subprocesses'],
+                results[name]['maxrss_kb']))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+    report = {
+        "revision": tool_revision(),
+        "time": time.time(),
+        "options": options,
+        "results": results,
+    }
+    with io.open(params.output, 'w', encoding='utf-8') as out:
+        json.dump(report, out, indent=1, sort_keys=True)
+
+    if params.compare:
+        with io.open(params.compare, 'r', encoding='utf-8') as old:
+            if compare(json.load(old), report):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,177 @@
+'''
+A cache of installed build trees, so a build that was done before can be
+restored instead of rebuilt.
+
+Every entry is the tree a `make install DESTDIR=...` produced, stored as a
+directory named by its key under the cache directory. The entries' mtimes
+are their last use; the least recently used ones are evicted once the
+cache is over its size.
+'''
+import os
+import errno
+import shutil
+import hashlib
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# the key of the entry last restored over the root, see uninstall
+INSTALLED_FILE = 'installed'
+
+
+def build_key(*parts):
+    '''
+    A key from everything a build depends on, e.g. the source tree hash,
+    patch contents and configure flags.
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode('utf-8')
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def tree_files(path):
+    '''
+    Paths relative to path of every file and symlink under it.
+    '''
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames + [d for d in dirnames
+                                 if os.path.islink(os.path.join(dirpath, d))]:
+            files.append(os.path.relpath(os.path.join(dirpath, name), path))
+    return sorted(files)
+
+
+def tree_size(path):
+    return sum(os.lstat(os.path.join(path, name)).st_size
+               for name in tree_files(path))
+
+
+def copy_over(source, root):
+    '''
+    Copy every file under source to the same place under root, replacing
+    what's there. Returns the relative paths copied.
+    '''
+    files = tree_files(source)
+    for name in files:
+        src = os.path.join(source, name)
+        dst = os.path.join(root, name)
+        parent = os.path.dirname(dst)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        if os.path.lexists(dst) and not os.path.isdir(dst):
+            os.remove(dst)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+        else:
+            shutil.copy2(src, dst)
+    return files
+
+
+class BuildCache(object):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        '''
+        The stored tree for key, or None.
+        '''
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def put(self, key, tree):
+        '''
+        Store a copy of tree as key, then evict down to the size limit.
+        '''
+        partial = self.path('%s.partial-%d' % (key, os.getpid()))
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+        shutil.copytree(tree, partial, symlinks=True)
+        try:
+            os.rename(partial, self.path(key))
+        except OSError as e:
+            # stored by someone else in the meantime
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            shutil.rmtree(partial)
+        # copytree copied tree's own mtime
+        os.utime(self.path(key), None)
+        self.evict(keep=key)
+        return self.path(key)
+
+    def entries(self):
+        '''
+        (mtime, key) of every entry, oldest first
+        '''
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if '.partial-' in key or not os.path.isdir(path):
+                continue
+            entries.append((os.stat(path).st_mtime, key))
+        return sorted(entries)
+
+    def installed(self):
+        try:
+            with open(os.path.join(self.directory, INSTALLED_FILE)) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def evict(self, keep=None):
+        '''
+        Remove the least recently used entries until the cache fits. keep
+        and the installed entry are never removed.
+        '''
+        installed = self.installed()
+        entries = [(key, tree_size(self.path(key))) for _, key in self.entries()]
+        total = sum(size for _, size in entries)
+        for key, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key in (keep, installed):
+                continue
+            shutil.rmtree(self.path(key))
+            total -= size
+
+    def restore(self, key, root='/'):
+        '''
+        Install the tree stored as key over root, removing what the
+        previously restored entry installed first.
+        '''
+        path = self.get(key)
+        if path is None:
+            raise KeyError(key)
+        self.uninstall(root)
+        copy_over(path, root)
+        with open(os.path.join(self.directory, INSTALLED_FILE), 'w') as f:
+            f.write(key)
+
+    def uninstall(self, root='/'):
+        '''
+        Remove the files the last restore installed under root, if that
+        entry is still around. Returns whether anything was uninstalled.
+        '''
+        key = self.installed()
+        if key is None:
+            return False
+        os.remove(os.path.join(self.directory, INSTALLED_FILE))
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return False
+        for name in tree_files(path):
+            try:
+                os.remove(os.path.join(root, name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return True
@@ -0,0 +1,171 @@
+'''
+Pin a VM's vCPU threads to dedicated host cores.
+
+The vCPU threads are picked out of the qemu process's threads, by name when
+qemu names them (-name debug-threads=on gives "CPU n/KVM") and otherwise
+as the busiest threads over a sampling interval. Each gets a core of its
+own from a core list, on the VM's NUMA node, away from the OVS PMD cores
+and their hyperthread siblings. Topology is read from sysfs; both the sysfs
+and proc roots can be pointed at fake trees.
+'''
+from __future__ import print_function
+import os
+import re
+import time
+
+import procinfo
+import tracing
+
+SYS_ROOT = '/sys'
+VCPU_THREAD_NAME = re.compile(r'^CPU (\d+)/KVM$')
+
+
+class PinningError(RuntimeError):
+    pass
+
+
+def parse_cpu_list(text):
+    '''
+    "0-3,8,10-11" as used all over sysfs, to a sorted list of cpus
+    '''
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def parse_cpu_mask(mask):
+    '''
+    a hex cpu mask like pmd-cpu-mask, to a sorted list of cpus
+    '''
+    value = int(mask, 16)
+    return [cpu for cpu in range(value.bit_length()) if value & (1 << cpu)]
+
+
+def read_sys(sys_root, *path):
+    with open(os.path.join(sys_root, *path)) as f:
+        return f.read()
+
+
+def node_cpus(node, sys_root=SYS_ROOT):
+    return parse_cpu_list(read_sys(
+        sys_root, 'devices', 'system', 'node', 'node%d' % node, 'cpulist'))
+
+
+def thread_siblings(cpu, sys_root=SYS_ROOT):
+    '''
+    the cpus sharing a core with cpu, cpu included
+    '''
+    try:
+        return parse_cpu_list(read_sys(
+            sys_root, 'devices', 'system', 'cpu', 'cpu%d' % cpu,
+            'topology', 'thread_siblings_list'))
+    except (IOError, OSError):
+        return [cpu]
+
+
+def sample_threads(process, interval):
+    '''
+    Returns (stat, usage) for every thread of process, usage being the
+    fraction of a cpu it used over interval seconds.
+    '''
+    before = dict((stat.id, stat.cpu_time) for stat in process.threads())
+    time.sleep(interval)
+    samples = []
+    for stat in process.threads():
+        if stat.id in before:
+            samples.append((stat, (stat.cpu_time - before[stat.id]) / interval))
+    return samples
+
+
+def vcpu_threads(samples, count):
+    '''
+    The count vCPU threads out of samples, ordered by vCPU index when qemu
+    named them and by usage otherwise.
+    '''
+    named = []
+    for stat, usage in samples:
+        match = VCPU_THREAD_NAME.match(stat.comm)
+        if match:
+            named.append((int(match.group(1)), stat))
+    if named:
+        return [stat for _, stat in sorted(named)][:count]
+    busiest = sorted(samples, key=lambda sample: sample[1], reverse=True)
+    return [stat for stat, _ in busiest[:count]]
+
+
+def usable_cpus(core_list, node, pmd_cpus, sys_root=SYS_ROOT):
+    '''
+    The cpus of core_list on node that are neither a PMD cpu nor one of
+    their hyperthread siblings.
+    '''
+    on_node = set(node_cpus(node, sys_root))
+    avoid = set()
+    for cpu in pmd_cpus:
+        avoid.update(thread_siblings(cpu, sys_root))
+    return [cpu for cpu in core_list if cpu in on_node and cpu not in avoid]
+
+
+def plan(threads, cpus, sys_root=SYS_ROOT):
+    '''
+    Pair every thread with a cpu of its own, preferring cpus whose
+    hyperthread siblings aren't given to another thread. Returns a list of
+    (thread stat, cpu); with fewer cpus than threads only the first
+    threads are paired and the rest are left where they are.
+    '''
+    if len(cpus) < len(threads):
+        print("WARNING %d vCPU threads but only %d usable cpus %s, "
+              "leaving %d unpinned" % (len(threads), len(cpus), cpus,
+                                       len(threads) - len(cpus)))
+    chosen = []
+    busy = set()
+    for cpu in cpus:
+        if cpu not in busy:
+            chosen.append(cpu)
+            busy.update(thread_siblings(cpu, sys_root))
+    chosen.extend(cpu for cpu in cpus if cpu not in chosen)
+    return list(zip(threads, chosen))
+
+
+def set_affinity(tid, cpu):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(tid, set([cpu]))
+    else:
+        # captured to keep taskset's before and after lines out of the log
+        tracing.check_output(['taskset', '-pc', str(cpu), str(tid)])
+
+
+def pin_vcpus(process_name, vcpus, core_list, node, pmd_cpus,
+              interval=2.0, dry_run=False,
+              proc=procinfo.PROC_ROOT, sys_root=SYS_ROOT,
+              setaffinity=set_affinity):
+    '''
+    Pin the vcpus vCPU threads of the process_name process. Prints and
+    returns the placement as a list of (thread stat, cpu); with dry_run
+    nothing is pinned.
+    '''
+    processes = procinfo.find_processes(names=(process_name,), proc=proc)
+    if len(processes) != 1:
+        raise PinningError("expected one %s process, found %s" %
+                           (process_name, processes))
+
+    threads = vcpu_threads(sample_threads(processes[0], interval), vcpus)
+    if len(threads) < vcpus:
+        raise PinningError("found only %d of %d vCPU threads" %
+                           (len(threads), vcpus))
+    placement = plan(threads, usable_cpus(core_list, node, pmd_cpus, sys_root),
+                     sys_root)
+
+    for thread, cpu in placement:
+        print("%s tid %d (%s) cpu %d -> %d" % (
+            'would pin' if dry_run else 'pin',
+            thread.id, thread.comm, thread.processor, cpu))
+        if not dry_run:
+            setaffinity(thread.id, cpu)
+    return placement
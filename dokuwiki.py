@@ -1,29 +1,357 @@
+#!/usr/bin/env python3
 import requests
+import requests.adapters
 import sys
+import os
+import io
+import time
+import sqlite3
+import hashlib
+import threading
+import functools
+import concurrent.futures
 import xml.etree.ElementTree as ET
 import getpass
 import argparse
 
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
 class DokuWikiError(RuntimeError):
     def __init__(self, string, xml, response):
         if not string:
             string = ''
         if not xml:
             xml = ''
-        if not response:
-            response = ''
+        if isinstance(xml, bytes):
+            xml = xml.decode('utf-8', errors='ignore')
+
+        status_code = ''
+        text = ''
+        if response is not None:
+            status_code = response.status_code
+            try:
+                text = response.text.encode('utf-8', errors='ignore')
+            except RuntimeError:
+                # the body was already streamed into the parser
+                text = '(body already consumed)'
 
         self._error_string = (
             "DokuWiki error: {}. \nXML:\n{}\nHTTP Response {}:\n{}"
             .format(
                 string,
                 xml,
-                response.status_code,
-                response.text.encode('utf-8', errors='ignore')))
+                status_code,
+                text))
 
     def __str__(self):
         return self._error_string
 
+class DokuWikiFault(RuntimeError):
+    '''
+    An XML-RPC fault returned for one call of a system.multicall batch,
+    or for the whole system.multicall when the wiki doesn't have it.
+    '''
+    def __init__(self, code, string):
+        self.code = code
+        self.string = string
+
+    def __str__(self):
+        return "DokuWiki fault {}: {}".format(self.code, self.string)
+
+def xmlrpc_value(value):
+    '''
+    Serialise a python value as an XML-RPC <value>.
+    '''
+    if isinstance(value, bool):
+        return "<value><boolean>{}</boolean></value>".format(int(value))
+    elif isinstance(value, int):
+        return "<value><int>{}</int></value>".format(value)
+    elif isinstance(value, (list, tuple)):
+        return "<value><array><data>{}</data></array></value>".format(
+            "".join(xmlrpc_value(v) for v in value))
+    elif isinstance(value, dict):
+        return "<value><struct>{}</struct></value>".format(
+            "".join("<member><name>{}</name>{}</member>".format(k, xmlrpc_value(v))
+                    for k, v in value.items()))
+    return "<value><string>{}</string></value>".format(cdata(value))
+
+def string_param(text):
+    '''
+    The pieces of an untyped string <param> for a RequestBody, the text
+    left as str to be escaped and encoded as it's sent.
+    '''
+    return [b"<param><string>", text, b"</string></param>"]
+
+class RequestBody:
+    '''
+    A request body made of pieces: bytes are sent as they are, str pieces
+    are page text, wrapped in CDATA and encoded a chunk at a time while
+    the body is sent. So the body never exists whole, only its length is
+    worked out up front (for Content-Length) by encoding it once without
+    keeping anything. Iterating again starts over, for retries.
+    '''
+    CHUNK=64*1024
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.length = sum(len(chunk) for chunk in self)
+
+    def __iter__(self):
+        for piece in self.pieces:
+            if isinstance(piece, bytes):
+                yield piece
+            else:
+                for chunk in cdata_chunks(piece, RequestBody.CHUNK):
+                    yield chunk
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        head = b""
+        for chunk in self:
+            head += chunk
+            if len(head) >= 1024:
+                break
+        return "{}... ({} bytes)".format(head[:1024].decode('utf-8', errors='ignore'),
+                                         self.length)
+
+class ResponseTarget:
+    '''
+    An XMLParser target building the response tree like TreeBuilder,
+    except that the text of each element is gathered in one bytearray
+    instead of a list of pieces, expat handing page text over line by
+    line. Elements off path are cleared as soon as they end, so only the
+    wanted subtree is ever held in memory; see parse_response.
+    '''
+    def __init__(self, path):
+        self.builder = ET.TreeBuilder()
+        self.wanted = path.split('/')
+        self.fault_path = ['fault', 'value']
+        self.tags = []
+        self.text = bytearray()
+        self.found = None
+        self.fault = None
+
+    def flush(self):
+        if self.text:
+            self.builder.data(self.text.decode('utf-8'))
+            self.text = bytearray()
+
+    def start(self, tag, attrs):
+        self.flush()
+        self.tags.append(tag)
+        return self.builder.start(tag, attrs)
+
+    def data(self, data):
+        self.text += data.encode('utf-8')
+
+    def end(self, tag):
+        self.flush()
+        element = self.builder.end(tag)
+        below_root = self.tags[1:]
+        self.tags.pop()
+        if below_root == self.wanted:
+            if self.found is None:
+                self.found = element
+        elif below_root == self.fault_path:
+            self.fault = element
+        elif below_root[:len(self.wanted)] != self.wanted and \
+                below_root[:len(self.fault_path)] != self.fault_path:
+            element.clear()
+        return element
+
+    def close(self):
+        self.flush()
+        return self.builder.close()
+
+def parse_response(stream, path, chunk_size=RequestBody.CHUNK):
+    '''
+    Parse an XML-RPC response from a byte stream, as it arrives. Returns
+    the first element at path below the root (e.g. params/param/value,
+    with its subtree) and the fault's value element if the response is
+    a fault.
+    '''
+    target = ResponseTarget(path)
+    # XML should be able to use UTF-8. However,
+    # the dokuwiki doesn't send an 'encoding' parameter in it's
+    # xml header or whatever it is, so tell the parser.
+    parser = ET.XMLParser(target=target, encoding='utf-8')
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        parser.feed(chunk)
+    parser.close()
+    return target.found, target.fault
+
+def cdata_chunks(text, size):
+    '''
+    cdata(text), encoded, in pieces of about size characters. A ]]> can
+    only run across pieces through trailing ]s, so those wait for the
+    next piece.
+    '''
+    yield b"<![CDATA["
+    pending = ""
+    for start in range(0, len(text), size):
+        chunk = pending + text[start:start + size]
+        cut = len(chunk.rstrip("]"))
+        pending = chunk[cut:]
+        if cut:
+            yield chunk[:cut].replace("]]>", "]]]]><![CDATA[>").encode('utf8', errors='ignore')
+    yield (pending + "]]>").encode('utf8', errors='ignore')
+
+def cdata(text):
+    '''
+    Wrap text in a CDATA section. A literal ]]> would end the section, so
+    it is split across two.
+    '''
+    return "<![CDATA[{}]]>".format(text.replace("]]>", "]]]]><![CDATA[>"))
+
+def xmlrpc_parse(value):
+    '''
+    Convert an XML-RPC <value> element to a python value.
+    '''
+    if len(value) == 0:
+        # no type element means string
+        return value.text or ''
+    typed = value[0]
+    if typed.tag in ('string', 'base64', 'dateTime.iso8601'):
+        return typed.text or ''
+    elif typed.tag == 'boolean':
+        return bool(int(typed.text))
+    elif typed.tag in ('int', 'i4', 'i8'):
+        return int(typed.text)
+    elif typed.tag == 'double':
+        return float(typed.text)
+    elif typed.tag == 'array':
+        return [xmlrpc_parse(v) for v in typed.findall('./data/value')]
+    elif typed.tag == 'struct':
+        return dict((member.findtext('name'), xmlrpc_parse(member.find('value')))
+                    for member in typed.findall('member'))
+    elif typed.tag == 'nil':
+        return None
+    return typed.text
+
+class PageCache:
+    '''
+    An on-disk cache of page text, keyed by page name and stamped with the
+    page's version and lastModified from wiki.getPageInfo. Bounded to
+    max_bytes of text, least recently used pages are evicted first.
+    '''
+    DEFAULT_MAX_BYTES=64*1024*1024
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "name TEXT PRIMARY KEY, "
+                "stamp TEXT NOT NULL, "
+                "text TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "used REAL NOT NULL)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+
+    def get(self, name, stamp):
+        '''
+        Returns the cached text if it was stored with this stamp, else None.
+        '''
+        with self.lock:
+            row = self.db.execute(
+                "SELECT text FROM pages WHERE name = ? AND stamp = ?",
+                (name, stamp)).fetchone()
+            if row is None:
+                return None
+            with self.db:
+                self.db.execute("UPDATE pages SET used = ? WHERE name = ?",
+                                (time.time(), name))
+            return row[0]
+
+    def put(self, name, stamp, text):
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO pages (name, stamp, text, size, used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (name, stamp, text, len(text), time.time()))
+            self.evict()
+
+    def invalidate(self, name):
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM pages WHERE name = ?", (name,))
+
+    def evict(self):
+        with self.lock:
+            with self.db:
+                total = self.db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+                if total <= self.max_bytes:
+                    return
+                for name, size in self.db.execute(
+                        "SELECT name, size FROM pages ORDER BY used ASC").fetchall():
+                    self.db.execute("DELETE FROM pages WHERE name = ?", (name,))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+
+    def close(self):
+        self.db.close()
+
+def content_hash(text):
+    '''
+    Hash of page text as DokuWiki would store it: it normalises line
+    endings and drops trailing whitespace on save, so those don't count
+    as changes.
+    '''
+    text = (text or '').replace('\r\n', '\n').rstrip()
+    return hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()
+
+class PublishManifest:
+    '''
+    The content hash of every page as it was last published to a wiki,
+    so unchanged pages can be skipped on the next publish.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS published ("
+                "wiki TEXT NOT NULL, "
+                "name TEXT NOT NULL, "
+                "hash TEXT NOT NULL, "
+                "time REAL NOT NULL, "
+                "PRIMARY KEY (wiki, name))")
+
+    def get(self, wiki, name):
+        '''
+        Returns the hash last published for name to wiki, or None.
+        '''
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash FROM published WHERE wiki = ? AND name = ?",
+                (wiki, name)).fetchone()
+            return row[0] if row is not None else None
+
+    def put_many(self, wiki, hashes):
+        with self.lock:
+            now = time.time()
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO published (wiki, name, hash, time) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(wiki, name, digest, now) for name, digest in hashes.items()])
+
+    def close(self):
+        self.db.close()
+
 class DokuWiki:
     '''
     A class representing a DokuWiki, using the XML RPC
@@ -42,76 +370,472 @@ class DokuWiki:
 
     RPC_PATH="/lib/exe/xmlrpc.php"
 
+    # (connect, read) seconds
+    DEFAULT_TIMEOUT=(10, 120)
+
+    # system.multicall batches are cut at whichever limit comes first
+    DEFAULT_MAX_PAYLOAD=4*1024*1024
+    DEFAULT_MAX_CALLS=50
+
+    # the XML-RPC fault code for an unknown method
+    FAULT_NO_METHOD=-32601
+
+    def __call(self, method, params, path):
+        '''
+        Send one RPC, params being a list of <param> pieces (see
+        RequestBody), and parse the response as it streams in. Returns the
+        element at path and the fault value (see parse_response), the
+        response and the request body.
+        '''
+        head, tail = DokuWiki.XML_RPC.split('{parameters}')
+        data = RequestBody(
+            [head.format(method_name=method).encode('utf8')] +
+            params +
+            [tail.encode('utf8')])
+
+        response = self.session.put(self.url + DokuWiki.RPC_PATH,
+                                    data=data,
+                                    timeout=self.timeout,
+                                    stream=True)
+        try:
+            if not (response.status_code >= 200 and
+                    response.status_code <= 299):
+                raise DokuWikiError("response code was not OK.",
+                                    data,
+                                    response)
+
+            try:
+                response.raw.decode_content = True
+                found, fault = parse_response(response.raw, path)
+            except Exception as e:
+                raise DokuWikiError(
+                    "caught {}".format(e),
+                    data,
+                    response)
+        finally:
+            response.close()
+
+        return found, fault, response, data
+
     def __get_parsed_response(self, method, params, retrieve_path):
-        params_str = ''
         # technically, there are other types of parameters defined in the
         # XML-RPC. I don't use any so I don't check.
-
+        params_parts = []
         for param in params:
-            # CDATA tag means 'character data' and is very much necessary
-            # for the frequent case of embedded HTML markup.
-            params_str += "<param><string><![CDATA[{}]]></string></param>".format(param)
+            params_parts.extend(string_param(param))
 
-        data_str = DokuWiki.XML_RPC.format(method_name=method,
-                                           parameters=params_str)
+        found, fault, response, data = self.__call(
+            method,
+            params_parts,
+            retrieve_path[len('./'):] if retrieve_path.startswith('./') else retrieve_path)
 
-        response = requests.put(self.url + DokuWiki.RPC_PATH,
-                                data=data_str.encode('utf8', errors='ignore'),
-                                cookies=self.cookies)
+        if found is None:
+            raise DokuWikiError(
+                "no {} in response{}".format(
+                    retrieve_path,
+                    "" if fault is None else ", fault {}".format(xmlrpc_parse(fault))),
+                data,
+                response)
 
-        if not (response.status_code >= 200 and
-                response.status_code <= 299):
-            raise DokuWikiError("response code was not OK.",
-                                data_str,
-                                response)
+        return found.text, response
 
-        return_val = None
+    def __multicall(self, calls):
+        '''
+        Run a list of (method, [params]) in one system.multicall and
+        return a list with each call's value, or a DokuWikiFault for the
+        calls that failed.
+        '''
+        params_str = "<param>{}</param>".format(xmlrpc_value(
+            [{'methodName': method, 'params': list(params)}
+             for method, params in calls]))
+        found, fault, response, data = self.__call(
+            'system.multicall',
+            [params_str.encode('utf8', errors='ignore')],
+            'params/param/value')
 
-        try:
-            # XML should be able to use UTF-8. However,
-            # the dokuwiki doesn't send an 'encoding' parameter in it's
-            # xml header or whatever it is. ElemTree is confused
-            # by utf8 chars and throws an error.
-            parsed_response = ET.fromstring(
-                    response.text.encode('utf-8', errors='ignore'))
-            return_val = parsed_response.findall(retrieve_path)[0].text
-        except Exception as e:
+        values = []
+        if found is not None:
+            values = found.findall('./array/data/value')
+        if fault is not None:
+            fault_value = xmlrpc_parse(fault)
+            if isinstance(fault_value, dict) and \
+                    fault_value.get('faultCode') == DokuWiki.FAULT_NO_METHOD:
+                raise DokuWikiFault(fault_value.get('faultCode'),
+                                    fault_value.get('faultString'))
+        if fault is not None or len(values) != len(calls):
             raise DokuWikiError(
-                "caught {}".format(e),
-                data_str,
+                "bad multicall response: {}".format(
+                    xmlrpc_parse(fault) if fault is not None else len(values)),
+                data,
                 response)
 
-        return return_val, response
+        results = []
+        for value in values:
+            result = xmlrpc_parse(value)
+            if isinstance(result, dict):
+                results.append(DokuWikiFault(result.get('faultCode'),
+                                             result.get('faultString')))
+            else:
+                results.append(result[0])
+        return results
+
+    def __batches(self, calls):
+        '''
+        Split calls into batches below the payload and call count limits.
+        A single call bigger than the limit gets a batch of its own.
+        '''
+        batch = []
+        size = 0
+        for call in calls:
+            call_size = sum(len(p.encode('utf-8')) for p in call[1]) + 128
+            if batch and (size + call_size > self.max_payload or
+                          len(batch) >= self.max_calls):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(call)
+            size += call_size
+        if batch:
+            yield batch
+
+    def __batched(self, calls, single):
+        '''
+        Run calls, a list of (method, [params]), through system.multicall
+        when the wiki has it, or one by one with single(*params) when it
+        doesn't. A batch that fails as a whole, e.g. on a 5xx or for being
+        too big for the server, is run one by one as well. Returns a list
+        of values or DokuWikiFault/DokuWikiError, one for every call.
+        '''
+        results = []
+        for batch in self.__batches(calls):
+            if self.multicall:
+                try:
+                    results.extend(self.__multicall(batch))
+                    continue
+                except DokuWikiFault:
+                    # no system.multicall on this wiki, don't try it again
+                    self.multicall = False
+                except (DokuWikiError, requests.RequestException):
+                    pass
+
+            for _, params in batch:
+                try:
+                    results.append(single(*params))
+                except (DokuWikiError, requests.RequestException) as e:
+                    results.append(e)
+        return results
 
-    def __init__(self, url):
+    def __init__(self,
+                 url,
+                 pool_size=4,
+                 timeout=DEFAULT_TIMEOUT,
+                 retries=3,
+                 backoff=0.5,
+                 max_payload=DEFAULT_MAX_PAYLOAD,
+                 max_calls=DEFAULT_MAX_CALLS,
+                 page_cache=None):
+        '''
+        All calls go through one keep-alive session, which holds up to
+        pool_size connections to the wiki and the login cookies. Connection
+        errors and resets are retried up to retries times, sleeping
+        backoff * 2^n seconds in between.
+
+        get_pages/put_pages send at most max_calls calls and roughly
+        max_payload bytes of page text per system.multicall request.
+
+        page_cache is an optional PageCache that get_page revalidates
+        against wiki.getPageInfo.
+        '''
         self.url=url
+        self.page_cache = page_cache
+        self.max_payload = max_payload
+        self.max_calls = max_calls
+        self.multicall = True
         self.version = None
-        self.cookies = requests.cookies.RequestsCookieJar()
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries,
+                              connect=retries,
+                              read=retries,
+                              status=0,
+                              backoff_factor=backoff))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cookies = self.session.cookies
         self.version = self.__get_parsed_response(
                             'dokuwiki.getVersion',
                             [],
                             './params/param/value/string')
 
     def get_page(self, pagename):
-        return self.__get_parsed_response(
+        '''
+        With a page cache, the cached text is returned when the page's
+        info shows it hasn't changed, so only the info call is made.
+        '''
+        stamp = None
+        if self.page_cache is not None:
+            try:
+                info = self.get_page_info(pagename)
+                stamp = "{}:{}".format(info.get('version'), info.get('lastModified'))
+            except DokuWikiError:
+                # e.g. the page doesn't exist yet, nothing to cache
+                pass
+            if stamp is not None:
+                text = self.page_cache.get(pagename, stamp)
+                if text is not None:
+                    return text
+
+        text = self.__get_parsed_response(
                 'wiki.getPage',
                 [pagename],
                 './params/param/value/string')[0]
+        if stamp is not None:
+            self.page_cache.put(pagename, stamp, text or '')
+        return text
+
+    def get_page_info(self, pagename):
+        '''
+        Returns wiki.getPageInfo's struct: name, lastModified, author and
+        version.
+        '''
+        return self.__rpc('wiki.getPageInfo', [pagename])
 
     def put_page(self, pagename, pagetext):
-        return bool(int(self.__get_parsed_response(
+        written = bool(int(self.__get_parsed_response(
                         'wiki.putPage',
                         [pagename, pagetext],
                         './params/param/value/boolean')[0]))
+        if self.page_cache is not None:
+            self.page_cache.invalidate(pagename)
+        return written
+
+    def get_pages(self, pagenames):
+        '''
+        Fetch many pages in as few requests as possible. Returns a dict of
+        pagename => text for the pages that were fetched, and a dict of
+        pagename => error for the ones that failed.
+        '''
+        return self.__split_results(
+            pagenames,
+            self.__batched([('wiki.getPage', [page]) for page in pagenames],
+                           self.get_page))
+
+    def put_pages(self, pages):
+        '''
+        Write a dict of pagename => text in as few requests as possible.
+        Returns a dict of pagename => bool for the pages that were written,
+        and a dict of pagename => error for the ones that failed.
+        '''
+        names = list(pages.keys())
+        results = self.__split_results(
+            names,
+            self.__batched([('wiki.putPage', [page, pages[page]]) for page in names],
+                           self.put_page))
+        if self.page_cache is not None:
+            for name in names:
+                self.page_cache.invalidate(name)
+        return results
+
+    def publish(self, pages, manifest, remote_check=False):
+        '''
+        Write the pages of a dict of pagename => text whose content changed
+        since they were last published according to manifest. With
+        remote_check the wiki's current text is compared as well, so pages
+        edited on the wiki are rewritten and pages that already match
+        aren't, whatever the manifest says.
+        Returns a list of the pages written, a list of the pages skipped
+        and a dict of pagename => error for the ones that failed.
+        '''
+        hashes = dict((name, content_hash(text)) for name, text in pages.items())
+        changed = set(name for name in pages
+                      if manifest.get(self.url, name) != hashes[name])
+
+        matching = {}
+        if remote_check:
+            remote, _ = self.get_pages(list(pages.keys()))
+            # pages that couldn't be fetched keep the manifest's verdict
+            for name, text in remote.items():
+                if content_hash(text) == hashes[name]:
+                    changed.discard(name)
+                    matching[name] = hashes[name]
+                else:
+                    changed.add(name)
+
+        written, failed = self.put_pages(dict((name, pages[name]) for name in changed))
+        for name, ok in list(written.items()):
+            if not ok:
+                failed[name] = DokuWikiError("wiki.putPage returned false", None, None)
+                del written[name]
+
+        matching.update((name, hashes[name]) for name in written)
+        manifest.put_many(self.url, matching)
+
+        skipped = [name for name in pages if name not in changed]
+        return list(written.keys()), skipped, failed
+
+    def list_pages(self, namespace, depth=0):
+        '''
+        List the pages in a namespace (all of its sub namespaces with
+        depth 0). Returns dicts with at least 'id' and 'size'.
+        '''
+        return self.__rpc('dokuwiki.getPagelist', [namespace, {'depth': depth}])
+
+    def __rpc(self, method, params):
+        '''
+        Call method with typed params and return its parsed return value.
+        '''
+        params_parts = ["<param>{}</param>".format(xmlrpc_value(param))
+                        .encode('utf8', errors='ignore') for param in params]
+        value, fault, response, data = self.__call(
+            method, params_parts, 'params/param/value')
+        if value is None:
+            raise DokuWikiError(
+                "no return value{}".format(
+                    "" if fault is None else ", fault {}".format(xmlrpc_parse(fault))),
+                data,
+                response)
+        return xmlrpc_parse(value)
+
+    @staticmethod
+    def __split_results(names, results):
+        values = {}
+        errors = {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                errors[name] = result
+            else:
+                values[name] = result
+        return values, errors
 
     def login(self, username, password):
         value, response = self.__get_parsed_response(
                             'dokuwiki.login',
                             [username, password],
                             './params/param/value/boolean')
-        self.cookies.update(response.cookies)
+        # the session already stores the response's cookies
         return bool(int(value))
 
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def page_path(directory, namespace, pagename):
+    '''
+    The local file for a page, laid out the way DokuWiki stores its pages:
+    ns:sub:page is <directory>/sub/page.txt when mirroring ns.
+    '''
+    relative = pagename
+    if namespace and pagename.startswith(namespace + ':'):
+        relative = pagename[len(namespace) + 1:]
+    return os.path.join(directory, *relative.split(':')) + '.txt'
+
+def local_pages(directory, namespace):
+    '''
+    Returns (pagename, path, size) for every .txt file under directory.
+    '''
+    pages = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if not filename.endswith('.txt'):
+                continue
+            path = os.path.join(dirpath, filename)
+            relative = os.path.relpath(path, directory)[:-len('.txt')]
+            pagename = ':'.join(relative.split(os.sep))
+            if namespace:
+                pagename = namespace + ':' + pagename
+            pages.append((pagename, path, os.path.getsize(path)))
+    return pages
+
+def transfer_all(transfers, jobs):
+    '''
+    Run (pagename, size, function) transfers on up to jobs threads, the
+    largest pages first so they don't end up as the tail. A transfer that
+    fails, for whatever reason, is reported and the others go on.
+    Returns the number of transfers that failed.
+    '''
+    failed = 0
+    transfers = sorted(transfers, key=lambda t: t[1], reverse=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = dict((pool.submit(function), pagename)
+                       for pagename, _, function in transfers)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print("E: {}: {}: {}".format(futures[future], type(e).__name__, e),
+                      file=sys.stderr)
+                failed += 1
+    return failed
+
+def mirror_namespace(wiki, namespace, directory, jobs):
+    '''
+    Copy every page in namespace to text files under directory.
+    Returns (pages, failed).
+    '''
+    def fetch(pagename):
+        path = page_path(directory, namespace, pagename)
+        text = wiki.get_page(pagename) or ''
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                # another transfer made it first
+                if not os.path.isdir(parent):
+                    raise
+        with io.open(path, 'w', encoding='utf-8') as out:
+            out.write(text)
+
+    pages = wiki.list_pages(namespace)
+    failed = transfer_all(
+        [(page['id'], int(page.get('size') or 0),
+          functools.partial(fetch, page['id']))
+         for page in pages],
+        jobs)
+    return len(pages), failed
+
+def push_namespace(wiki, namespace, directory, jobs):
+    '''
+    Write every text file under directory to its page in namespace.
+    Returns (pages, failed).
+    '''
+    def store(pagename, path):
+        with io.open(path, 'r', encoding='utf-8') as inp:
+            text = inp.read()
+        if not wiki.put_page(pagename, text):
+            raise DokuWikiError("wiki.putPage returned false", None, None)
+
+    pages = local_pages(directory, namespace)
+    failed = transfer_all(
+        [(pagename, size,
+          functools.partial(store, pagename, path))
+         for pagename, path, size in pages],
+        jobs)
+    return len(pages), failed
+
+def publish_namespace(wiki, namespace, directory, manifest, remote_check=False):
+    '''
+    Publish every text file under directory to its page in namespace,
+    skipping the unchanged ones. Returns (written, skipped, failed) counts.
+    '''
+    pages = {}
+    for pagename, path, _ in local_pages(directory, namespace):
+        with io.open(path, 'r', encoding='utf-8') as inp:
+            pages[pagename] = inp.read()
+
+    written, skipped, failed = wiki.publish(pages, manifest, remote_check)
+    for pagename, error in sorted(failed.items()):
+        print("E: {}: {}".format(pagename, error), file=sys.stderr)
+    return len(written), len(skipped), len(failed)
+
 '''
 Demo program for fetching dokuwiki stuff using XML RPC
 '''
@@ -121,13 +845,18 @@ def main(url,
         action, 
         nologin, 
         input_file, 
-        output_file):
+        output_file,
+        directory=None,
+        jobs=8,
+        page_cache=None,
+        manifest=None,
+        remote_check=False):
 
-    wiki = DokuWiki(url)
+    wiki = DokuWiki(url, pool_size=jobs, page_cache=page_cache)
     
 
     if not nologin:
-        username = raw_input('username > ')
+        username = input('username > ')
         password = getpass.getpass('password > ')
         if not wiki.login(username, password):
             print("could not log in")
@@ -140,10 +869,20 @@ def main(url,
     if action == 'get':
         output_file.write(wiki.get_page(page))
     elif action == 'put':
-        wikitext=''
-        for line in iter(input_file.readline, ''):
-            wikitext += line
-        wiki.put_page(page, wikitext)
+        wiki.put_page(page, input_file.read())
+    elif action in ('mirror', 'push'):
+        sync = mirror_namespace if action == 'mirror' else push_namespace
+        pages, failed = sync(wiki, page, directory, jobs)
+        print("{} {} of {} pages".format(action, pages - failed, pages))
+        if failed:
+            raise SystemExit(1)
+    elif action == 'publish':
+        written, skipped, failed = publish_namespace(
+            wiki, page, directory, manifest, remote_check)
+        print("publish: {} written, {} skipped, {} failed".format(
+            written, skipped, failed))
+        if failed:
+            raise SystemExit(1)
     else:
         print('undefined action')
 
@@ -154,13 +893,65 @@ if __name__ == '__main__':
                         dest='nologin',
                         action='store_true',
                         default=False)
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=8,
+                        help='concurrent page transfers for mirror/push')
+    parser.add_argument('--page-cache',
+                        type=str,
+                        default=None,
+                        help='cache page text in this file, revalidated with '
+                             'wiki.getPageInfo on every get')
+    parser.add_argument('--page-cache-size',
+                        type=int,
+                        default=PageCache.DEFAULT_MAX_BYTES // (1024*1024),
+                        help='page cache size in MiB')
+    parser.add_argument('--manifest',
+                        type=str,
+                        default=None,
+                        help='hashes of the pages last published, default '
+                             '.publish-manifest in the publish directory')
+    parser.add_argument('--remote-check',
+                        action='store_true',
+                        default=False,
+                        help='publish: also compare with the text on the wiki')
     parser.add_argument('url', nargs=1)
-    parser.add_argument('page', nargs=1)
-    parser.add_argument('action', nargs=1)
-    parser.add_argument('output_file', nargs='?', default='')
+    parser.add_argument('page', nargs=1,
+                        help='page, or namespace for mirror/push/publish')
+    parser.add_argument('action', nargs=1,
+                        help='get, put, mirror, push or publish')
+    parser.add_argument('output_file', nargs='?', default='',
+                        help='output file, or directory for mirror/push/publish')
     parser.add_argument('input_file', nargs='?', default='')
     params = parser.parse_args(sys.argv[1:])
 
+    page_cache = None
+    if params.page_cache is not None:
+        page_cache = PageCache(params.page_cache,
+                               max_bytes=params.page_cache_size*1024*1024)
+
+    if params.action[0] in ('mirror', 'push', 'publish'):
+        if params.output_file == '':
+            print("{} needs a directory".format(params.action[0]))
+            raise SystemExit(1)
+        manifest = None
+        if params.action[0] == 'publish':
+            manifest = PublishManifest(
+                params.manifest or
+                os.path.join(params.output_file, '.publish-manifest'))
+        main(url=params.url[0],
+             page=params.page[0],
+             action=params.action[0],
+             nologin=params.nologin,
+             input_file=None,
+             output_file=None,
+             directory=params.output_file,
+             jobs=params.jobs,
+             page_cache=page_cache,
+             manifest=manifest,
+             remote_check=params.remote_check)
+        raise SystemExit(0)
+
     i = None
     if params.input_file == '':
         i = sys.stdin
@@ -179,5 +970,6 @@ if __name__ == '__main__':
              action=params.action[0],
              nologin=params.nologin,
              input_file=inp,
-             output_file=out)
+             output_file=out,
+             page_cache=page_cache)
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+'''
+A local stand-in for a DokuWiki XML-RPC endpoint, for benchmarking and
+trying out dokuwiki.py without a live wiki.
+
+Pages are kept in memory. It implements dokuwiki.getVersion,
+dokuwiki.login, dokuwiki.getPagelist, wiki.getPage, wiki.putPage,
+wiki.getPageInfo and system.multicall, on PUT and POST to any path. Every
+request can be delayed by a fixed latency, and the wiki can be seeded with
+pages of a given size.
+'''
+import sys
+import time
+import argparse
+import threading
+import http.server
+import xmlrpc.client
+
+VERSION = 'Release 2018-04-22 "Greebo" (fake-dokuwiki)'
+# DokuWiki's fault codes for the cases we have
+FAULT_NO_PAGE = 121
+FAULT_NO_METHOD = -32601
+
+
+class FakeWiki:
+    def __init__(self, multicall=True):
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.info = {}
+        self.multicall = multicall
+
+    def seed(self, namespace, count, size):
+        '''
+        create count pages of size characters each, ns:page0 and up
+        '''
+        line = 'fake page text, seeded for benchmarking.\n'
+        text = (line * (size // len(line) + 1))[:size]
+        for n in range(count):
+            self.put_page('{}:page{}'.format(namespace, n), text)
+
+    def put_page(self, name, text):
+        with self.lock:
+            version = int(time.time())
+            if name in self.info:
+                version = max(version, self.info[name]['version'] + 1)
+            self.pages[name] = text
+            self.info[name] = {
+                'name': name,
+                'version': version,
+                'lastModified': xmlrpc.client.DateTime(version),
+                'author': 'fake',
+            }
+        return True
+
+    def call(self, method, params):
+        if method == 'dokuwiki.getVersion':
+            return VERSION
+        if method == 'dokuwiki.login':
+            return True
+        if method == 'wiki.getPage':
+            with self.lock:
+                return self.pages.get(params[0], '')
+        if method == 'wiki.putPage':
+            return self.put_page(params[0], params[1])
+        if method == 'wiki.getPageInfo':
+            with self.lock:
+                if params[0] not in self.info:
+                    raise xmlrpc.client.Fault(FAULT_NO_PAGE, 'The requested page does not exist')
+                return self.info[params[0]]
+        if method == 'dokuwiki.getPagelist':
+            prefix = params[0] + ':' if params[0] else ''
+            with self.lock:
+                return [{'id': name, 'rev': self.info[name]['version'],
+                         'mtime': self.info[name]['version'],
+                         'size': len(text.encode('utf-8'))}
+                        for name, text in sorted(self.pages.items())
+                        if name.startswith(prefix)]
+        if method == 'system.multicall' and self.multicall:
+            results = []
+            for call in params[0]:
+                try:
+                    results.append([self.call(call['methodName'], call['params'])])
+                except xmlrpc.client.Fault as fault:
+                    results.append({'faultCode': fault.faultCode,
+                                    'faultString': fault.faultString})
+            return results
+        raise xmlrpc.client.Fault(FAULT_NO_METHOD, 'server error. requested method {} does not exist.'.format(method))
+
+
+def make_handler(wiki, latency):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # send headers and body in one segment, or every response waits
+        # out a delayed ack and the latency numbers are meaningless
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8', errors='ignore')
+            # dokuwiki.py sends its own xml declaration, after whitespace
+            start = body.find('<methodCall>')
+            if start >= 0:
+                body = body[start:]
+            if latency:
+                time.sleep(latency)
+            try:
+                params, method = xmlrpc.client.loads(body)
+                out = xmlrpc.client.dumps((wiki.call(method, params),), methodresponse=True, allow_none=True)
+            except xmlrpc.client.Fault as fault:
+                out = xmlrpc.client.dumps(fault, methodresponse=True)
+            except Exception as e:
+                out = xmlrpc.client.dumps(xmlrpc.client.Fault(-32700, 'parse error. {}'.format(e)),
+                                          methodresponse=True)
+            out = out.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        do_POST = do_PUT
+
+    return Handler
+
+
+def serve(host, port, wiki, latency):
+    '''
+    returns a started server, serving on a daemon thread
+    '''
+    server = http.server.ThreadingHTTPServer((host, port), make_handler(wiki, latency))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Local stand-in for a DokuWiki XML-RPC endpoint')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0,
+                        help='0 picks a free port, printed on startup')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--pages', type=int, default=0,
+                        help='pages to seed the wiki with')
+    parser.add_argument('--page-size', type=int, default=4096,
+                        help='characters per seeded page')
+    parser.add_argument('--namespace', type=str, default='bench')
+    parser.add_argument('--no-multicall', action='store_true', default=False,
+                        help='answer system.multicall with a fault, like a wiki without it')
+    params = parser.parse_args(args)
+
+    wiki = FakeWiki(multicall=not params.no_multicall)
+    wiki.seed(params.namespace, params.pages, params.page_size)
+    server = serve(params.host, params.port, wiki, params.latency)
+    print("listening on http://{}:{}".format(*server.server_address[:2]))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
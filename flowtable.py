@@ -0,0 +1,128 @@
+'''
+OpenFlow tables for the test bridge, installed in one transaction.
+
+A table is a list of flows in ovs-ofctl's text syntax: a cross-connect
+of port pairs, optionally under N more specific flows for stress runs.
+install() writes it to a file and replaces the bridge's whole table with
+a single bundled `ovs-ofctl replace-flows`, so the switch goes from the
+old table to the new one atomically and keeps the old one if anything
+is rejected; verify() compares the bridge against the file with one
+`ovs-ofctl diff-flows`. Bundles need OpenFlow 1.4, which bridges don't
+speak by default, so install() enables it on the bridge first.
+'''
+import os
+import tempfile
+import subprocess
+
+import tracing
+
+CROSS_CONNECT_PRIORITY = 1
+STRESS_PRIORITY = 10
+# stress flows match on a destination address from here up
+STRESS_BASE_ADDRESS = 10 << 24
+# what the bridge is set to speak: 1.4 for bundles, 1.0 for plain ovs-ofctl
+PROTOCOLS = ['OpenFlow10', 'OpenFlow13', 'OpenFlow14']
+BUNDLE_PROTOCOL = 'OpenFlow14'
+
+
+class FlowError(RuntimeError):
+    pass
+
+
+def parse_port_pairs(text):
+    '''
+    "2:4,1:3" to [('2', '4'), ('1', '3')]
+    '''
+    pairs = []
+    for item in text.split(','):
+        ports = item.strip().split(':')
+        if len(ports) != 2 or not all(ports):
+            raise ValueError("bad port pair %r, expected A:B" % item)
+        pairs.append(tuple(ports))
+    return pairs
+
+
+def directions(pairs):
+    '''
+    (in_port, out_port) both ways for every pair
+    '''
+    for a, b in pairs:
+        yield a, b
+        yield b, a
+
+
+def ipv4_address(value):
+    return '.'.join(str(value >> shift & 0xff) for shift in (24, 16, 8, 0))
+
+
+def cross_connect(pairs, priority=CROSS_CONNECT_PRIORITY):
+    return ["priority=%d,in_port=%s,actions=output:%s" % (priority, in_port, out_port)
+            for in_port, out_port in directions(pairs)]
+
+
+def stress_flows(pairs, count, priority=STRESS_PRIORITY):
+    '''
+    count flows, each matching one destination address on one direction
+    of the pairs in turn, forwarding like the cross-connect
+    '''
+    ways = list(directions(pairs))
+    if count > 0xffffff:
+        raise ValueError("at most %d stress flows" % 0xffffff)
+    return ["priority=%d,ip,in_port=%s,nw_dst=%s,actions=output:%s" % (
+                priority, ways[i % len(ways)][0],
+                ipv4_address(STRESS_BASE_ADDRESS + 1 + i), ways[i % len(ways)][1])
+            for i in range(count)]
+
+
+def flow_table(pairs, stress=0):
+    '''
+    The cross-connect for pairs, under stress more specific flows
+    '''
+    if not pairs:
+        raise ValueError("no port pairs")
+    return stress_flows(pairs, stress) + cross_connect(pairs)
+
+
+def write_flows(flows, directory=None):
+    '''
+    flows to a new file, one per line, returns its path
+    '''
+    fd, path = tempfile.mkstemp(prefix='flows-', suffix='.txt', dir=directory)
+    with os.fdopen(fd, 'w') as out:
+        for flow in flows:
+            out.write(flow + '\n')
+    return path
+
+
+def install(bridge, path):
+    '''
+    Replace bridge's flow table with the flows in path, atomically.
+    '''
+    try:
+        tracing.check_output(["ovs-vsctl", "set", "bridge", bridge,
+                              "protocols=%s" % ','.join(PROTOCOLS)],
+                             stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        raise FlowError("enabling %s on %s failed, table unchanged:\n%s" % (
+            BUNDLE_PROTOCOL, bridge, e.output.decode('utf-8', 'replace')))
+    try:
+        tracing.check_output(["ovs-ofctl", "-O", BUNDLE_PROTOCOL, "--bundle",
+                              "replace-flows", bridge, path],
+                             stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        raise FlowError("installing %s on %s failed, table unchanged:\n%s" % (
+            path, bridge, e.output.decode('utf-8', 'replace')))
+
+
+def verify(bridge, path):
+    '''
+    Raise FlowError unless bridge's table is exactly the flows in path.
+    '''
+    # exits 2 when there are differences
+    returncode, output = tracing.TRACER.run(["ovs-ofctl", "diff-flows", bridge, path],
+                                            capture=True, stderr=subprocess.STDOUT)
+    output = output.decode('utf-8', 'replace')
+    if returncode != 0 or output.strip():
+        lines = output.splitlines()
+        raise FlowError("flows on %s differ from %s (%d lines):\n%s" % (
+            bridge, path, len(lines), '\n'.join(lines[:20])))
@@ -5,10 +5,29 @@ import subprocess
 import argparse
 import re
 import collections
+import array
+import heapq
+import sqlite3
+import tempfile
+import threading
+import time
+import concurrent.futures
+import csv
+import hashlib
+import io
+import json
+import shutil
 
 UPSTREAM_COMPLIANT_PATTERN=re.compile(r'^upstream/[\d\.]+$')
 UPSTREAM_GIT_PATTERN='upstream'
 UPSTREAM_OVERRIDE_PATTERN=re.compile(r'^(upstream/[\d\.]+)\-real$')
+LOG_FORMAT=["%H", "%an", "%ae", "%s"]
+CACHE_FILE_NAME='git-deltas-cache.sqlite'
+CACHE_MAX_ENTRIES=500000
+COLUMN_NAMES={"%H":"hash", "%an":"author", "%ae":"email", "%s":"subject"}
+OUTPUT_BUFFER_SIZE=1<<20
+TAG_REF_PREFIX='refs/tags/'
+NATURAL_SORT_PATTERN=re.compile(r'(\d+)')
 
 
 TagScheme = collections.namedtuple('TagScheme', ['prefix', 'check_pattern', 'override_pattern'])
@@ -37,18 +56,514 @@ FORMATS = {
         "column_end":"",
         "row_begin":"",
         "row_end":""
-    }
+    },
+    # the optional keys: "heading" replaces the para_begin/para_end
+    # heading, "header_begin"/"header_column_begin" etc. add a row of
+    # column names, "cell" is the cell format, "cell_end" follows every
+    # cell, and "escape" maps characters to their escaped form.
+    "markdown":{
+        "heading":"\n### Delta between {} ==> {}\n\n",
+        "table_begin":"",
+        "table_end":"",
+        "header_begin":"|",
+        "header_column_begin":" ",
+        "header_column_end":" |",
+        "header_end":"\n|" + "---|" * len(LOG_FORMAT) + "\n",
+        "column_begin":" ",
+        "column_end":" |",
+        "row_begin":"|",
+        "row_end":"",
+        "cell":"{}",
+        "cell_end":"",
+        "escape":{"|":"\\|"},
+    },
+    "dokuwiki":{
+        "heading":"\n===== Delta between {} ==> {} =====\n\n",
+        "table_begin":"",
+        "table_end":"",
+        "header_begin":"^",
+        "header_column_begin":" ",
+        "header_column_end":" ^",
+        "header_end":"\n",
+        "column_begin":" ",
+        "column_end":" |",
+        "row_begin":"|",
+        "row_end":"",
+        "cell":"{}",
+        "cell_end":"",
+        "escape":{"|":"%%|%%", "^":"%%^%%"},
+    },
 }
 
+def literal(string):
+    '''
+    escape a string for use as literal text in a str.format template
+    '''
+    return string.replace("{", "{{").replace("}", "}}")
+
+
 class Formatter:
-    def __init__(self, table):
+    '''
+    renders delta sections from a FORMATS table. the row template is
+    compiled once, so each row is a single format and write call.
+    '''
+    def __init__(self, table, stream=None, log_format=LOG_FORMAT):
         self.table = table
+        self.stream = stream or sys.stdout
+        self.write = self.stream.write
+        self.escape = None
+        if table.get("escape"):
+            self.escape = str.maketrans(table["escape"])
+
+        get = lambda name: table.get(name) or ""
+        ncolumns = len(log_format)
+        self.heading = table.get("heading") or (
+            literal(get("para_begin")) + "Delta between {} ==> {}" +
+            literal(get("para_end")) + "\n")
+        self.row_template = (
+            literal(get("row_begin")) +
+            (literal(get("column_begin")) + table.get("cell", "{:20}") +
+             literal(get("column_end")) + literal(table.get("cell_end", " "))) *
+            ncolumns +
+            "\n" + literal(get("row_end")))
+        self.header = ""
+        if "header_begin" in table:
+            self.header = (
+                get("header_begin") +
+                "".join(get("header_column_begin") +
+                        COLUMN_NAMES.get(column, column) +
+                        get("header_column_end")
+                        for column in log_format) +
+                get("header_end"))
+
     def out(self, name):
         if self.table[name] != None and \
             self.table[name] != "" and \
             (name in self.table):
 
-            print(self.table[name], end='')
+            self.write(self.table[name])
+
+    def begin(self):
+        '''
+        writes whatever comes before the first section
+        '''
+        pass
+
+    def section(self, pair, commits):
+        self.write(self.heading.format(pair[0], pair[1]))
+        self.out("table_begin")
+        self.write(self.header)
+        row_template = self.row_template
+        for fields in commits:
+            if self.escape is not None:
+                fields = [field.translate(self.escape) for field in fields]
+            self.write(row_template.format(*fields))
+        self.out("table_end")
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CsvFormatter(Formatter):
+    '''
+    one csv record per commit, prefixed with the tag pair
+    '''
+    def __init__(self, stream=None, log_format=LOG_FORMAT):
+        self.stream = stream or sys.stdout
+        self.writer = csv.writer(self.stream)
+        self.columns = ["from", "to"] + [COLUMN_NAMES.get(c, c) for c in log_format]
+
+    def begin(self):
+        self.writer.writerow(self.columns)
+
+    def section(self, pair, commits):
+        writerow = self.writer.writerow
+        for fields in commits:
+            writerow([pair[0], pair[1]] + fields)
+
+
+class JsonFormatter(Formatter):
+    '''
+    newline delimited json, one object per commit
+    '''
+    def __init__(self, stream=None, log_format=LOG_FORMAT):
+        self.stream = stream or sys.stdout
+        self.write = self.stream.write
+        self.columns = ["from", "to"] + [COLUMN_NAMES.get(c, c) for c in log_format]
+        self.encoder = json.JSONEncoder(ensure_ascii=False)
+
+    def section(self, pair, commits):
+        columns = self.columns
+        encode = self.encoder.encode
+        for fields in commits:
+            self.write(encode(dict(zip(columns, [pair[0], pair[1]] + fields))))
+            self.write("\n")
+
+
+def make_formatter(name, stream=None):
+    if name == "csv":
+        return CsvFormatter(stream)
+    elif name == "json":
+        return JsonFormatter(stream)
+    return Formatter(FORMATS[name], stream)
+
+
+def buffered_stdout():
+    '''
+    a text stream over stdout with a large buffer; the report is written
+    through it and flushed per section.
+    '''
+    sys.stdout.flush()
+    return io.TextIOWrapper(
+        io.open(sys.stdout.fileno(), 'wb', buffering=OUTPUT_BUFFER_SIZE, closefd=False),
+        encoding='utf-8',
+        errors='replace',
+        newline='')
+
+
+class CommitCache:
+    '''
+    persistent commit metadata of whole tag pair deltas, keyed by the
+    SHAs of the two tags' commits and the log format. a delta never
+    changes for a given pair of commits, so entries never go stale and a
+    hit runs no git at all. the file is bounded to max_entries commits,
+    the least recently used deltas are evicted on close.
+
+    a delta is stored and read back in batches of rows, so it is never
+    held in memory whole. every thread has its own connection; sqlite does
+    the locking between them, and between report jobs sharing a cache.
+    '''
+    BATCH = 1000
+    # deltas left incomplete by a run that died are removed after this
+    INCOMPLETE_TIMEOUT = 24 * 3600
+    # files of an older version are emptied when opened. 1: --graph
+    # deltas of skewed histories stored before 1 can differ from git's
+    VERSION = 1
+
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections = []
+        self.hits = []
+        db = self.connection()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            # e.g. network filesystems, the default rollback journal is
+            # still safe, just slower with concurrent readers.
+            pass
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS deltas ("
+                "id INTEGER PRIMARY KEY, "
+                "new_sha TEXT NOT NULL, "
+                "old_sha TEXT NOT NULL, "
+                "format TEXT NOT NULL, "
+                "commits INTEGER NOT NULL, "
+                "used REAL NOT NULL, "
+                "complete INTEGER NOT NULL)")
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS deltas_key "
+                "ON deltas (new_sha, old_sha, format, complete)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS delta_commits ("
+                "delta INTEGER NOT NULL, "
+                "seq INTEGER NOT NULL, "
+                "fields TEXT NOT NULL, "
+                "PRIMARY KEY (delta, seq)) WITHOUT ROWID")
+            if db.execute("PRAGMA user_version").fetchone()[0] < CommitCache.VERSION:
+                db.execute("DELETE FROM delta_commits")
+                db.execute("DELETE FROM deltas")
+                db.execute("PRAGMA user_version = {}".format(CommitCache.VERSION))
+
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # only used by this thread; close() closes it from another
+            db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self.local.db = db
+            with self.lock:
+                self.connections.append(db)
+        return db
+
+    def lookup(self, new_sha, old_sha, log_format=LOG_FORMAT):
+        '''
+        returns the id of the stored delta new_sha ^old_sha, or None
+        '''
+        row = self.connection().execute(
+            "SELECT id FROM deltas WHERE new_sha = ? AND old_sha = ? "
+            "AND format = ? AND complete = 1 ORDER BY id DESC LIMIT 1",
+            (new_sha, old_sha, "\0".join(log_format))).fetchone()
+        return row[0] if row else None
+
+    def commits(self, new_sha, old_sha, compute, log_format=LOG_FORMAT):
+        '''
+        yields the fields of every commit in new_sha ^old_sha. on a miss
+        they come from compute() and are stored as they go by; the delta
+        is only used by later runs once all of it was stored.
+        '''
+        delta = self.lookup(new_sha, old_sha, log_format)
+        if delta is not None:
+            with self.lock:
+                self.hits.append(delta)
+            return self._stored(delta)
+        return self._store(new_sha, old_sha, compute, log_format)
+
+    def _stored(self, delta):
+        db = self.connection()
+        last = -1
+        while True:
+            rows = db.execute(
+                "SELECT seq, fields FROM delta_commits WHERE delta = ? AND seq > ? "
+                "ORDER BY seq LIMIT ?", (delta, last, CommitCache.BATCH)).fetchall()
+            if not rows:
+                return
+            for _, fields in rows:
+                yield fields.split("\0")
+            last = rows[-1][0]
+
+    def _store(self, new_sha, old_sha, compute, log_format):
+        db = self.connection()
+        fmt = "\0".join(log_format)
+        with db:
+            delta = db.execute(
+                "INSERT INTO deltas (new_sha, old_sha, format, commits, used, complete) "
+                "VALUES (?, ?, ?, 0, ?, 0)", (new_sha, old_sha, fmt, time.time())).lastrowid
+
+        batch = []
+        def flush():
+            with db:
+                db.executemany(
+                    "INSERT INTO delta_commits (delta, seq, fields) VALUES (?, ?, ?)", batch)
+            del batch[:]
+
+        complete = False
+        seq = 0
+        try:
+            for fields in compute():
+                batch.append((delta, seq, "\0".join(fields)))
+                seq += 1
+                if len(batch) >= CommitCache.BATCH:
+                    flush()
+                yield fields
+            flush()
+            with db:
+                # the same delta stored meanwhile by another job
+                for (other,) in db.execute(
+                        "SELECT id FROM deltas WHERE new_sha = ? AND old_sha = ? "
+                        "AND format = ? AND complete = 1",
+                        (new_sha, old_sha, fmt)).fetchall():
+                    self._delete(db, other)
+                db.execute("UPDATE deltas SET commits = ?, used = ?, complete = 1 "
+                           "WHERE id = ?", (seq, time.time(), delta))
+            complete = True
+        finally:
+            if not complete:
+                with db:
+                    self._delete(db, delta)
+
+    @staticmethod
+    def _delete(db, delta):
+        db.execute("DELETE FROM delta_commits WHERE delta = ?", (delta,))
+        db.execute("DELETE FROM deltas WHERE id = ?", (delta,))
+
+    def evict(self):
+        db = self.connection()
+        with db:
+            if self.hits:
+                now = time.time()
+                db.executemany("UPDATE deltas SET used = ? WHERE id = ?",
+                               [(now, delta) for delta in set(self.hits)])
+                self.hits = []
+            for (delta,) in db.execute(
+                    "SELECT id FROM deltas WHERE complete = 0 AND used < ?",
+                    (time.time() - CommitCache.INCOMPLETE_TIMEOUT,)).fetchall():
+                self._delete(db, delta)
+            total = db.execute(
+                "SELECT COALESCE(SUM(commits), 0) FROM deltas WHERE complete = 1").fetchone()[0]
+            if total <= self.max_entries:
+                return
+            for delta, commits in db.execute(
+                    "SELECT id, commits FROM deltas WHERE complete = 1 "
+                    "ORDER BY used ASC").fetchall():
+                if total <= self.max_entries:
+                    break
+                self._delete(db, delta)
+                total -= commits
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            for db in self.connections:
+                db.close()
+            self.connections = []
+
+
+class CommitGraph:
+    '''
+    the commit graph reachable from a list of tags, loaded with a single
+    git rev-list --parents. commits are integer indices: dates and the
+    parent lists live in flat arrays and SHAs in one packed 20 byte per
+    commit buffer, so a 500k commit history takes tens of megabytes.
+
+    each delta is then walked in memory the way git rev-list walks it,
+    see _walk, rather than taken from which tag first contains a commit:
+    with skewed commit dates git's answer for A ^B can keep ancestors of
+    B, and the output has to be git's.
+    '''
+    # commits walked past the point where only uninteresting ones are
+    # left, revision.c's SLOP
+    SLOP = 5
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.dates = array.array('q')
+        self.shas = bytearray()
+        # parents of commit c are parents[parent_start[row[c]]:
+        # parent_start[row[c] + 1]], rows being rev-list output lines.
+        self.row = array.array('l')
+        self.parent_start = array.array('l', [0])
+        self.parents = array.array('l')
+
+        index = {}
+
+        def commit_index(hexsha):
+            key = bytes.fromhex(hexsha)
+            idx = index.get(key)
+            if idx is None:
+                idx = len(self.row)
+                index[key] = idx
+                self.shas.extend(key)
+                self.row.append(-1)
+                self.dates.append(0)
+            return idx
+
+        refs = ["refs/tags/{}".format(tag) for tag in tags]
+        for line in lines_in_command(
+                ["git", "rev-list", "--timestamp", "--parents"] + refs):
+            fields = line.split()
+            idx = commit_index(fields[1])
+            self.dates[idx] = int(fields[0])
+            self.row[idx] = len(self.parent_start) - 1
+            self.parents.extend(commit_index(f) for f in fields[2:])
+            self.parent_start.append(len(self.parents))
+
+        tips = git_tag_commits(tags)
+        self.tips = [index[bytes.fromhex(tips[tag])] for tag in tags]
+
+    def sha(self, idx):
+        return self.shas[idx*20:(idx+1)*20].hex()
+
+    def parents_of(self, idx):
+        '''
+        commits never listed themselves (parents past a shallow clone's
+        boundary) have no parents here and are never output
+        '''
+        row = self.row[idx]
+        if row < 0:
+            return ()
+        return self.parents[self.parent_start[row]:self.parent_start[row+1]]
+
+    def _walk(self, tip, other):
+        '''
+        returns the commits of tip ^other in git rev-list order, replaying
+        revision.c's limit_list: commits come off a list ordered by commit
+        date, ties first in first out. an uninteresting commit marks its
+        parents uninteresting, and their parents too where they have been
+        reached already. the walk stops once only uninteresting commits
+        are left and the newest of them is older than the last
+        interesting one, SLOP commits later. interesting commits that got
+        marked after coming off the list are left out.
+        '''
+        SEEN, UNINTERESTING = 1, 2
+        flags = {}
+        # reached, not off the list yet, and interesting
+        queued = set()
+        interesting = 0
+        queue = []
+        counter = 0
+
+        def push(commit):
+            nonlocal interesting, counter
+            flags[commit] = flags.get(commit, 0) | SEEN
+            queued.add(commit)
+            if not flags[commit] & UNINTERESTING:
+                interesting += 1
+            heapq.heappush(queue, (-self.dates[commit], counter, commit))
+            counter += 1
+
+        def mark(commit):
+            nonlocal interesting
+            flag = flags.get(commit, 0)
+            if flag & UNINTERESTING:
+                return False
+            flags[commit] = flag | UNINTERESTING
+            if commit in queued:
+                interesting -= 1
+            return bool(flag & SEEN)
+
+        def mark_parents(commit):
+            # commits already reached have their parents parsed, so git
+            # carries on through them
+            stack = [commit]
+            while stack:
+                for parent in self.parents_of(stack.pop()):
+                    if mark(parent):
+                        stack.append(parent)
+
+        push(tip)
+        if other != tip:
+            push(other)
+        mark(other)
+        mark_parents(other)
+
+        walked = []
+        slop = CommitGraph.SLOP
+        date = None
+        while queue:
+            _, _, commit = heapq.heappop(queue)
+            queued.discard(commit)
+            if flags[commit] & UNINTERESTING:
+                for parent in self.parents_of(commit):
+                    mark(parent)
+                    mark_parents(parent)
+                    if not flags[parent] & SEEN:
+                        push(parent)
+                if not queue:
+                    break
+                if (date is not None and date <= self.dates[queue[0][2]]) or interesting:
+                    slop = CommitGraph.SLOP
+                else:
+                    slop -= 1
+                    if not slop:
+                        break
+                continue
+            interesting -= 1
+            for parent in self.parents_of(commit):
+                if not flags.get(parent, 0) & SEEN:
+                    push(parent)
+            date = self.dates[commit]
+            walked.append(commit)
+        return [c for c in walked
+                if not flags[c] & UNINTERESTING and self.row[c] >= 0]
+
+    def delta(self, i):
+        '''
+        returns the SHAs of tags[i] ^tags[i+1], in git rev-list order.
+        '''
+        return [self.sha(c) for c in self._walk(self.tips[i], self.tips[i+1])]
+
+
+def git_default_cache_path():
+    '''
+    the cache lives in the (common) git dir, so it is shared by worktrees
+    and goes away with the repo.
+    '''
+    git_dir = subprocess.check_output(
+        ["git", "rev-parse", "--git-common-dir"]).decode('utf-8').strip()
+    return os.path.join(git_dir, CACHE_FILE_NAME)
 
 def lines_in_command(shell_command):
     shell = True
@@ -60,17 +575,92 @@ def lines_in_command(shell_command):
         yield line.decode('ASCII').strip()
 
 
-def git_ordered_tags(pattern):
-    return list(
-        map(lambda s: s.strip(),
-            sorted(lines_in_command("git tag --list {}".format(pattern)), reverse=True)))
+def git_readable_dir():
+    '''
+    returns the git dir if its refs can be read straight from the files
+    system, i.e. a plain .git directory with loose and packed refs. returns
+    None for layouts left to git itself: worktrees and submodules (.git
+    is a file), bare repos and reftable.
+    '''
+    git_dir = os.environ.get('GIT_DIR')
+    if git_dir is None:
+        path = os.getcwd()
+        while True:
+            candidate = os.path.join(path, '.git')
+            if os.path.exists(candidate):
+                git_dir = candidate
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
 
+    if not os.path.isdir(git_dir) or \
+            os.path.exists(os.path.join(git_dir, 'commondir')) or \
+            os.path.exists(os.path.join(git_dir, 'reftable')):
+        return None
+    return git_dir
 
-def git_checked_tag_list(scheme):
+
+def read_tag_refs(git_dir):
+    '''
+    returns the set of tag names in packed-refs and loose refs/tags files
+    '''
+    tags = set()
+    packed = os.path.join(git_dir, 'packed-refs')
+    if os.path.exists(packed):
+        with io.open(packed, 'r', encoding='utf-8', errors='replace') as refs:
+            for line in refs:
+                # '#' is the header, '^' the peeled commit of the tag above
+                if line.startswith('#') or line.startswith('^'):
+                    continue
+                fields = line.rstrip('\n').split(' ', 1)
+                if len(fields) == 2 and fields[1].startswith(TAG_REF_PREFIX):
+                    tags.add(fields[1][len(TAG_REF_PREFIX):])
+
+    root = os.path.join(git_dir, 'refs', 'tags')
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.lock'):
+                continue
+            tags.add(os.path.relpath(
+                os.path.join(dirpath, filename), root).replace(os.sep, '/'))
+    return tags
+
+
+def git_tag_names():
+    '''
+    returns every tag name in the repo, read from the refs files without
+    running git when the layout allows it
+    '''
+    git_dir = git_readable_dir()
+    if git_dir is not None:
+        return read_tag_refs(git_dir)
+    return set(lines_in_command(
+        ["git", "for-each-ref", "--format=%(refname:strip=2)", TAG_REF_PREFIX]))
+
+
+def natural_sort_key(tag):
+    '''
+    sorts digit runs by value, so upstream/2.10 comes after upstream/2.9
+    '''
+    return [(0, int(chunk), '') if chunk.isdigit() else (1, 0, chunk)
+            for chunk in NATURAL_SORT_PATTERN.split(tag)]
+
+
+def sort_tags(tags):
+    return sorted(tags, key=natural_sort_key, reverse=True)
+
+
+def check_tag_list(scheme, ordered_tags):
+    '''
+    split a scheme's ordered tags into the checked tag list, with override
+    tags standing in for the tags they override, and the non-compliant tags
+    '''
     tags = []
     overrides= {}
     errors = []
-    for tag in git_ordered_tags("{}/*".format(scheme.prefix)):
+    for tag in ordered_tags:
         override_match = re.match(scheme.override_pattern, tag)
         if re.match(scheme.check_pattern, tag):
             tags.append(tag)
@@ -80,21 +670,34 @@ def git_checked_tag_list(scheme):
             print("W: non-compliant upstream tag {}".format(tag), file=sys.stderr)
             errors.append(tag)
 
-    for override in overrides.keys():
-        if override in tags:
-            idx = tags.index(override)
-            tags.insert(idx, overrides[override])
-            tags.pop(idx+1)
+    return [overrides.get(tag, tag) for tag in tags], errors
+
+
+def git_checked_tag_lists(schemes):
+    '''
+    returns (tags, errors) for every scheme, from a single read of the refs
+    '''
+    prefixes = ["{}/".format(scheme.prefix) for scheme in schemes]
+    matched = [[] for _ in schemes]
+    for tag in git_tag_names():
+        for i, prefix in enumerate(prefixes):
+            if tag.startswith(prefix):
+                matched[i].append(tag)
+
+    return [check_tag_list(scheme, sort_tags(tags))
+            for scheme, tags in zip(schemes, matched)]
 
-    return tags, errors
+
+def git_checked_tag_list(scheme):
+    return git_checked_tag_lists([scheme])[0]
 
 
 def git_check_repo(tag_schemes):
     '''
     check the repo for bad ref names
     '''
-    for tag_scheme in tag_schemes:
-        _, errors = git_checked_tag_list(tag_scheme)
+    for tag_scheme, (_, errors) in zip(
+            tag_schemes, git_checked_tag_lists(tag_schemes)):
         if len(errors):
             print("{} errors found in your tagging scheme".format(len(errors)), file=sys.stderr)
         else:
@@ -118,7 +721,7 @@ def git_pretty_commit(
         as_list=False, 
         stripped=False, 
         delim='\t',
-        log_format=["%H", "%an", "%ae", "%s"]):
+        log_format=LOG_FORMAT):
     '''
     returns pretty print log of commit
     '''
@@ -148,40 +751,356 @@ def git_pretty_commit(
 
 
 
-def git_deltas(git_tags, formatter):
-    pairs = list_pairs(git_tags)
+def strip_fields(fields):
+    '''
+    strip a commit's fields the way stripping the joined log line would
+    '''
+    fields = list(fields)
+    fields[0] = fields[0].lstrip()
+    fields[-1] = fields[-1].rstrip()
+    return fields
+
+
+def git_pretty_commits(
+        revisions,
+        stripped=False,
+        log_format=LOG_FORMAT,
+        chunk_size=65536,
+        stdin_revisions=None):
+    '''
+    yields the pretty print log of every commit in revisions (a list of
+    arguments to git log, e.g. ['refs/tags/a', '^refs/tags/b']) as a list
+    of fields, using a single git log for the whole range.
 
-    for pair in pairs:
-        print("{para_begin}Delta between {} ==> {}{para_end}"
-            .format(pair[0], pair[1], **formatter.table))
+    fields are NUL separated on the wire so that a field containing the
+    display delimiter (e.g. a tab in an author name) stays one field.
 
-        formatter.out("table_begin")
+    stdin_revisions are fed to git log --stdin, for lists of commits too
+    long for the command line.
+    '''
+    nfields = len(log_format)
+    stdin = None
+    command = ["git",
+               "log",
+               "-z",
+               "--pretty=tformat:{}".format("%x00".join(log_format))] + revisions
+    if stdin_revisions is not None:
+        stdin = tempfile.TemporaryFile()
+        stdin.write("".join(r + "\n" for r in stdin_revisions).encode('ascii'))
+        stdin.seek(0)
+        command.append("--stdin")
 
-        for line in lines_in_command(
-            "git rev-list refs/tags/{} ^refs/tags/{}".format(pair[0], pair[1])):
+    proc = subprocess.Popen(
+        command,
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    if stdin is not None:
+        stdin.close()
+
+    fields = []
+    pending = b''
+    for chunk in iter(lambda: proc.stdout.read(chunk_size), b''):
+        tokens = (pending + chunk).split(b'\0')
+        pending = tokens.pop()
+        for token in tokens:
+            fields.append(token.decode('utf-8', 'ignore'))
+            if len(fields) == nfields:
+                yield strip_fields(fields) if stripped else fields
+                fields = []
+
+    proc.stdout.close()
+    if proc.wait() != 0:
+        print("E: {}".format(proc.stderr.read().decode('utf-8', 'ignore')))
+        raise SystemExit(1)
+    proc.stderr.close()
+
+
+def git_listed_commits(shas, stripped=False):
+    '''
+    yields the fields of every commit in shas, in order
+    '''
+    if not shas:
+        return
+    for fields in git_pretty_commits(["--no-walk=unsorted"], stdin_revisions=shas):
+        yield strip_fields(fields) if stripped else fields
+
+
+def git_uncached_delta_commits(i, pair, commit_graph=None):
+    if commit_graph is not None:
+        return git_listed_commits(commit_graph.delta(i), stripped=True)
+    return git_pretty_commits(
+        ["refs/tags/{}".format(pair[0]), "^refs/tags/{}".format(pair[1])],
+        stripped=True)
+
+
+def git_delta_commits(i, pair, cache=None, commit_graph=None, tips=None):
+    '''
+    yields the stripped fields of every commit in the i'th pair's delta,
+    through the cache when there is one. tips maps the tags to their
+    commit SHAs, the cache's keys.
+    '''
+    if cache is None:
+        return git_uncached_delta_commits(i, pair, commit_graph)
+    return cache.commits(
+        tips[pair[0]], tips[pair[1]],
+        lambda: git_uncached_delta_commits(i, pair, commit_graph))
+
+
+def print_delta(pair, commits, formatter):
+    formatter.section(pair, commits)
+
+
+def delta_results(indexed_pairs, cache=None, commit_graph=None, jobs=1, tips=None):
+    '''
+    yields (pair, commits, error) for every (i, pair) in indexed_pairs, in
+    order. with jobs > 1 the deltas are computed by a pool of workers, and
+    each is yielded as soon as it and everything before it is done; a
+    failed pair is yielded with its error instead of stopping the others.
+    '''
+    if jobs <= 1:
+        for i, pair in indexed_pairs:
+            yield pair, git_delta_commits(i, pair, cache, commit_graph, tips), None
+        return
+
+    def compute(i, pair):
+        return list(git_delta_commits(i, pair, cache, commit_graph, tips))
+
+    def result(pending):
+        pair, future = pending
+        try:
+            return pair, future.result(), None
+        except BaseException as e:
+            return pair, None, e
+
+    # only keep a window of sections in flight, so a slow early pair
+    # doesn't leave the whole report buffered in memory.
+    window = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        for i, pair in indexed_pairs:
+            window.append((pair, pool.submit(compute, i, pair)))
+            while len(window) > 2*jobs or (window and window[0][1].done()):
+                yield result(window.popleft())
+        while window:
+            yield result(window.popleft())
+
+
+def report_delta_error(pair, error):
+    print("E: delta between {} ==> {} failed: {!r}".format(pair[0], pair[1], error),
+          file=sys.stderr)
+
+
+def git_deltas(git_tags, formatter, cache=None, graph=False, jobs=1):
+    '''
+    print the delta of every consecutive tag pair, in tag order. returns
+    the number of pairs that failed.
+    '''
+    pairs = list_pairs(list(git_tags))
+    tips = None
+    if cache is not None:
+        tips = git_tag_commits(git_tags)
+    commit_graph = None
+    if graph and (cache is None or not all(
+            cache.lookup(tips[a], tips[b]) for a, b in pairs)):
+        commit_graph = CommitGraph(git_tags)
+
+    failures = 0
+    formatter.begin()
+    for pair, commits, error in delta_results(
+            list(enumerate(pairs)), cache, commit_graph, jobs, tips):
+        if error is not None:
+            report_delta_error(pair, error)
+            failures += 1
+            continue
+        print_delta(pair, commits, formatter)
+        formatter.flush()
+
+    return failures
+
+
+def git_tag_commits(tags):
+    '''
+    returns a dict of tag => commit SHA, from a single git rev-parse
+    '''
+    shas = list(lines_in_command(
+        ["git", "rev-parse"] +
+        ["refs/tags/{}^{{commit}}".format(tag) for tag in tags]))
+    return dict(zip(tags, shas))
+
+
+def delta_hash(pair, tips, format_name):
+    '''
+    a pair's delta only depends on the commits its tags point to, so this
+    hash changes exactly when its section has to be regenerated.
+    '''
+    key = [format_name, LOG_FORMAT,
+           pair[0], tips.get(pair[0]), pair[1], tips.get(pair[1])]
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def read_incremental_state(state_path, format_name, output):
+    '''
+    returns {(from, to): (from sha, to sha, hash)} of the sections the last
+    run put in output, or {} when there was none, it can't be read, or it
+    was written for another format, log format or output.
+    '''
+    try:
+        with io.open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or \
+            state.get("format") != format_name or \
+            state.get("log_format") != LOG_FORMAT or \
+            state.get("output") != os.path.abspath(output):
+        return {}
+    return dict(((entry[0], entry[1]), tuple(entry[2:5]))
+                for entry in state.get("pairs", []) if len(entry) == 5)
+
+
+def git_incremental_deltas(
+        git_tags, format_name, output, cache=None, graph=False, jobs=1):
+    '''
+    write the deltas report to output, only computing the tag pairs that
+    are new or whose tags moved since the last run.
+
+    every rendered section is kept in output.sections/<hash>, and
+    output.state lists the pairs, the commits their tags pointed to and
+    the hashes that make up output. a pair is only reused when the state
+    was written for the same format and output and its tags still point
+    to the same commits. the report is reassembled from the sections and
+    replaced atomically. returns the number of pairs that failed.
+    '''
+    state_path = output + ".state"
+    sections_dir = output + ".sections"
+    if not os.path.isdir(sections_dir):
+        os.makedirs(sections_dir)
+
+    tips = git_tag_commits(git_tags)
+    pairs = list_pairs(list(git_tags))
+    hashes = [delta_hash(pair, tips, format_name) for pair in pairs]
+    section_path = lambda h: os.path.join(sections_dir, h)
+    state_entry = lambda i: (tips.get(pairs[i][0]), tips.get(pairs[i][1]), hashes[i])
+
+    previous = read_incremental_state(state_path, format_name, output)
+    stale = [(i, pair) for i, pair in enumerate(pairs)
+             if previous.get(tuple(pair)) != state_entry(i) or
+             not os.path.exists(section_path(hashes[i]))]
+
+    commit_graph = None
+    if graph and stale:
+        commit_graph = CommitGraph(git_tags)
+
+    failed = set()
+    for (i, _), (pair, commits, error) in zip(
+            stale, delta_results(stale, cache, commit_graph, jobs, tips)):
+        if error is not None:
+            report_delta_error(pair, error)
+            failed.add(i)
+            continue
+        tmp = section_path(hashes[i]) + ".tmp"
+        with io.open(tmp, 'w', encoding='utf-8', newline='') as section:
+            make_formatter(format_name, section).section(pair, commits)
+        os.replace(tmp, section_path(hashes[i]))
+
+    reported = [i for i in range(len(pairs)) if i not in failed]
+
+    tmp = output + ".tmp"
+    with io.open(tmp, 'w', encoding='utf-8', newline='') as out:
+        make_formatter(format_name, out).begin()
+        for i in reported:
+            with io.open(section_path(hashes[i]), 'r', encoding='utf-8',
+                         newline='') as section:
+                shutil.copyfileobj(section, out)
+    os.replace(tmp, output)
+
+    tmp = state_path + ".tmp"
+    with io.open(tmp, 'w', encoding='utf-8') as state:
+        json.dump({"format": format_name,
+                   "log_format": LOG_FORMAT,
+                   "output": os.path.abspath(output),
+                   "pairs": [list(pairs[i]) + list(state_entry(i)) for i in reported]},
+                  state, indent=1)
+    os.replace(tmp, state_path)
+
+    # sections of pairs that are gone (or were overridden) are dropped
+    keep = set(hashes[i] for i in reported)
+    for name in os.listdir(sections_dir):
+        if name not in keep:
+            os.remove(section_path(name))
 
-            formatter.out("row_begin")
-            rows = git_pretty_commit(line, as_list=True, stripped=True, delim="\t")
-            for row in rows:
-                print("{column_begin}{:20}{column_end}".format(
-                    row,
-                    **formatter.table), end=' ')
-            print()
-            formatter.out("row_end")
+    print("{} of {} tag pair deltas computed, {} reused"
+          .format(len(stale) - len(failed), len(pairs), len(pairs) - len(stale)),
+          file=sys.stderr)
+    return len(failed)
 
-        formatter.out("table_end")
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Parse arguments')
-    parser.add_argument('--format', type=str, default='text')
+    parser.add_argument('--format', type=str, default='text',
+                        choices=sorted(list(FORMATS.keys()) + ['csv', 'json']))
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help='keep the commits of every delta in a cache and '
+                             'reuse them for tag pairs that did not move')
+    parser.add_argument('--cache-file', type=str, default=None,
+                        help='commit metadata cache (default in the git dir)')
+    parser.add_argument('--cache-size', type=int, default=CACHE_MAX_ENTRIES,
+                        help='maximum number of cached commits, over all deltas')
+    parser.add_argument('--graph', action='store_true', default=False,
+                        help='compute all deltas from one in-memory commit graph')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='compute up to this many tag pair deltas at once')
+    parser.add_argument('--output', type=str, default=None,
+                        help='write the report to this file instead of stdout')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='only compute tag pairs that changed since the '
+                             'last run with the same --output')
     parser.add_argument('action', metavar='action', type=str, nargs=1)
     args = parser.parse_args(sys.argv[1:])
 
     if args.action[0] == 'check':
         git_check_repo([UPSTREAM_TAG_SCHEME])
     elif args.action[0] == 'upstream-deltas':
-        git_deltas(
-            git_checked_tag_list(UPSTREAM_TAG_SCHEME)[0],
-            formatter=Formatter(FORMATS[args.format]))
+        cache = None
+        if args.cache:
+            cache = CommitCache(
+                args.cache_file or git_default_cache_path(),
+                max_entries=args.cache_size)
+        try:
+            if args.incremental:
+                if args.output is None:
+                    print("--incremental needs an --output file", file=sys.stderr)
+                    raise SystemExit(1)
+                failures = git_incremental_deltas(
+                    git_checked_tag_list(UPSTREAM_TAG_SCHEME)[0],
+                    args.format,
+                    args.output,
+                    cache=cache,
+                    graph=args.graph,
+                    jobs=args.jobs)
+            else:
+                if args.output is None:
+                    stream = buffered_stdout()
+                else:
+                    stream = io.open(args.output, 'w', encoding='utf-8',
+                                     newline='', buffering=OUTPUT_BUFFER_SIZE)
+                formatter = make_formatter(args.format, stream)
+                try:
+                    failures = git_deltas(
+                        git_checked_tag_list(UPSTREAM_TAG_SCHEME)[0],
+                        formatter=formatter,
+                        cache=cache,
+                        graph=args.graph,
+                        jobs=args.jobs)
+                finally:
+                    formatter.flush()
+                    if args.output is not None:
+                        stream.close()
+        finally:
+            if cache is not None:
+                cache.close()
+        if failures:
+            print("{} tag pair deltas failed".format(failures), file=sys.stderr)
+            raise SystemExit(1)
     else:
         print("unknown action {}".format(args.action), file=sys.stderr)
@@ -1,16 +1,25 @@
 #!/usr/bin/python
 import apt.debfile
-import traceback
 import argparse
-import operator
 import sys
 import subprocess
-import paramiko
-import signal
 import os
 import re
-import time
 import shutil
+import time
+import procinfo
+import cpupin
+import readiness
+import stages
+import buildcache
+import tempfile
+import tracing
+import throughput
+import results
+import sshsession
+import flowtable
+import socket
+import glob
 
 
 '''
@@ -36,10 +45,12 @@ def fatal_error(message, long_message, exception=None):
 
 GIT_BISECT_GOOD=0
 GIT_BISECT_BAD=1
+# git bisect run's exit code for "can't test this commit"
+GIT_BISECT_SKIP=125
 GIT_BISECT_ABORT=255
 QEMU_PROCESS_NAME='qemu-system-x86_64'
 
-client = None
+guest = None
 config = {
         "imgloc":"/home/me/hlx-gold-small",
         "scripts":"/home/me/scripts/scripts",
@@ -48,6 +59,7 @@ config = {
         "vhostuser_path":"/var/run/openvswitch",
         "cores":"4",
         "core_list":"4,5,6,7",
+        "numa_node":"0",
         "veth_addr":"192.168.122.1/24",
         "veth_name":"myveth",
         "bridge_name":"mgmt-br",
@@ -75,7 +87,7 @@ PACKAGES=[
         'openvswitch-switch']
 
 VM_IP="192.168.122.115"
-VM_PASS="iforgot"
+VM_PASS=os.environ.get("VM_PASS", "iforgot")
 VM_USER="me"
 QEMU_CMD="qemu-system-x86_64"
 QEMU_SCRIPT_CMD="qemu_linux.pl"
@@ -89,48 +101,103 @@ VM_START="perl %(scripts)s/qemu_linux.pl \
     --vhostuser-sock %(vhostuser)s1,00:00:00:00:00:02 \
     --use-hugepage-backend yes \
     --cores 4 \
-    --numa-node 0 \
+    --numa-node %(numa_node)s \
     --core-list %(core_list)s \
     --vhostuser-path %(vhostuser_path)s \
     --background yes" % config
 TESTPMD_CMD="sudo /home/me/testpmd-daemon"
+# prints testpmd's "show port stats all" for the running daemon
+TESTPMD_STATS_CMD="sudo /home/me/testpmd-daemon stats"
 UP_LINKS="ip l set up dev %(veth_name)s0 && ip l set up dev %(veth_name)s1" % config
 BRIDGE="br0"
+# OpenFlow ports cross-connected on BRIDGE
+PORT_PAIRS="2:4,1:3"
+OVS_RUN_DIR="/usr/local/var/run/openvswitch"
+OVSDB_SOCKET=OVS_RUN_DIR + "/db.sock"
+SSH_PORT=22
+SSH_KEEPALIVE=15
+# written to the OVS tree once it is configured, holding the configure key
+BUILD_STAMP=".install-package-configured"
+BUILD_CACHE=os.path.expanduser("~/.cache/install-package/ovs")
+TRACE_DIR=os.path.expanduser("~/.cache/install-package/traces")
+RESULTS_DB=os.path.expanduser("~/.cache/install-package/results.sqlite")
+TESTPMD_PROCESS="testpmd"
+# seconds to wait for each stage to be ready, see wait_ready()
+READY_TIMEOUTS={
+        "vm_shutdown":30,
+        "ovsdb":30,
+        "vswitchd":60,
+        "ssh":300,
+        "testpmd":120,
+        "pmd":120,
+}
 
-class JustAccept(paramiko.MissingHostKeyPolicy):
-    def missing_host_key(self, client, hostname, key):
-        return
+def wait_ready(description, probe, stage, fatal=()):
+    '''
+    Wait for probe to pass, with backoff, for up to the stage's timeout.
+    '''
+    status("Wait for %s" % description)
+    waited = readiness.wait_for(description, probe, READY_TIMEOUTS[stage], fatal=fatal)
+    success("%s ready after %.1fs" % (description, waited))
+
+def ssh_port_open():
+    try:
+        return readiness.tcp_port_open(VM_IP, SSH_PORT)
+    except socket.error:
+        return False
+
+def ssh_logged_in():
+    guest.ensure_connected()
+    return True
+
+def testpmd_running():
+    return guest.run("pgrep %s" % TESTPMD_PROCESS, echo=False).status == 0
+
+def ovsdb_ready():
+    return readiness.unix_socket_accepts(OVSDB_SOCKET)
+
+def vswitchd_ready():
+    return any(readiness.unix_socket_accepts(path) for path in
+               glob.glob(os.path.join(OVS_RUN_DIR, 'ovs-vswitchd.*.ctl')))
 
 def stop_vm(args):
-    global client
     '''
     Stop the virtual machine. Try to first gracefully shutdown
     by SSHing into it. If that doesn't work kill all qemu processes.
     '''
-    if client is None:
-        start_client()
+    logged_in = False
+    if ssh_port_open():
+        try:
+            logged_in = ssh_logged_in()
+        except sshsession.ERRORS as e:
+            print("Unable to SSH to the VM: %r" % e)
 
-    if client is not None:
+    if logged_in:
         print("Shutting down client")
-        client.exec_command("sudo shutdown -P")
-        time.sleep(2)
-
-    out = subprocess.check_output(["ps", "--no-headers", "-e", "-o", "cmd:80,pid"])
-    for signal_send in (signal.SIGINT, signal.SIGKILL):
-        for line in out.split('\n'):
-            if line.find(QEMU_CMD) != -1 or line.find(QEMU_SCRIPT_CMD) != -1:
-                pid = int(re.split(r"\s+", line)[-1])
-                print("Killing %d\n" % pid)
-                os.kill(pid, signal_send)
+        # takes the connection down with it
+        guest.start("sudo shutdown -P")
+        try:
+            wait_ready("VM shutdown",
+                lambda: readiness.processes_gone(names=(QEMU_PROCESS_NAME,)),
+                'vm_shutdown')
+        except readiness.NotReady as e:
+            print("%s, killing it" % e)
+
+    processes = procinfo.find_processes(patterns=(QEMU_CMD, QEMU_SCRIPT_CMD))
+    for process in processes:
+        print("Killing %d\n" % process.pid)
+    left = procinfo.kill_and_wait(processes)
+    if left:
+        print("Still running after SIGKILL: %s" % left)
     cmds = [
             'ip l del mgmt-br',
             'ip l del myveth0']
     for cmd in cmds:
         try:
-            subprocess.call(cmd, shell=True)
+            tracing.call(cmd, shell=True)
         except Exception as e:
             pass
-    client = None
+    guest.close()
 
 def start_vm(args):
     '''
@@ -138,8 +205,8 @@ def start_vm(args):
     '''
     status("Start VM")
     try:
-        subprocess.check_output(VM_START, shell=True, stderr=subprocess.STDOUT)
-        subprocess.check_output(UP_LINKS, shell=True, stderr=subprocess.STDOUT)
+        tracing.check_output(VM_START, shell=True, stderr=subprocess.STDOUT)
+        tracing.check_output(UP_LINKS, shell=True, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as e:
         print("Failed call:\n%s\n" % e.cmd)
         print("Output:\n%s\n" % e.output)
@@ -147,113 +214,56 @@ def start_vm(args):
     else:
         success("Start VM")
 
-def yield_lines_from_process(cmd, shell=False):
-    output = subprocess.check_output(cmd, shell=shell)
-    for line in output.split('\n'):
-        yield line
-
-def get_ps_list(fields, taskname=None):
-    li = ['ps', '--no-headers', '-L']
-
-    if taskname is not None:
-        li.extend(['-C', taskname])
-    else:
-        li.append('-e')
-
-    li.append('-o')
-    li.append(','.join(fields))
-    return li
-
-
 def taskset_vm(args):
-    matches = []
+    '''
+    Pin each vCPU thread of the VM to a core of its own from core_list
+    on the VM's NUMA node, away from the PMD cores and their siblings.
+    '''
     status("Taskset VM")
-    class PSLine:
-        def __init__(self, line):
-            splits = re.split(r'\s+', line)
-            if len(splits) != 4:
-                raise RuntimeError("Not enough fields in PS split, got: %s" % line)
-            self.comm = splits[0]
-            self.pid = int(splits[1])
-            self.psr = int(splits[2])
-            hours,mins,secs = map(int, splits[3].split(':'))
-            self.time = float(hours*60*60+mins*60+secs)
-        def __cmp__(self, other):
-            return cmp(self.time, other.time)
-
-        
-    matches = [PSLine(i) for i in 
-            filter(lambda line: True if len(line) > 0 else False, 
-                yield_lines_from_process(
-                    get_ps_list(['comm', 'tid', 'psr', 'time'],
-                    taskname=QEMU_PROCESS_NAME)))]
-
-    matches.sort()
-    matching_process=matches[-1]
-    cores = {}
-
-    for match in matches:
-        if not cores.has_key(match.psr):
-            cores[match.psr] = 0
-        cores[match.psr] += 1
-
-    sorted_cores = sorted(cores.items(), key=operator.itemgetter(1))
-    most_used_core = sorted_cores[-1][0]
-
-    if matching_process.pid != most_used_core:
-        core = most_used_core+1
-        status("Move tid %d to psr %d, hex mask %s"%
-            (matching_process.pid, core, hex(1<<core)))
-        subprocess.check_call(
-            "taskset -p %s %d" % 
-                (hex(1<<core),
-                matching_process.pid),
-             shell=True)
-    else:
-        status("No need to move processor, it's already there")
-
+    try:
+        cpupin.pin_vcpus(QEMU_PROCESS_NAME,
+                         int(config['cores']),
+                         cpupin.parse_cpu_list(config['core_list']),
+                         int(config['numa_node']),
+                         cpupin.parse_cpu_mask(config['pmd_cpu_mask']),
+                         interval=args.pin_interval,
+                         dry_run=args.pin_dry_run)
+    except cpupin.PinningError as e:
+        print("Unable to pin vCPUs: %s" % e)
+        raise
     success("Taskset VM")
 
 
 
-def start_client():
-    global client
-    try:
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(JustAccept())
-        client.connect(hostname=VM_IP,
-                       username=VM_USER,
-                       password=VM_PASS)
-    except paramiko.SSHException as e:
-        print("Caught SSHException starting client: %r" % e)
-        client = None
-        return None
-    except Exception as e:
-        print("Caught Unknown exception: %r" % e)
-        traceback.print_exc(file=sys.stdout)
-        client = None
-        return None
+def open_guest(args):
+    '''
+    The SSH session to the VM. --vm-key, the agent and ~/.ssh keys are
+    tried before the password, which defaults to $VM_PASS.
+    '''
+    return sshsession.SSHSession(VM_IP, VM_USER,
+        password=args.vm_password,
+        key_filename=args.vm_key,
+        port=SSH_PORT,
+        keepalive=SSH_KEEPALIVE,
+        reconnect_timeout=READY_TIMEOUTS['ssh'],
+        label='vm')
 
 def start_testpmd(args):
-    global client
     '''
     Start testpmd on the virtual machine.
     Try to SSH in, exit if that doesn't work.
     '''
     status("Start testpmd")
-    for i in range(1, 10):
-        time.sleep(5)
-        if client is None:
-            status("Starting client...")
-            start_client()
-        else:
-            break
-
-    if client is None:
-        raise RuntimeError("Unable to start testpmd, no SSH connection")
-
-    client.exec_command(TESTPMD_CMD)
+    try:
+        wait_ready("SSH port on %s" % VM_IP, ssh_port_open, 'ssh')
+        wait_ready("SSH login on %s" % VM_IP, ssh_logged_in, 'ssh',
+            fatal=sshsession.FATAL_ERRORS)
+    except readiness.NotReady as e:
+        raise RuntimeError("Unable to start testpmd, no SSH connection: %s" % e)
+
+    # its output is streamed from the session as it runs
+    guest.start(TESTPMD_CMD)
+    wait_ready("testpmd in the VM", testpmd_running, 'testpmd')
     success("Start testpmd")
 
 def stop_ovs(args):
@@ -263,27 +273,79 @@ def stop_ovs(args):
     status("Stop OVS")
     cmd = "%(ovs_ctl)s stop" % config
     try:
-        subprocess.check_output(cmd, shell=True)
+        tracing.check_output(cmd, shell=True)
     except subprocess.CalledProcessError as e:
         print("Unable to stop OVS w/ %s" % cmd)
         print("output %s" % e.output)
     else:
         success("Stop OVS")
-    output = subprocess.check_output(["ps", "-e", "-o", "cmd,pid", "--no-headers"])
-    for line in output.split('\n'):
-        if line.find('ovsdb-server') != -1 or line.find('ovs-vswitchd') != -1:
-            status("Kill process %s" % line)
-            pid = int(re.split(r'\s+', line)[-1])
-            os.kill(pid, signal.SIGINT)
+    processes = procinfo.find_processes(names=('ovsdb-server', 'ovs-vswitchd'))
+    for process in processes:
+        status("Kill process %d %s" % (process.pid, ' '.join(process.cmdline)))
+    left = procinfo.kill_and_wait(processes)
+    if left:
+        print("Still running after SIGKILL: %s" % left)
+
 
+def ovs_patch_file():
+    if config['internal_dpdk']:
+        return "../%(internal_git_patch)s" % config
+    return "../%(external_git_patch)s" % config
+
+def ovs_configure_key():
+    '''
+    key of everything the configured tree depends on besides the sources
+    '''
+    with open(ovs_patch_file(), 'rb') as f:
+        patch = f.read()
+    return buildcache.build_key(patch,
+                                config['extra_cflags'],
+                                config['with_dpdk'],
+                                config['internal_dpdk'])
+
+def ovs_build_key():
+    '''
+    key of an installed build: the source tree and the configure key
+    '''
+    tree = tracing.check_output(["git", "rev-parse", "HEAD^{tree}"]).strip()
+    return buildcache.build_key(tree, ovs_configure_key())
+
+def ovs_configured():
+    '''
+    the tree is configured the way it would be now
+    '''
+    try:
+        with open(BUILD_STAMP) as f:
+            return f.read().strip() == ovs_configure_key()
+    except IOError:
+        return False
+
+def open_build_cache(args):
+    if args.no_build_cache:
+        return None
+    return buildcache.BuildCache(args.build_cache,
+                                 max_bytes=args.build_cache_size*1024*1024)
 
 def build_ovs(args):
     '''
-    build openvswitch
+    build openvswitch, or restore an identical earlier build from the
+    build cache. With --incremental-build an already configured tree is
+    only patched and made again.
     '''
     if args.no_build_ovs:
         status("Skip Build OVS")
         return
+
+    cache = open_build_cache(args)
+    key = None
+    if cache is not None:
+        key = ovs_build_key()
+        if cache.get(key) is not None:
+            status("Restore OVS build %s from cache" % key[:12])
+            cache.restore(key)
+            success("Build OVS from cache")
+            return
+
     git_cmds = [
             "git clean -xdf",
             "git checkout -f"]
@@ -296,31 +358,50 @@ def build_ovs(args):
         patch_cmds.extend([
             "patch -p1 < ../%(external_git_patch)s" % config])
 
-    make_cmds = [
+    configure_cmds = [
             "./boot.sh",
             "CFLAGS=\"%(extra_cflags)s\" ./configure --with-dpdk=%(with_dpdk)s" % config,
-            "make -j",
-            "make install"]
+            "echo %s > %s" % (ovs_configure_key(), BUILD_STAMP)]
+
+    staging = None
+    make_cmds = ["make -j"]
+    if cache is not None:
+        staging = tempfile.mkdtemp(prefix='ovs-install-')
+        make_cmds.append("make install DESTDIR=%s" % staging)
+    else:
+        make_cmds.append("make install")
 
     cmds = []
-    for li in (git_cmds, patch_cmds, make_cmds):
-        cmds.extend(li)
+    if args.incremental_build and ovs_configured():
+        status("Reuse configured OVS tree")
+        for li in (patch_cmds, make_cmds):
+            cmds.extend(li)
+    else:
+        for li in (git_cmds, patch_cmds, configure_cmds, make_cmds):
+            cmds.extend(li)
 
     status("Building OVS")
     try:
         for cmd in cmds:
-            subprocess.check_output(cmd, shell=True)
+            tracing.check_output(cmd, shell=True)
             success(cmd)
+        if cache is not None:
+            cache.put(key, staging)
+            cache.restore(key)
     except subprocess.CalledProcessError as e:
         print("failed to build OVS with command %s" % cmd)
         print("output:\n%s\n" % e.output)
         raise e
     else:
         success("Build OVS")
+    finally:
+        if staging is not None:
+            shutil.rmtree(staging)
 
 def clean_ovs(args):
     '''
-    clean openvswitch
+    clean openvswitch. With --incremental-build the configured tree and
+    build outputs are kept, only the patches are taken back out.
     '''
     status("Clean OVS")
     git_cmds = [
@@ -336,16 +417,25 @@ def clean_ovs(args):
         patch_cmds.extend([
             "patch -p1 -R < ../%(external_git_patch)s" % config])
 
-    make_cmds = [
-            "make uninstall",
-            "make clean"]
+    make_cmds = []
+    cache = open_build_cache(args)
+    if cache is not None and cache.uninstall():
+        success("Uninstall cached OVS build")
+    else:
+        make_cmds.append("make uninstall")
+    if not args.incremental_build:
+        make_cmds.append("make clean")
 
     cmds = []
-    for li in (make_cmds, patch_cmds, git_cmds):
-        cmds.extend(li)
+    if args.incremental_build:
+        for li in (make_cmds, patch_cmds):
+            cmds.extend(li)
+    else:
+        for li in (make_cmds, patch_cmds, git_cmds):
+            cmds.extend(li)
     for cmd in cmds:
         try:
-            subprocess.check_output(cmd, shell=True)
+            tracing.check_output(cmd, shell=True)
         except subprocess.CalledProcessError as e:
             print("failed to clean OVS with command %s" % cmd)
             print("output:\n%s\n" % e.output)
@@ -356,19 +446,23 @@ def clean_ovs(args):
         shutil.rmtree('/usr/local/var/run/openvswitch')
 
 def setup_ovs_flows(args):
-    status("Add flows")
-    cmds = ["ovs-ofctl del-flows %s" % BRIDGE]
-    ports = [ ('2', '4'), ('1', '3')]
-    for port_pair in ports:
-        for pair in [(0, 1), (1, 0)]:
-            cmds.append("ovs-ofctl add-flow %s in_port=%s,action:output_port=%s" % (BRIDGE, port_pair[pair[0]], port_pair[pair[1]]))
+    '''
+    Replace the bridge's flows with the port pair cross-connect, plus
+    --stress-flows more specific ones, in one transaction, and check the
+    bridge has exactly those.
+    '''
+    flows = flowtable.flow_table(args.port_pairs, args.stress_flows)
+    status("Add %d flows" % len(flows))
+    path = flowtable.write_flows(flows)
     try:
-        for cmd in cmds:
-            subprocess.check_output(cmd, shell=True)
-    except subprocess.CalledProcessError as e:
-        print("Failed to add flow %s" % cmd)
-    else:
-        success("Add flows")
+        flowtable.install(BRIDGE, path)
+        flowtable.verify(BRIDGE, path)
+    except flowtable.FlowError as e:
+        print(e)
+        print("Flows left in %s" % path)
+        raise
+    os.remove(path)
+    success("Add flows")
 
 def start_ovs(args):
     '''
@@ -376,20 +470,162 @@ def start_ovs(args):
     '''
     status("Start OVS")
     cmds = [
-        "ovsdb-server %(ovsdb_server_arguments)s" % config,
-        "ovs-vsctl set Open_vSwitch . other_config:pmd-cpu-mask=%(pmd_cpu_mask)s" % config,
-        "ovs-vswitchd %(ovs_vswitchd_arguments)s" % config,
-        "ovs-vsctl --no-wait init"]
+        ("ovsdb-server %(ovsdb_server_arguments)s" % config,
+            ("ovsdb-server socket", ovsdb_ready, 'ovsdb')),
+        ("ovs-vsctl set Open_vSwitch . other_config:pmd-cpu-mask=%(pmd_cpu_mask)s" % config,
+            None),
+        ("ovs-vswitchd %(ovs_vswitchd_arguments)s" % config,
+            ("ovs-vswitchd control socket", vswitchd_ready, 'vswitchd')),
+        ("ovs-vsctl --no-wait init",
+            None)]
     try:
-        for cmd in cmds:
-            subprocess.check_output(cmd, shell=True)
+        for cmd, ready in cmds:
+            tracing.check_output(cmd, shell=True)
+            if ready is not None:
+                wait_ready(*ready)
     except subprocess.CalledProcessError as e:
         print("failed to start OVS command %s" % cmd)
-        print("output:\n%s\n" % cmd.output)
+        print("output:\n%s\n" % e.output)
+        raise
+    except readiness.NotReady as e:
+        print("failed to start OVS: %s" % e)
+        raise
     else:
         success("Start OVS")
 
 
+def wait_pmd(args):
+    '''
+    wait for the OVS PMD threads to be polling
+    '''
+    wait_ready("OVS PMD threads", readiness.pmd_threads_spinning, 'pmd')
+
+
+def guest_port_stats():
+    result = guest.run(TESTPMD_STATS_CMD, echo=False)
+    if result.status != 0:
+        raise throughput.MeasurementError("%s failed: %s" %
+            (TESTPMD_STATS_CMD, result.stderr))
+    return result.stdout
+
+def pmd_stats():
+    return tracing.check_output("ovs-appctl dpif-netdev/pmd-stats-show",
+        shell=True).decode('utf-8', 'replace')
+
+def clear_pmd_stats():
+    tracing.check_output("ovs-appctl dpif-netdev/pmd-stats-clear", shell=True)
+
+VERDICT_CODES={
+        throughput.GOOD:GIT_BISECT_GOOD,
+        throughput.BAD:GIT_BISECT_BAD,
+        throughput.SKIP:GIT_BISECT_SKIP,
+}
+
+def results_setup():
+    '''
+    what, besides the commit, a throughput result depends on
+    '''
+    return (config['extra_cflags'],
+            "%s%s" % (config['with_dpdk'],
+                      " (internal)" if config['internal_dpdk'] else ""),
+            "cores %(core_list)s node %(numa_node)s pmd %(pmd_cpu_mask)s" % config)
+
+def git_commit(rev="HEAD"):
+    return tracing.check_output(["git", "rev-parse", "%s^{commit}" % rev]).strip().decode('utf-8')
+
+def open_results_db(args):
+    directory = os.path.dirname(args.results_db)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    return results.ResultsDB(args.results_db)
+
+def judge(args, db, commit):
+    '''
+    The verdict for commit from its stored trials: against the reference
+    commit's trials with --reference, else against --baseline-mpps.
+    '''
+    setup = results_setup()
+    if args.reference is not None:
+        reference = [mpps for mpps, _ in db.trials(git_commit(args.reference), setup)]
+        if not reference:
+            print("No trials of reference %s with this setup" % args.reference)
+            return throughput.SKIP
+    else:
+        reference = [args.baseline_mpps]
+    return results.judge(db.trials(commit, setup), reference,
+        args.noise_margin, args.max_spread)
+
+def measure_throughput(args):
+    '''
+    Measure the forwarding rate --warmup + --trials times, store the
+    trials and judge them. Returns the git bisect exit code; anything
+    going wrong while measuring is a skip.
+    '''
+    status("Measure throughput, %d trials of %ds" % (args.trials, args.measure_window))
+    db = open_results_db(args)
+    try:
+        commit = git_commit()
+        ssh_logged_in()
+        for trial in range(args.warmup + args.trials):
+            measurement = throughput.measure(guest_port_stats,
+                pmd_stats=pmd_stats,
+                clear_pmd_stats=clear_pmd_stats,
+                window=args.measure_window,
+                interval=args.measure_interval)
+            if trial < args.warmup:
+                status("Warm-up trial %d: %s" % (trial + 1, measurement))
+                continue
+            db.add(commit, results_setup(), measurement)
+            status("Trial %d: %s" % (trial - args.warmup + 1, measurement))
+    except (throughput.MeasurementError, subprocess.CalledProcessError,
+            readiness.NotReady) + sshsession.ERRORS as e:
+        print("Unable to measure throughput: %s" % e)
+        db.close()
+        return GIT_BISECT_SKIP
+    verdict = judge(args, db, commit)
+    db.close()
+    done("Throughput %s for %s" % (verdict, commit))
+    return VERDICT_CODES[verdict]
+
+def measured_verdict(args):
+    '''
+    The verdict for HEAD when it already has --trials trials stored, else
+    None.
+    '''
+    db = open_results_db(args)
+    try:
+        commit = git_commit()
+        if len(db.trials(commit, results_setup())) < args.trials:
+            return None
+        verdict = judge(args, db, commit)
+        done("Throughput %s for %s, from %d stored trials" %
+            (verdict, commit, len(db.trials(commit, results_setup()))))
+        return VERDICT_CODES[verdict]
+    finally:
+        db.close()
+
+def print_history(args):
+    db = open_results_db(args)
+    print("%-12s %6s %9s %19s  %s" % ('commit', 'trials', 'Mpps', 'interval', 'measured'))
+    for commit, trials, mpps, low, high, first in db.history(results_setup()):
+        print("%-12s %6d %9.3f %9.3f-%-9.3f  %s" % (commit[:12], trials, mpps, low, high,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(first))))
+    db.close()
+
+def unattended(args):
+    '''
+    there is a baseline to judge against, so no one is asked
+    '''
+    return args.baseline_mpps is not None or args.reference is not None
+
+def get_verdict(args):
+    '''
+    measure unattended when there is a baseline, ask otherwise
+    '''
+    if not unattended(args):
+        return get_input(args)
+    return measure_throughput(args)
+
 def get_input(args):
     while True:
         user_input = raw_input("[Gg]ood/[Bb]ad/[Ss]kip/[Aa]bort? > ")
@@ -455,40 +691,194 @@ def main(args):
         type=bool,
         default=False,
         help='Don\'t stop or start VM')
+    parser.add_argument('--pin-interval',
+        type=float,
+        default=2.0,
+        help='Seconds to sample qemu threads for when finding vCPUs')
+    parser.add_argument('--pin-dry-run',
+        action='store_true',
+        default=False,
+        help='Print the vCPU placement without pinning')
+    parser.add_argument('--build-cache',
+        type=str,
+        default=BUILD_CACHE,
+        help='Directory to keep installed OVS builds in')
+    parser.add_argument('--build-cache-size',
+        type=int,
+        default=buildcache.DEFAULT_MAX_BYTES // (1024*1024),
+        help='Build cache size in MiB')
+    parser.add_argument('--no-build-cache',
+        action='store_true',
+        default=False,
+        help='Always build OVS, don\'t keep builds')
+    parser.add_argument('--incremental-build',
+        action='store_true',
+        default=False,
+        help='Keep the configured OVS tree between runs and only make again')
+    parser.add_argument('--baseline-mpps',
+        type=float,
+        default=None,
+        help='Judge the commit by throughput against this rate instead '
+            'of asking')
+    parser.add_argument('--noise-margin',
+        type=float,
+        default=0.03,
+        help='Relative drop below the baseline still counted as good')
+    parser.add_argument('--max-spread',
+        type=float,
+        default=0.05,
+        help='Skip the commit when the rates of the intervals differ '
+            'by more than this, relative to their mean')
+    parser.add_argument('--measure-window',
+        type=float,
+        default=30.0,
+        help='Seconds to measure throughput for')
+    parser.add_argument('--measure-interval',
+        type=float,
+        default=5.0,
+        help='Seconds between throughput samples')
+    parser.add_argument('--reference',
+        type=str,
+        default=None,
+        help='Judge the commit against the stored trials of this commit '
+            'instead of --baseline-mpps')
+    parser.add_argument('--trials',
+        type=int,
+        default=1,
+        help='Throughput trials per build')
+    parser.add_argument('--warmup',
+        type=int,
+        default=0,
+        help='Throughput trials to run and discard before the real ones')
+    parser.add_argument('--results-db',
+        type=str,
+        default=RESULTS_DB,
+        help='SQLite database of throughput trials')
+    parser.add_argument('--remeasure',
+        action='store_true',
+        default=False,
+        help='Measure even if the commit already has enough trials stored')
+    parser.add_argument('--history',
+        action='store_true',
+        default=False,
+        help='Print the throughput of every commit measured with this '
+            'setup and exit')
+    parser.add_argument('--trace-dir',
+        type=str,
+        default=TRACE_DIR,
+        help='Directory to write each run\'s timing summary and Chrome trace to')
+    parser.add_argument('--trace-aggregate',
+        type=str,
+        nargs='+',
+        default=None,
+        metavar='SUMMARY',
+        help='Print per-stage percentiles over run summaries and exit')
+    parser.add_argument('--port-pairs',
+        type=flowtable.parse_port_pairs,
+        default=flowtable.parse_port_pairs(PORT_PAIRS),
+        metavar='A:B,...',
+        help='OpenFlow ports to cross-connect, default %s' % PORT_PAIRS)
+    parser.add_argument('--stress-flows',
+        type=int,
+        default=0,
+        help='Number of extra flows, each matching one destination '
+            'address, to install above the cross-connect')
+    parser.add_argument('--vm-key',
+        type=str,
+        default=None,
+        help='Private key to log in to the VM with')
+    parser.add_argument('--vm-password',
+        type=str,
+        default=VM_PASS,
+        help='Password to log in to the VM with, defaults to $VM_PASS')
+    parser.add_argument('--ready-timeout',
+        action='append',
+        default=[],
+        metavar='STAGE=SECONDS',
+        help='Override a readiness timeout, stages: %s' %
+            ', '.join(sorted(READY_TIMEOUTS)))
 
     parsed_args = parser.parse_args(args)
+    if parsed_args.trace_aggregate:
+        print(tracing.format_aggregate(
+            tracing.aggregate(parsed_args.trace_aggregate)))
+        return
+    for timeout in parsed_args.ready_timeout:
+        stage, _, seconds = timeout.partition('=')
+        if stage not in READY_TIMEOUTS:
+            parser.error("unknown readiness stage %s" % stage)
+        READY_TIMEOUTS[stage] = float(seconds)
     if parsed_args.dpdk !=  config['with_dpdk']:
         config['with_dpdk'] = parsed_args.dpdk
         config['internal_dpdk'] = False
     if parsed_args.extra_cflags:
         config['extra_cflags'] = parsed_args.extra_cflags
 
-    if not parsed_args.no_start_vm:
-        stop_vm(parsed_args)
-    if not parsed_args.no_start_ovs:
-        stop_ovs(parsed_args)
-    if not parsed_args.no_build_ovs:
-        clean_ovs(parsed_args)
-        build_ovs(parsed_args)
-    if not parsed_args.no_start_ovs:
-        start_ovs(parsed_args)
-
-    setup_ovs_flows(parsed_args)
-
-    if not parsed_args.no_start_vm:
-        start_vm(parsed_args)
-        start_testpmd(parsed_args)
-
-    status("Sleep after VM start/testpmd start")
-    time.sleep(60)
-    done("Sleep after VM start")
-    taskset_vm(parsed_args)
-    code = get_input(parsed_args)
-
-    if not parsed_args.no_start_ovs:
-        stop_ovs(parsed_args)
-    if not parsed_args.no_build_ovs:
-        clean_ovs(parsed_args)
+    if parsed_args.history:
+        print_history(parsed_args)
+        return
+    if unattended(parsed_args) and not parsed_args.remeasure:
+        code = measured_verdict(parsed_args)
+        if code is not None:
+            sys.exit(code)
+
+    global guest
+    guest = open_guest(parsed_args)
+
+    # The old OVS is stopped, and the new one cleaned and built, while
+    # the VM shuts down. The new OVS only starts once the old VM is gone.
+    pipeline = [
+        stages.Stage('stop_vm', stop_vm,
+            enabled=not parsed_args.no_start_vm),
+        stages.Stage('stop_ovs', stop_ovs,
+            enabled=not parsed_args.no_start_ovs),
+        stages.Stage('clean_ovs', clean_ovs,
+            after=['stop_ovs'],
+            enabled=not parsed_args.no_build_ovs),
+        stages.Stage('build_ovs', build_ovs,
+            after=['clean_ovs'],
+            enabled=not parsed_args.no_build_ovs),
+        stages.Stage('start_ovs', start_ovs,
+            after=['stop_vm', 'stop_ovs', 'build_ovs'],
+            enabled=not parsed_args.no_start_ovs),
+        stages.Stage('setup_ovs_flows', setup_ovs_flows,
+            after=['start_ovs']),
+        stages.Stage('start_vm', start_vm,
+            after=['stop_vm', 'setup_ovs_flows'],
+            enabled=not parsed_args.no_start_vm),
+        stages.Stage('start_testpmd', start_testpmd,
+            after=['start_vm'],
+            enabled=not parsed_args.no_start_vm),
+        stages.Stage('wait_pmd', wait_pmd,
+            after=['start_ovs', 'start_testpmd']),
+        stages.Stage('taskset_vm', taskset_vm,
+            after=['wait_pmd']),
+    ]
+    for stage in pipeline:
+        stage.function = tracing.TRACER.stage(stage.name, stage.function)
+    # Under git bisect run an uncaught error would exit 1 and mark the
+    # commit bad; unattended, only a measured verdict is good or bad and
+    # a commit that couldn't be set up or measured is skipped.
+    code = GIT_BISECT_SKIP
+    try:
+        failed = stages.run_stages(pipeline, parsed_args)
+        status("Critical path: %s" % stages.format_critical_path(pipeline))
+        if failed:
+            raise failed[0].error
+        code = tracing.TRACER.stage('verdict', get_verdict)(parsed_args)
+
+        if not parsed_args.no_start_ovs:
+            tracing.TRACER.stage('final_stop_ovs', stop_ovs)(parsed_args)
+        if not parsed_args.no_build_ovs:
+            tracing.TRACER.stage('final_clean_ovs', clean_ovs)(parsed_args)
+    except Exception as e:
+        if not unattended(parsed_args):
+            raise
+        print("ERROR %r, exiting with %d" % (e, code))
+    finally:
+        guest.close()
+        for path in tracing.TRACER.write(parsed_args.trace_dir):
+            status("Wrote %s" % path)
     sys.exit(code)
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+'''
+Process and thread inspection straight from /proc, instead of running and
+parsing ps. Every function takes the proc root to read, so it can be
+pointed at a fake tree.
+'''
+import os
+import time
+import errno
+import signal
+
+PROC_ROOT = '/proc'
+# comm is the executable name cut to TASK_COMM_LEN - 1
+COMM_LEN = 15
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (ValueError, OSError, AttributeError):
+    CLOCK_TICKS = 100
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('utf-8', 'replace')
+
+
+class Stat(object):
+    '''
+    The fields we use from a /proc/<pid>/stat or /proc/<pid>/task/<tid>/stat
+    line. Times are in seconds, start_time in clock ticks since boot.
+    '''
+    def __init__(self, line):
+        # comm is in parentheses and may itself contain spaces and ')'
+        start = line.index('(')
+        end = line.rindex(')')
+        self.id = int(line[:start])
+        self.comm = line[start + 1:end]
+        # fields from 3 (state) on, so field n is at n - 3
+        fields = line[end + 2:].split()
+        self.state = fields[0]
+        self.ppid = int(fields[1])
+        self.utime = float(fields[11]) / CLOCK_TICKS
+        self.stime = float(fields[12]) / CLOCK_TICKS
+        self.start_time = int(fields[19])
+        self.processor = int(fields[36])
+
+    @property
+    def cpu_time(self):
+        return self.utime + self.stime
+
+
+class Process(object):
+    def __init__(self, pid, proc=PROC_ROOT):
+        self.pid = pid
+        self.proc = proc
+        self.path = os.path.join(proc, str(pid))
+        self.stat = Stat(read_file(os.path.join(self.path, 'stat')))
+        self.comm = read_file(os.path.join(self.path, 'comm')).rstrip('\n')
+        self.cmdline = [arg for arg in
+                        read_file(os.path.join(self.path, 'cmdline')).split('\0')
+                        if arg]
+
+    def __repr__(self):
+        return 'Process(%d, %r)' % (self.pid, self.comm)
+
+    def name_is(self, name):
+        return self.comm == name[:COMM_LEN] or \
+            (self.cmdline and os.path.basename(self.cmdline[0]) == name)
+
+    def threads(self):
+        '''
+        Stat of every thread of the process, threads that exit while
+        reading are left out.
+        '''
+        stats = []
+        task = os.path.join(self.path, 'task')
+        for tid in listdir_ids(task):
+            try:
+                stats.append(Stat(read_file(os.path.join(task, str(tid), 'stat'))))
+            except (IOError, OSError):
+                pass
+        return stats
+
+    def alive(self):
+        '''
+        The process still exists and isn't a zombie. A pid that was reused
+        by another process since this one was read doesn't count.
+        '''
+        try:
+            stat = Stat(read_file(os.path.join(self.path, 'stat')))
+        except (IOError, OSError):
+            return False
+        return stat.start_time == self.stat.start_time and stat.state != 'Z'
+
+
+def listdir_ids(path):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def processes(proc=PROC_ROOT):
+    '''
+    Every process in proc, processes that exit while reading are left out.
+    '''
+    found = []
+    for pid in listdir_ids(proc):
+        try:
+            found.append(Process(pid, proc))
+        except (IOError, OSError, ValueError, IndexError):
+            pass
+    return found
+
+
+def find_processes(names=(), patterns=(), proc=PROC_ROOT):
+    '''
+    Processes whose name is one of names or whose command line contains
+    one of patterns. This process is never included.
+    '''
+    me = os.getpid()
+    found = []
+    for process in processes(proc):
+        if process.pid == me:
+            continue
+        cmdline = ' '.join(process.cmdline)
+        if any(process.name_is(name) for name in names) or \
+                any(pattern in cmdline for pattern in patterns):
+            found.append(process)
+    return found
+
+
+def kill_and_wait(processes, signals=(signal.SIGINT, signal.SIGKILL),
+                  timeout=10.0, interval=0.05, kill=os.kill):
+    '''
+    Send each of signals in turn to the processes that are still alive,
+    waiting up to timeout seconds for them to exit before going on to the
+    next one. Returns the processes left alive after the last signal.
+    '''
+    remaining = [p for p in processes if p.alive()]
+    for signal_send in signals:
+        for process in remaining:
+            try:
+                kill(process.pid, signal_send)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+        deadline = time.time() + timeout
+        while True:
+            remaining = [p for p in remaining if p.alive()]
+            if not remaining or time.time() >= deadline:
+                break
+            time.sleep(interval)
+        if not remaining:
+            break
+    return remaining
@@ -0,0 +1,85 @@
+'''
+Wait for things to be ready instead of sleeping for a worst case.
+
+wait_for() polls a probe with exponential backoff until it passes or a
+timeout runs out. The probes here are plain functions returning a bool;
+an exception from a probe counts as not ready yet, unless it is one that
+waiting won't fix.
+'''
+from __future__ import print_function
+import os
+import time
+import socket
+
+import procinfo
+import cpupin
+
+
+class NotReady(RuntimeError):
+    pass
+
+
+def wait_for(description, probe, timeout, initial=0.1, factor=2.0, max_interval=5.0,
+             fatal=()):
+    '''
+    Call probe until it returns true, sleeping initial seconds after the
+    first try and factor times longer after every next one, up to
+    max_interval. Returns the seconds waited, raises NotReady if probe
+    didn't pass within timeout. Exceptions of the fatal types, e.g. a
+    login refused for bad credentials, are raised right away.
+    '''
+    start = time.time()
+    deadline = start + timeout
+    interval = initial
+    last_error = None
+    while True:
+        try:
+            if probe():
+                return time.time() - start
+            last_error = None
+        except fatal:
+            raise
+        except Exception as e:
+            last_error = e
+        now = time.time()
+        if now >= deadline:
+            raise NotReady("%s not ready after %gs%s" % (
+                description, timeout,
+                ", last error: %r" % last_error if last_error else ""))
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * factor, max_interval)
+
+
+def unix_socket_accepts(path):
+    if not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    finally:
+        sock.close()
+
+
+def tcp_port_open(host, port, connect_timeout=1.0):
+    sock = socket.create_connection((host, port), connect_timeout)
+    sock.close()
+    return True
+
+
+def processes_gone(names=(), patterns=(), proc=procinfo.PROC_ROOT):
+    return not procinfo.find_processes(names, patterns, proc)
+
+
+def pmd_threads_spinning(process_name='ovs-vswitchd', min_usage=0.9,
+                         interval=0.2, proc=procinfo.PROC_ROOT):
+    '''
+    The process has PMD threads and they all busy-poll, i.e. use close
+    to a whole cpu each.
+    '''
+    processes = procinfo.find_processes(names=(process_name,), proc=proc)
+    if not processes:
+        return False
+    pmds = [usage for stat, usage in cpupin.sample_threads(processes[0], interval)
+            if stat.comm.startswith('pmd')]
+    return bool(pmds) and min(pmds) >= min_usage
@@ -0,0 +1,146 @@
+'''
+A local SQLite database of throughput trials, and verdicts from them.
+
+Every trial is stored against the commit it measured and the setup it ran
+with: cflags, DPDK variant and core layout. Commits are compared by the
+median of their trials, with a confidence interval for the median from
+order statistics, against a reference commit's trials.
+'''
+from __future__ import division
+import time
+import sqlite3
+
+import throughput
+
+CONFIDENCE = 0.95
+
+
+def binomial_cdf(k, n):
+    '''
+    P(X <= k) for X ~ Binomial(n, 1/2)
+    '''
+    total = 0
+    coefficient = 1
+    for i in range(k + 1):
+        total += coefficient
+        coefficient = coefficient * (n - i) // (i + 1)
+    return total / 2.0 ** n
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def median_interval(values, confidence=CONFIDENCE):
+    '''
+    (low, high) order statistics bounding the median with at least
+    confidence, or the whole range when there are too few values for it.
+    '''
+    values = sorted(values)
+    n = len(values)
+    # [x_k, x_(n-1-k)] covers the median with probability 1 - 2 P(B <= k),
+    # take the narrowest one that still does often enough
+    k = 0
+    while k + 1 <= (n - 1) // 2 and 1 - 2 * binomial_cdf(k + 1, n) >= confidence:
+        k += 1
+    return values[k], values[n - 1 - k]
+
+
+def compare(samples, reference, margin):
+    '''
+    GOOD when the median of samples is within margin of the reference
+    median (or above it), BAD when it is further below and the confidence
+    intervals don't overlap, SKIP when the trials can't tell or one of
+    them forwarded nothing.
+    '''
+    if not samples or not reference or min(samples) <= 0 or min(reference) <= 0:
+        return throughput.SKIP
+    drop = 1 - median(samples) / median(reference)
+    if drop <= margin:
+        return throughput.GOOD
+    if median_interval(samples)[1] < median_interval(reference)[0]:
+        return throughput.BAD
+    return throughput.SKIP
+
+
+def judge(trials, reference, margin, max_spread):
+    '''
+    The verdict for trials, (mpps, spread) as stored, against the
+    reference Mpps values. margin is the relative drop accepted as noise
+    (0.03 for 3%); a trial whose interval rates spread further than
+    max_spread, or that forwarded nothing, can't be judged and makes the
+    verdict SKIP.
+    '''
+    for mpps, spread in trials:
+        if mpps <= 0 or spread is None or spread > max_spread:
+            return throughput.SKIP
+    return compare([mpps for mpps, _ in trials], reference, margin)
+
+
+class ResultsDB(object):
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS trials ("
+                "commit_sha TEXT NOT NULL, "
+                "cflags TEXT NOT NULL, "
+                "dpdk TEXT NOT NULL, "
+                "cores TEXT NOT NULL, "
+                "mpps REAL NOT NULL, "
+                "spread REAL, "
+                "cycles_per_packet REAL, "
+                "time REAL NOT NULL)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS trials_setup "
+                "ON trials (cflags, dpdk, cores, commit_sha)")
+
+    def add(self, commit, setup, measurement):
+        '''
+        setup is (cflags, dpdk, cores)
+        '''
+        spread = measurement.spread
+        with self.db:
+            self.db.execute(
+                "INSERT INTO trials (commit_sha, cflags, dpdk, cores, mpps, "
+                "spread, cycles_per_packet, time) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (commit,) + tuple(setup) + (
+                    measurement.mpps,
+                    spread if spread != float('inf') else None,
+                    measurement.cycles_per_packet,
+                    time.time()))
+
+    def trials(self, commit, setup):
+        '''
+        (mpps, spread) of every trial of commit with setup
+        '''
+        return self.db.execute(
+            "SELECT mpps, spread FROM trials "
+            "WHERE cflags = ? AND dpdk = ? AND cores = ? AND commit_sha = ? "
+            "ORDER BY time", tuple(setup) + (commit,)).fetchall()
+
+    def history(self, setup):
+        '''
+        (commit, trials, median, low, high, first measured) for every
+        commit measured with setup, in the order they were first measured
+        '''
+        rows = self.db.execute(
+            "SELECT commit_sha, mpps, time FROM trials "
+            "WHERE cflags = ? AND dpdk = ? AND cores = ? ORDER BY time",
+            tuple(setup)).fetchall()
+        commits = {}
+        for commit, mpps, when in rows:
+            commits.setdefault(commit, (when, []))[1].append(mpps)
+        history = []
+        for commit, (first, values) in sorted(commits.items(), key=lambda item: item[1][0]):
+            low, high = median_interval(values)
+            history.append((commit, len(values), median(values), low, high, first))
+        return history
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,193 @@
+'''
+One SSH connection to a host, kept alive and reused for every command.
+
+Commands run as channels over the session's transport, their stdout and
+stderr are passed on line by line as they arrive and the exit status is
+returned. A transport that died, e.g. because the guest rebooted, is
+replaced on the next command.
+'''
+from __future__ import print_function
+import time
+import select
+import socket
+import threading
+
+import paramiko
+
+import readiness
+
+BUFSIZE = 32768
+# what a broken or refused connection raises
+ERRORS = (paramiko.SSHException, socket.error, EOFError)
+# what retrying won't fix
+FATAL_ERRORS = (paramiko.AuthenticationException,)
+
+
+class CommandResult(object):
+    def __init__(self, command, status, stdout, stderr):
+        self.command = command
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __repr__(self):
+        return 'CommandResult(%r, %r)' % (self.command, self.status)
+
+
+class LineBuffer(object):
+    '''
+    Collects a stream's output and hands every complete line to on_line.
+    '''
+    def __init__(self, name, on_line):
+        self.name = name
+        self.on_line = on_line
+        self.pending = b''
+        self.chunks = []
+
+    def feed(self, data):
+        self.chunks.append(data)
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.line(line)
+
+    def line(self, line):
+        if self.on_line is not None:
+            self.on_line(self.name, line.decode('utf-8', 'replace').rstrip('\r'))
+
+    def close(self):
+        if self.pending:
+            self.line(self.pending)
+            self.pending = b''
+        return b''.join(self.chunks).decode('utf-8', 'replace')
+
+
+class SSHSession(object):
+    def __init__(self, hostname, username, password=None, key_filename=None,
+                 port=22, keepalive=15, connect_timeout=10, reconnect_timeout=120,
+                 label=None):
+        '''
+        Without password or key_filename the usual keys and the agent are
+        tried. Host keys aren't checked: the guests are throwaway VMs.
+        '''
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.key_filename = key_filename
+        self.port = port
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.reconnect_timeout = reconnect_timeout
+        self.label = label or hostname
+        self.lock = threading.Lock()
+        self.client = None
+
+    def connected(self):
+        transport = self.client.get_transport() if self.client is not None else None
+        return transport is not None and transport.is_active()
+
+    def connect(self):
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname=self.hostname,
+                       port=self.port,
+                       username=self.username,
+                       password=self.password,
+                       key_filename=self.key_filename,
+                       timeout=self.connect_timeout)
+        client.get_transport().set_keepalive(self.keepalive)
+        self.client = client
+
+    def ensure_connected(self, timeout=0):
+        '''
+        Returns the live transport, connecting first if there is none.
+        With a timeout connecting is retried for that long, unless the
+        login is refused.
+        '''
+        with self.lock:
+            if not self.connected():
+                self.disconnect()
+                if timeout:
+                    readiness.wait_for("SSH to %s" % self.label,
+                                       lambda: self.connect() or True,
+                                       timeout, fatal=FATAL_ERRORS)
+                else:
+                    self.connect()
+            return self.client.get_transport()
+
+    def open_channel(self):
+        '''
+        A new session channel; a dead transport is replaced once, waiting
+        up to reconnect_timeout for the host to come back.
+        '''
+        try:
+            return self.ensure_connected().open_session(timeout=self.connect_timeout)
+        except ERRORS:
+            with self.lock:
+                self.disconnect()
+            return self.ensure_connected(self.reconnect_timeout).open_session(
+                timeout=self.connect_timeout)
+
+    def print_line(self, stream, line):
+        print("[%s %s] %s" % (self.label, stream, line))
+
+    def run(self, command, echo=True, on_line=None, timeout=None):
+        '''
+        Run command and wait for it. Every output line is passed to
+        on_line(stream, line), or printed with echo. Returns a
+        CommandResult; raises paramiko.SSHException if the connection is
+        lost or timeout seconds pass first.
+        '''
+        if on_line is None and echo:
+            on_line = self.print_line
+        channel = self.open_channel()
+        stdout = LineBuffer('stdout', on_line)
+        stderr = LineBuffer('stderr', on_line)
+        deadline = time.time() + timeout if timeout else None
+        try:
+            channel.exec_command(command)
+            while True:
+                if channel.recv_ready():
+                    stdout.feed(channel.recv(BUFSIZE))
+                elif channel.recv_stderr_ready():
+                    stderr.feed(channel.recv_stderr(BUFSIZE))
+                elif channel.eof_received and channel.exit_status_ready():
+                    break
+                elif channel.closed:
+                    raise paramiko.SSHException("connection lost running %s" % command)
+                elif deadline is not None and time.time() > deadline:
+                    raise paramiko.SSHException("%s timed out after %ss" % (command, timeout))
+                else:
+                    select.select([channel], [], [], 0.5)
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        return CommandResult(command, status, stdout.close(), stderr.close())
+
+    def start(self, command, echo=True, on_line=None):
+        '''
+        Run command in the background, e.g. a daemon or a shutdown that
+        takes the connection down. Returns the thread running it.
+        '''
+        def run():
+            try:
+                result = self.run(command, echo=echo, on_line=on_line)
+                if echo:
+                    print("[%s] %s exited with %d" % (self.label, command, result.status))
+            except ERRORS as e:
+                if echo:
+                    print("[%s] %s: %r" % (self.label, command, e))
+        thread = threading.Thread(target=run, name='ssh-%s' % command.split()[0])
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def disconnect(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
@@ -0,0 +1,190 @@
+'''
+Run stages that depend on each other, each as soon as everything it
+depends on is done, independent ones concurrently.
+
+A stage that isn't enabled counts as done for its dependents as soon as
+its own dependencies are. When a
+stage fails every stage depending on it, directly or not, is aborted;
+stages not depending on it still run.
+'''
+from __future__ import print_function
+import sys
+import time
+import threading
+import traceback
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+ABORTED = 'aborted'
+
+
+class Stage(object):
+    def __init__(self, name, function, after=(), enabled=True):
+        '''
+        function is called with the arguments given to run_stages, after
+        the stages named in after.
+        '''
+        self.name = name
+        self.function = function
+        self.after = list(after)
+        self.enabled = enabled
+        self.state = PENDING
+        self.start = None
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def __repr__(self):
+        return 'Stage(%r, %s)' % (self.name, self.state)
+
+
+def check_stages(stages):
+    '''
+    Raise ValueError for duplicate names, unknown dependencies or cycles.
+    '''
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError("duplicate stage %s" % stage.name)
+        by_name[stage.name] = stage
+    for stage in stages:
+        for name in stage.after:
+            if name not in by_name:
+                raise ValueError("stage %s depends on unknown stage %s" % (stage.name, name))
+
+    visiting = set()
+    visited = set()
+
+    def visit(stage, path):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError("dependency cycle %s" % ' -> '.join(path + [stage.name]))
+        visiting.add(stage.name)
+        for name in stage.after:
+            visit(by_name[name], path + [stage.name])
+        visiting.discard(stage.name)
+        visited.add(stage.name)
+
+    for stage in stages:
+        visit(stage, [])
+    return by_name
+
+
+def run_stages(stages, *args):
+    '''
+    Run stages, calling each stage's function with args. Returns the
+    stages that failed. A stage raising something that isn't an
+    Exception, like SystemExit, stops the run: no more stages are
+    started and, once the running ones are done, it is raised again.
+    '''
+    by_name = check_stages(stages)
+    condition = threading.Condition()
+
+    def run(stage):
+        state = FAILED
+        try:
+            stage.function(*args)
+            state = DONE
+        except Exception as e:
+            print("ERROR stage %s failed: %r" % (stage.name, e))
+            traceback.print_exc(file=sys.stdout)
+            stage.error = e
+        except BaseException as e:
+            # e.g. sys.exit() in a stage, raised again by run_stages
+            print("ERROR stage %s stopped the run: %r" % (stage.name, e))
+            stage.error = e
+        finally:
+            with condition:
+                stage.end = time.time()
+                stage.state = state
+                condition.notify_all()
+
+    def stopping():
+        for stage in stages:
+            if stage.state == FAILED and not isinstance(stage.error, Exception):
+                return stage
+        return None
+
+    threads = []
+    with condition:
+        while True:
+            progressed = False
+            stopped = stopping()
+            for stage in stages:
+                if stage.state != PENDING:
+                    continue
+                states = [by_name[name].state for name in stage.after]
+                if stopped is not None or \
+                        any(state in (FAILED, ABORTED) for state in states):
+                    print("STATUS abort stage %s" % stage.name)
+                    stage.state = ABORTED
+                    progressed = True
+                elif not all(state in (DONE, SKIPPED) for state in states):
+                    continue
+                elif not stage.enabled:
+                    # still ordered after its own dependencies
+                    stage.state = SKIPPED
+                    stage.start = stage.end = time.time()
+                    progressed = True
+                else:
+                    stage.state = RUNNING
+                    stage.start = time.time()
+                    thread = threading.Thread(target=run, args=(stage,),
+                                              name='stage-%s' % stage.name)
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+            if progressed:
+                # skips and aborts above can unblock more stages
+                continue
+            if not any(stage.state == RUNNING for stage in stages):
+                break
+            # with a timeout, or python 2 can't be interrupted
+            condition.wait(1.0)
+    for thread in threads:
+        thread.join()
+    stopped = stopping()
+    if stopped is not None:
+        raise stopped.error
+    return [stage for stage in stages if stage.state == FAILED]
+
+
+def critical_path(stages):
+    '''
+    The chain of stages that determined the total run time: the stage
+    that ended last, the dependency of it that ended last, and so on.
+    Skipped stages are walked through but left out.
+    '''
+    by_name = dict((stage.name, stage) for stage in stages)
+    ran = [stage for stage in stages
+           if stage.end is not None and stage.state != SKIPPED]
+    if not ran:
+        return []
+    path = [max(ran, key=lambda stage: stage.end)]
+    while True:
+        before = [by_name[name] for name in path[-1].after
+                  if by_name[name].end is not None]
+        if not before:
+            break
+        path.append(max(before, key=lambda stage: stage.end))
+    path.reverse()
+    return [stage for stage in path if stage.state != SKIPPED]
+
+
+def format_critical_path(stages):
+    path = critical_path(stages)
+    if not path:
+        return "no stages ran"
+    return "%s, %.1fs total" % (
+        ' -> '.join("%s %.1fs" % (stage.name, stage.duration) for stage in path),
+        path[-1].end - min(stage.start for stage in stages
+                           if stage.start is not None and stage.state != SKIPPED))
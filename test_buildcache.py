@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import buildcache
+
+
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='buildcache-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.root = os.path.join(self.dir, 'root')
+        os.mkdir(self.root)
+        self.cache = buildcache.BuildCache(os.path.join(self.dir, 'cache'))
+
+    def tree(self, name, files, links=()):
+        '''
+        a DESTDIR tree with files {path: text} and symlinks [(path, target)]
+        '''
+        path = os.path.join(self.dir, name)
+        for relpath, text in list(files.items()) + [(link, None) for link, _ in links]:
+            parent = os.path.join(path, os.path.dirname(relpath))
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            if text is not None:
+                with open(os.path.join(path, relpath), 'w') as f:
+                    f.write(text)
+        for link, target in links:
+            os.symlink(target, os.path.join(path, link))
+        return path
+
+    def put(self, key, files, links=()):
+        return self.cache.put(key, self.tree('tree-' + key, files, links))
+
+    def read(self, name):
+        with open(os.path.join(self.root, name)) as f:
+            return f.read()
+
+    def exists(self, name):
+        return os.path.lexists(os.path.join(self.root, name))
+
+    def test_build_key(self):
+        self.assertEqual(buildcache.build_key('tree', '-O2'), buildcache.build_key('tree', '-O2'))
+        self.assertNotEqual(buildcache.build_key('tree', '-O2'),
+                            buildcache.build_key('-O2', 'tree'))
+        self.assertNotEqual(buildcache.build_key('ab', 'c'), buildcache.build_key('a', 'bc'))
+
+    def test_round_trip(self):
+        self.put('a', {'usr/sbin/ovs-vswitchd': 'daemon', 'usr/lib/libopenvswitch.so.1': 'lib'},
+                 [('usr/lib/libopenvswitch.so', 'libopenvswitch.so.1'),
+                  ('usr/lib64', 'lib')])
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), self.cache.path('a'))
+        self.cache.restore('a', self.root)
+        self.assertEqual(self.read('usr/sbin/ovs-vswitchd'), 'daemon')
+        self.assertEqual(os.readlink(os.path.join(self.root, 'usr/lib/libopenvswitch.so')),
+                         'libopenvswitch.so.1')
+        self.assertEqual(os.readlink(os.path.join(self.root, 'usr/lib64')), 'lib')
+        self.assertEqual(self.read('usr/lib/libopenvswitch.so'), 'lib')
+        self.assertEqual(self.cache.installed(), 'a')
+        self.assertRaises(KeyError, self.cache.restore, 'b', self.root)
+
+    def test_restore_replaces_existing_files(self):
+        os.makedirs(os.path.join(self.root, 'usr/lib'))
+        with open(os.path.join(self.root, 'usr/lib/libopenvswitch.so'), 'w') as f:
+            f.write('old')
+        self.put('a', {'usr/lib/libopenvswitch.so.1': 'lib'},
+                 [('usr/lib/libopenvswitch.so', 'libopenvswitch.so.1')])
+        self.cache.restore('a', self.root)
+        self.assertTrue(os.path.islink(os.path.join(self.root, 'usr/lib/libopenvswitch.so')))
+
+    def test_uninstall_removes_last_restored_entry_only(self):
+        with open(os.path.join(self.root, 'keep'), 'w') as f:
+            f.write('not ours')
+        self.put('a', {'bin/a': 'a', 'bin/shared': 'a'}, [('bin/link-a', 'a')])
+        self.put('b', {'bin/b': 'b', 'bin/shared': 'b'})
+        self.cache.restore('a', self.root)
+        self.cache.restore('b', self.root)
+        self.assertFalse(self.exists('bin/a'))
+        self.assertFalse(self.exists('bin/link-a'))
+        self.assertEqual(self.read('bin/shared'), 'b')
+        self.assertTrue(self.cache.uninstall(self.root))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'bin'))), [])
+        self.assertEqual(self.read('keep'), 'not ours')
+        self.assertIsNone(self.cache.installed())
+        self.assertFalse(self.cache.uninstall(self.root))
+
+    def test_uninstall_of_evicted_entry(self):
+        self.put('a', {'bin/a': 'a'})
+        self.cache.restore('a', self.root)
+        shutil.rmtree(self.cache.path('a'))
+        self.assertFalse(self.cache.uninstall(self.root))
+        self.assertEqual(self.read('bin/a'), 'a')
+
+    def test_evict_least_recently_used(self):
+        for key in 'abc':
+            self.put(key, {'file': 'x' * 100})
+        self.cache.restore('b', self.root)
+        for n, key in enumerate('abc'):
+            os.utime(self.cache.path(key), (1000 + n, 1000 + n))
+        self.cache.max_bytes = 250
+        self.put('d', {'file': 'x' * 100})
+        self.assertEqual([key for _, key in self.cache.entries()], ['b', 'd'])
+
+    def test_evict_keeps_keep_and_installed(self):
+        for key in 'abcd':
+            self.put(key, {'file': 'x' * 100})
+        self.cache.restore('c', self.root)
+        self.cache.max_bytes = 0
+        self.cache.evict(keep='a')
+        self.assertEqual(sorted(key for _, key in self.cache.entries()), ['a', 'c'])
+        self.cache.evict()
+        self.assertEqual([key for _, key in self.cache.entries()], ['c'])
+
+    def test_put_twice(self):
+        self.put('a', {'file': 'first'})
+        self.cache.put('a', self.tree('other', {'file': 'second'}))
+        with open(os.path.join(self.cache.path('a'), 'file')) as f:
+            self.assertEqual(f.read(), 'first')
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cpupin
+import procinfo
+from test_procinfo import FakeProc, stat_line
+
+
+class FakeSys(object):
+    '''
+    A sysfs tree in a temporary directory with nodes and hyperthread
+    siblings, e.g. FakeSys({0: [0, 1, 2, 3, 8, 9, 10, 11]}, [(0, 8), (1, 9)]).
+    '''
+    def __init__(self, nodes, siblings):
+        self.root = tempfile.mkdtemp(prefix='sys-')
+        system = os.path.join(self.root, 'devices', 'system')
+        for node, cpus in nodes.items():
+            self.write(os.path.join(system, 'node', 'node%d' % node), 'cpulist',
+                       ','.join(str(cpu) for cpu in cpus))
+        for group in siblings:
+            for cpu in group:
+                self.write(os.path.join(system, 'cpu', 'cpu%d' % cpu, 'topology'),
+                           'thread_siblings_list', ','.join(str(c) for c in group))
+
+    def write(self, path, name, text):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(text + '\n')
+
+    def close(self):
+        shutil.rmtree(self.root)
+
+
+def threads(count):
+    return [procinfo.Stat(stat_line(1000 + i, 'CPU %d/KVM' % i)) for i in range(count)]
+
+
+class ParseTest(unittest.TestCase):
+    def test_cpu_list(self):
+        self.assertEqual(cpupin.parse_cpu_list('0-3,8,10-11\n'), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(cpupin.parse_cpu_list('5,1,1'), [1, 5])
+        self.assertEqual(cpupin.parse_cpu_list(''), [])
+
+    def test_cpu_mask(self):
+        self.assertEqual(cpupin.parse_cpu_mask('0x6'), [1, 2])
+        self.assertEqual(cpupin.parse_cpu_mask('f0'), [4, 5, 6, 7])
+
+
+class TopologyTestCase(unittest.TestCase):
+    # two nodes of 4 cores with 2 threads each, siblings n and n + 8
+    NODES = {0: [0, 1, 2, 3, 8, 9, 10, 11], 1: [4, 5, 6, 7, 12, 13, 14, 15]}
+    SIBLINGS = [(n, n + 8) for n in range(8)]
+
+    def setUp(self):
+        self.sys = FakeSys(self.NODES, self.SIBLINGS)
+        self.addCleanup(self.sys.close)
+
+
+class UsableCpusTest(TopologyTestCase):
+    def test_other_node_left_out(self):
+        self.assertEqual(cpupin.usable_cpus([2, 3, 4, 5], 0, [], self.sys.root), [2, 3])
+
+    def test_pmd_cpus_and_siblings_left_out(self):
+        self.assertEqual(cpupin.usable_cpus([0, 1, 2, 3, 8, 9, 10, 11], 0, [1, 10],
+                                            self.sys.root),
+                         [0, 3, 8, 11])
+
+    def test_missing_topology_is_its_own_core(self):
+        self.assertEqual(cpupin.thread_siblings(40, self.sys.root), [40])
+
+
+class PlanTest(TopologyTestCase):
+    def cpus(self, placement):
+        return [cpu for _, cpu in placement]
+
+    def test_one_thread_per_core_first(self):
+        placement = cpupin.plan(threads(3), [2, 3, 10, 11], self.sys.root)
+        self.assertEqual([t.id for t, _ in placement], [1000, 1001, 1002])
+        self.assertEqual(self.cpus(placement), [2, 3, 10])
+
+    def test_siblings_used_when_cores_run_out(self):
+        self.assertEqual(self.cpus(cpupin.plan(threads(4), [2, 10, 3, 11], self.sys.root)),
+                         [2, 3, 10, 11])
+
+    def test_short_of_cpus_pins_what_it_can(self):
+        placement = cpupin.plan(threads(4), [2, 3], self.sys.root)
+        self.assertEqual([(t.id, cpu) for t, cpu in placement], [(1000, 2), (1001, 3)])
+        self.assertEqual(cpupin.plan(threads(2), [], self.sys.root), [])
+
+
+class VcpuThreadsTest(unittest.TestCase):
+    def test_named_threads_by_index(self):
+        samples = [(procinfo.Stat(stat_line(10, 'qemu-system-x86')), 0.0),
+                   (procinfo.Stat(stat_line(12, 'CPU 1/KVM')), 0.5),
+                   (procinfo.Stat(stat_line(11, 'CPU 0/KVM')), 0.1)]
+        self.assertEqual([t.id for t in cpupin.vcpu_threads(samples, 2)], [11, 12])
+
+    def test_busiest_without_names(self):
+        samples = [(procinfo.Stat(stat_line(10 + i, 'qemu-system-x86')), usage)
+                   for i, usage in enumerate([0.1, 1.0, 0.0, 0.9])]
+        self.assertEqual([t.id for t in cpupin.vcpu_threads(samples, 2)], [11, 13])
+
+
+class PinVcpusTest(TopologyTestCase):
+    def setUp(self):
+        TopologyTestCase.setUp(self)
+        self.proc = FakeProc()
+        self.addCleanup(self.proc.close)
+        self.pinned = []
+
+    def pin(self, vcpus, core_list, pmd_cpus=()):
+        return cpupin.pin_vcpus('qemu-system-x86_64', vcpus, core_list, 0, list(pmd_cpus),
+                                interval=0.01, proc=self.proc.root, sys_root=self.sys.root,
+                                setaffinity=lambda tid, cpu: self.pinned.append((tid, cpu)))
+
+    def test_pins_named_vcpus(self):
+        self.proc.add(200, 'qemu-system-x86_64', ['qemu-system-x86_64'],
+                      threads=[(201, 'CPU 0/KVM', {}), (202, 'CPU 1/KVM', {})])
+        self.pin(2, [0, 1, 2, 3], pmd_cpus=[1])
+        self.assertEqual(self.pinned, [(201, 0), (202, 2)])
+
+    def test_short_of_cores_pins_what_it_can(self):
+        self.proc.add(200, 'qemu-system-x86_64', ['qemu-system-x86_64'],
+                      threads=[(201, 'CPU 0/KVM', {}), (202, 'CPU 1/KVM', {}),
+                               (203, 'CPU 2/KVM', {})])
+        self.pin(3, [0, 1, 4], pmd_cpus=[1])
+        self.assertEqual(self.pinned, [(201, 0)])
+
+    def test_no_qemu_process(self):
+        self.assertRaises(cpupin.PinningError, self.pin, 2, [0, 1])
+        self.assertEqual(self.pinned, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
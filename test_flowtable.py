@@ -0,0 +1,111 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+import flowtable
+
+# ovs-vsctl and ovs-ofctl for one bridge, keeping its protocols and
+# table in files next to them
+OVS_VSCTL = '''#!/bin/sh
+dir=$(dirname "$0")
+case "$*" in
+  "set bridge br0 protocols="*) echo "${4#protocols=}" > "$dir/protocols" ;;
+  *) echo "ovs-vsctl: unexpected $*" >&2; exit 1 ;;
+esac
+'''
+
+OVS_OFCTL = '''#!/bin/sh
+dir=$(dirname "$0")
+echo "$*" >> "$dir/ofctl.log"
+case "$*" in
+  "-O OpenFlow14 --bundle replace-flows br0 "*)
+    grep -qs OpenFlow14 "$dir/protocols" || {
+      echo "ovs-ofctl: br0: failed to connect to socket (Protocol error)" >&2; exit 1; }
+    grep -q bad "$6" && { echo "ovs-ofctl: bad flow" >&2; exit 1; }
+    cp "$6" "$dir/table" ;;
+  "diff-flows br0 "*)
+    diff "$dir/table" "$3" | grep '^[<>]' && exit 2; exit 0 ;;
+  *) echo "ovs-ofctl: unexpected $*" >&2; exit 1 ;;
+esac
+'''
+
+
+class FlowTableTest(unittest.TestCase):
+    def test_parse_port_pairs(self):
+        self.assertEqual(flowtable.parse_port_pairs('2:4, 1:3'), [('2', '4'), ('1', '3')])
+        for text in ('2', '2:', '1:2:3'):
+            self.assertRaises(ValueError, flowtable.parse_port_pairs, text)
+
+    def test_cross_connect_both_ways(self):
+        self.assertEqual(flowtable.flow_table([('2', '4')]),
+                         ['priority=1,in_port=2,actions=output:4',
+                          'priority=1,in_port=4,actions=output:2'])
+
+    def test_stress_flows_above_cross_connect(self):
+        flows = flowtable.flow_table([('2', '4'), ('1', '3')], 300)
+        self.assertEqual(len(flows), 304)
+        self.assertEqual(flows[0],
+                         'priority=10,ip,in_port=2,nw_dst=10.0.0.1,actions=output:4')
+        self.assertEqual(flows[299],
+                         'priority=10,ip,in_port=3,nw_dst=10.0.1.44,actions=output:1')
+        self.assertEqual(len(set(flows)), len(flows))
+
+    def test_no_pairs(self):
+        self.assertRaises(ValueError, flowtable.flow_table, [])
+
+
+class InstallTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='ovs-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        for name, script in (('ovs-vsctl', OVS_VSCTL), ('ovs-ofctl', OVS_OFCTL)):
+            path = os.path.join(self.dir, name)
+            with open(path, 'w') as f:
+                f.write(script)
+            os.chmod(path, stat.S_IRWXU)
+        path = os.environ['PATH']
+        os.environ['PATH'] = self.dir + os.pathsep + path
+        self.addCleanup(os.environ.__setitem__, 'PATH', path)
+
+    def flows(self, flows):
+        return flowtable.write_flows(flows, self.dir)
+
+    def read(self, name):
+        with open(os.path.join(self.dir, name)) as f:
+            return f.read()
+
+    def test_install_and_verify(self):
+        path = self.flows(flowtable.flow_table([('2', '4')], 10))
+        flowtable.install('br0', path)
+        flowtable.verify('br0', path)
+        self.assertEqual(self.read('protocols').strip(), 'OpenFlow10,OpenFlow13,OpenFlow14')
+        self.assertEqual(self.read('table'), self.read(os.path.basename(path)))
+
+    def test_rejected_table_left_unchanged(self):
+        good = self.flows(flowtable.flow_table([('2', '4')]))
+        flowtable.install('br0', good)
+        try:
+            flowtable.install('br0', self.flows(['bad']))
+        except flowtable.FlowError as e:
+            self.assertIn('bad flow', str(e))
+        else:
+            self.fail("FlowError not raised")
+        flowtable.verify('br0', good)
+
+    def test_verify_finds_differences(self):
+        path = self.flows(flowtable.flow_table([('2', '4')]))
+        flowtable.install('br0', path)
+        with open(os.path.join(self.dir, 'table'), 'a') as f:
+            f.write('priority=5,actions=drop\n')
+        try:
+            flowtable.verify('br0', path)
+        except flowtable.FlowError as e:
+            self.assertIn('priority=5,actions=drop', str(e))
+        else:
+            self.fail("FlowError not raised")
+
+
+if __name__ == '__main__':
+    unittest.main()
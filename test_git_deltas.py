@@ -0,0 +1,94 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import subprocess
+import importlib.util
+
+spec = importlib.util.spec_from_file_location(
+    'git_deltas', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'git-deltas.py'))
+git_deltas = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(git_deltas)
+
+
+def make_skewed_repo(path, commits=600, tags=18, seed=3, skew=0.3):
+    '''
+    a random history over a few branches that fork and merge, the skew
+    fraction of its commits dated up to 30 days off, so older commits can
+    look newer than their children. tags upstream/1.<n> go on random
+    commits in history order, mostly on different branches from each
+    other.
+    '''
+    rng = random.Random(seed)
+    subprocess.check_call(['git', 'init', '-q', path])
+    lines = []
+    heads = {}
+    date = 1500000000
+    tagged = sorted(rng.sample(range(1, commits + 1), tags))
+    for mark in range(1, commits + 1):
+        branch = 'b%d' % rng.randrange(4)
+        date += 60
+        skewed = date + (rng.randrange(-30, 30) * 86400 if rng.random() < skew else 0)
+        lines.append('commit refs/heads/%s' % branch)
+        lines.append('mark :%d' % mark)
+        lines.append('committer Dev <dev@example.com> %d +0000' % skewed)
+        lines.append('data 9\ncommit %02d' % (mark % 100))
+        parent = heads.get(branch) or (mark - 1 if mark > 1 else None)
+        if parent:
+            lines.append('from :%d' % parent)
+        others = [head for name, head in heads.items() if name != branch and head != parent]
+        if others and rng.random() < 0.15:
+            lines.append('merge :%d' % rng.choice(others))
+        lines.append('M 644 inline file\ndata %d\n%d\n' % (len(str(mark)), mark))
+        heads[branch] = mark
+    for n, mark in enumerate(tagged):
+        lines.append('reset refs/tags/upstream/1.%d\nfrom :%d\n' % (n, mark))
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'],
+                   input=('\n'.join(lines) + '\n').encode('utf-8'), check=True)
+    return ['upstream/1.%d' % n for n in reversed(range(tags))]
+
+
+def rev_list(*args):
+    return subprocess.check_output(['git', 'rev-list'] + list(args)).decode('ascii').split()
+
+
+class CommitGraphTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.repo = tempfile.mkdtemp(prefix='git-deltas-')
+        cls.tags = make_skewed_repo(cls.repo)
+        cls.cwd = os.getcwd()
+        os.chdir(cls.repo)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.repo)
+
+    def test_history_is_skewed_and_not_nested(self):
+        graph = git_deltas.CommitGraph(self.tags)
+        nested = [subprocess.call(['git', 'merge-base', '--is-ancestor', old, new]) == 0
+                  for new, old in zip(self.tags, self.tags[1:])]
+        self.assertIn(True, nested)
+        self.assertIn(False, nested)
+        skewed = [c for c in range(len(graph.row))
+                  if any(graph.dates[p] > graph.dates[c] for p in graph.parents_of(c))]
+        self.assertTrue(skewed)
+
+    def test_delta_matches_rev_list(self):
+        graph = git_deltas.CommitGraph(self.tags)
+        for i in range(len(self.tags) - 1):
+            new, old = self.tags[i], self.tags[i + 1]
+            self.assertEqual(graph.delta(i), rev_list(new, '^' + old),
+                             '%s ==> %s' % (new, old))
+
+    def test_graph_of_every_other_tag(self):
+        tags = self.tags[::2]
+        graph = git_deltas.CommitGraph(tags)
+        for i in range(len(tags) - 1):
+            self.assertEqual(set(graph.delta(i)), set(rev_list(tags[i], '^' + tags[i + 1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
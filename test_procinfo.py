@@ -0,0 +1,170 @@
+import os
+import errno
+import shutil
+import signal
+import tempfile
+import unittest
+
+import procinfo
+
+
+def stat_line(pid, comm, state='S', ppid=1, utime=0, stime=0, start_time=1000,
+              processor=0):
+    # pid (comm) state ppid, then fields 5-52 with the ones we read filled in
+    fields = ['0'] * 49
+    fields[14 - 5] = str(utime)
+    fields[15 - 5] = str(stime)
+    fields[22 - 5] = str(start_time)
+    fields[39 - 5] = str(processor)
+    return '%d (%s) %s %d %s\n' % (pid, comm, state, ppid, ' '.join(fields))
+
+
+class FakeProc(object):
+    '''
+    A /proc tree in a temporary directory.
+    '''
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='proc-')
+
+    def add(self, pid, comm, cmdline, threads=(), **stat):
+        path = os.path.join(self.root, str(pid))
+        os.makedirs(os.path.join(path, 'task'))
+        self.write(path, 'stat', stat_line(pid, comm[:procinfo.COMM_LEN], **stat))
+        self.write(path, 'comm', comm[:procinfo.COMM_LEN] + '\n')
+        self.write(path, 'cmdline', ''.join(arg + '\0' for arg in cmdline))
+        for tid, thread_comm, thread_stat in [(pid, comm, {})] + list(threads):
+            task = os.path.join(path, 'task', str(tid))
+            os.makedirs(task)
+            self.write(task, 'stat', stat_line(tid, thread_comm, **thread_stat))
+
+    def set_state(self, pid, comm, **stat):
+        self.write(os.path.join(self.root, str(pid)), 'stat', stat_line(pid, comm, **stat))
+
+    def remove(self, pid):
+        shutil.rmtree(os.path.join(self.root, str(pid)))
+
+    def write(self, path, name, text):
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(text)
+
+    def close(self):
+        shutil.rmtree(self.root)
+
+
+class ProcTestCase(unittest.TestCase):
+    def setUp(self):
+        self.proc = FakeProc()
+        self.addCleanup(self.proc.close)
+
+
+class StatTest(unittest.TestCase):
+    def test_comm_with_spaces_and_parentheses(self):
+        stat = procinfo.Stat(stat_line(42, 'a) (b', utime=250, stime=50,
+                                       start_time=7, processor=3))
+        self.assertEqual(stat.id, 42)
+        self.assertEqual(stat.comm, 'a) (b')
+        self.assertEqual(stat.state, 'S')
+        self.assertEqual(stat.start_time, 7)
+        self.assertEqual(stat.processor, 3)
+        self.assertAlmostEqual(stat.cpu_time, 300.0 / procinfo.CLOCK_TICKS)
+
+
+class FindProcessesTest(ProcTestCase):
+    def setUp(self):
+        ProcTestCase.setUp(self)
+        self.proc.add(100, 'ovs-vswitchd',
+                      ['ovs-vswitchd', 'unix:/var/run/openvswitch/db.sock', '--pidfile'])
+        self.proc.add(200, 'qemu-system-x86_64',
+                      ['/usr/bin/qemu-system-x86_64', '-name', 'vm,debug-threads=on'])
+        self.proc.add(300, 'bash', ['bash', '-c', 'sleep 1000'])
+
+    def find(self, names=(), patterns=()):
+        return [p.pid for p in procinfo.find_processes(names, patterns, self.proc.root)]
+
+    def test_by_name(self):
+        self.assertEqual(self.find(names=('ovs-vswitchd',)), [100])
+
+    def test_long_name_matches_truncated_comm(self):
+        self.assertEqual(self.find(names=('qemu-system-x86_64',)), [200])
+
+    def test_name_is_not_a_prefix_match(self):
+        self.assertEqual(self.find(names=('ovs',)), [])
+        self.assertEqual(self.find(names=('qemu',)), [])
+
+    def test_by_pattern(self):
+        self.assertEqual(self.find(patterns=('sleep 1000',)), [300])
+        self.assertEqual(self.find(patterns=('db.sock', 'debug-threads')), [100, 200])
+
+    def test_never_this_process(self):
+        self.proc.add(os.getpid(), 'ovs-vswitchd', ['ovs-vswitchd'])
+        self.assertEqual(self.find(names=('ovs-vswitchd',)), [100])
+
+    def test_unreadable_entries_left_out(self):
+        os.makedirs(os.path.join(self.proc.root, '400'))
+        os.makedirs(os.path.join(self.proc.root, 'sys'))
+        self.assertEqual([p.pid for p in procinfo.processes(self.proc.root)], [100, 200, 300])
+
+
+class ProcessTest(ProcTestCase):
+    def test_threads(self):
+        self.proc.add(200, 'qemu-system-x86_64', ['qemu-system-x86_64'],
+                      threads=[(201, 'CPU 0/KVM', {'utime': 10}),
+                               (202, 'CPU 1/KVM', {'processor': 5})])
+        process = procinfo.Process(200, self.proc.root)
+        threads = process.threads()
+        self.assertEqual([t.id for t in threads], [200, 201, 202])
+        self.assertEqual([t.comm for t in threads][1:], ['CPU 0/KVM', 'CPU 1/KVM'])
+        self.assertEqual(threads[2].processor, 5)
+
+    def test_alive(self):
+        self.proc.add(100, 'ovs-vswitchd', ['ovs-vswitchd'])
+        process = procinfo.Process(100, self.proc.root)
+        self.assertTrue(process.alive())
+        self.proc.set_state(100, 'ovs-vswitchd', state='Z')
+        self.assertFalse(process.alive())
+
+    def test_reused_pid_is_not_alive(self):
+        self.proc.add(100, 'ovs-vswitchd', ['ovs-vswitchd'])
+        process = procinfo.Process(100, self.proc.root)
+        self.proc.set_state(100, 'bash', start_time=2000)
+        self.assertFalse(process.alive())
+
+    def test_gone_is_not_alive(self):
+        self.proc.add(100, 'ovs-vswitchd', ['ovs-vswitchd'])
+        process = procinfo.Process(100, self.proc.root)
+        self.proc.remove(100)
+        self.assertFalse(process.alive())
+
+
+class KillAndWaitTest(ProcTestCase):
+    def test_escalates_until_gone(self):
+        self.proc.add(100, 'stubborn', ['stubborn'])
+        self.proc.add(200, 'polite', ['polite'])
+        processes = procinfo.find_processes(names=('stubborn', 'polite'),
+                                            proc=self.proc.root)
+        sent = []
+
+        def kill(pid, signal_send):
+            sent.append((pid, signal_send))
+            if pid == 200 or signal_send == signal.SIGKILL:
+                self.proc.remove(pid)
+
+        remaining = procinfo.kill_and_wait(processes, timeout=0.2, interval=0.01,
+                                           kill=kill)
+        self.assertEqual(remaining, [])
+        self.assertEqual(sent, [(100, signal.SIGINT), (200, signal.SIGINT),
+                                (100, signal.SIGKILL)])
+
+    def test_already_exited(self):
+        self.proc.add(100, 'ovs-vswitchd', ['ovs-vswitchd'])
+        processes = procinfo.find_processes(names=('ovs-vswitchd',), proc=self.proc.root)
+
+        def kill(pid, signal_send):
+            self.proc.remove(pid)
+            raise OSError(errno.ESRCH, 'No such process')
+
+        self.assertEqual(procinfo.kill_and_wait(processes, timeout=0.2, kill=kill), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import unittest
+
+import readiness
+
+
+class Probe(object):
+    '''
+    Fails with each of errors in turn, or returns False for None, then
+    passes.
+    '''
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if not self.errors:
+            return True
+        error = self.errors.pop(0)
+        if error is None:
+            return False
+        raise error
+
+
+class WaitForTest(unittest.TestCase):
+    def test_passes_after_failures(self):
+        probe = Probe(None, IOError('refused'), None)
+        readiness.wait_for('thing', probe, 5, initial=0.01)
+        self.assertEqual(probe.calls, 4)
+
+    def test_times_out(self):
+        probe = Probe(*[IOError('refused')] * 1000)
+        start = time.time()
+        try:
+            readiness.wait_for('thing', probe, 0.2, initial=0.01)
+        except readiness.NotReady as e:
+            self.assertIn('refused', str(e))
+        else:
+            self.fail("NotReady not raised")
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_fatal_raised_right_away(self):
+        probe = Probe(IOError('refused'), ValueError('bad password'))
+        start = time.time()
+        self.assertRaises(ValueError, readiness.wait_for, 'thing', probe, 300,
+                          initial=0.01, fatal=(ValueError,))
+        self.assertEqual(probe.calls, 2)
+        self.assertLess(time.time() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
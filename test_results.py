@@ -0,0 +1,56 @@
+import unittest
+
+import results
+import throughput
+
+
+class MedianTest(unittest.TestCase):
+    def test_median(self):
+        self.assertEqual(results.median([3, 1, 2]), 2)
+        self.assertEqual(results.median([4, 1, 3, 2]), 2.5)
+
+    def test_interval_widens_to_the_range_for_few_values(self):
+        self.assertEqual(results.median_interval([3, 1, 2]), (1, 3))
+
+    def test_interval_narrows_with_more_values(self):
+        values = list(range(1, 21))
+        low, high = results.median_interval(values)
+        self.assertTrue(1 < low <= results.median(values) <= high < 20)
+        self.assertGreaterEqual(1 - 2 * results.binomial_cdf(values.index(low), 20),
+                                results.CONFIDENCE)
+
+
+class CompareTest(unittest.TestCase):
+    def test_within_margin(self):
+        self.assertEqual(results.compare([9.8, 9.9, 10.0], [10.0], 0.03), throughput.GOOD)
+
+    def test_clearly_below(self):
+        self.assertEqual(results.compare([8.0, 8.1, 8.2], [10.0, 10.1, 9.9], 0.03),
+                         throughput.BAD)
+
+    def test_overlapping_is_undecided(self):
+        self.assertEqual(results.compare([8.0, 8.1, 10.5], [8.0, 10.0, 10.1], 0.03),
+                         throughput.SKIP)
+
+    def test_nothing_forwarded(self):
+        self.assertEqual(results.compare([0, 0, 0], [10.0], 0.03), throughput.SKIP)
+        self.assertEqual(results.compare([10.0], [0], 0.03), throughput.SKIP)
+        self.assertEqual(results.compare([], [10.0], 0.03), throughput.SKIP)
+
+
+class JudgeTest(unittest.TestCase):
+    def test_any_unusable_trial_skips(self):
+        good = (10.0, 0.01)
+        for bad in [(10.0, None), (10.0, 0.5), (0.0, 0.01)]:
+            for trials in ([bad], [good, bad, good]):
+                self.assertEqual(results.judge(trials, [10.0], 0.03, 0.1), throughput.SKIP)
+
+    def test_usable_trials_compared(self):
+        self.assertEqual(results.judge([(10.0, 0.01)] * 3, [10.0], 0.03, 0.1),
+                         throughput.GOOD)
+        self.assertEqual(results.judge([(8.0, 0.01)] * 3, [10.0], 0.03, 0.1),
+                         throughput.BAD)
+
+
+if __name__ == '__main__':
+    unittest.main()
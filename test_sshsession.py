@@ -0,0 +1,92 @@
+import time
+import socket
+import threading
+import unittest
+
+try:
+    import paramiko
+    import sshsession
+except ImportError:
+    paramiko = None
+
+import readiness
+
+PASSWORD = 'iforgot'
+
+
+class Server(object):
+    '''
+    An SSH server on a local port that only does password logins.
+    '''
+    def __init__(self):
+        self.key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.transports = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except (socket.error, OSError):
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.key)
+            transport.start_server(server=Authenticator())
+            self.transports.append(transport)
+
+    def close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+
+if paramiko is not None:
+    class Authenticator(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            if password == PASSWORD:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+
+@unittest.skipIf(paramiko is None, "paramiko not installed")
+class EnsureConnectedTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.addCleanup(self.server.close)
+
+    def session(self, password):
+        session = sshsession.SSHSession('127.0.0.1', 'tester', password=password,
+                                        port=self.server.port, connect_timeout=5,
+                                        reconnect_timeout=300, label='test')
+        self.addCleanup(session.close)
+        return session
+
+    def test_login(self):
+        self.assertTrue(self.session(PASSWORD).ensure_connected(300).is_active())
+
+    def test_refused_login_is_not_retried(self):
+        session = self.session('wrong')
+        start = time.time()
+        self.assertRaises(paramiko.AuthenticationException, session.ensure_connected, 300)
+        self.assertLess(time.time() - start, 30)
+
+    def test_closed_port_is_retried(self):
+        self.server.close()
+        session = self.session(PASSWORD)
+        start = time.time()
+        self.assertRaises(readiness.NotReady, session.ensure_connected, 0.5)
+        self.assertGreaterEqual(time.time() - start, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import time
+import unittest
+
+import stages
+
+
+class RunStagesTest(unittest.TestCase):
+    def setUp(self):
+        self.ran = []
+
+    def stage(self, name, after=(), error=None, enabled=True, sleep=0):
+        def function():
+            self.ran.append(name)
+            time.sleep(sleep)
+            if error is not None:
+                raise error
+        return stages.Stage(name, function, after, enabled)
+
+    def states(self, pipeline):
+        return dict((stage.name, stage.state) for stage in pipeline)
+
+    def test_order_and_skips(self):
+        pipeline = [self.stage('c', after=['b']), self.stage('b', after=['a'], enabled=False),
+                    self.stage('a')]
+        self.assertEqual(stages.run_stages(pipeline), [])
+        self.assertEqual(self.ran, ['a', 'c'])
+        self.assertEqual(self.states(pipeline),
+                         {'a': stages.DONE, 'b': stages.SKIPPED, 'c': stages.DONE})
+
+    def test_failure_aborts_dependents_only(self):
+        pipeline = [self.stage('a', error=ValueError('broken')),
+                    self.stage('b', after=['a']), self.stage('c', after=['b']),
+                    self.stage('d')]
+        failed = stages.run_stages(pipeline)
+        self.assertEqual([stage.name for stage in failed], ['a'])
+        self.assertIsInstance(failed[0].error, ValueError)
+        self.assertEqual(self.states(pipeline),
+                         {'a': stages.FAILED, 'b': stages.ABORTED, 'c': stages.ABORTED,
+                          'd': stages.DONE})
+
+    def test_exit_stops_the_run(self):
+        pipeline = [self.stage('a', error=SystemExit(3)), self.stage('b', after=['a']),
+                    self.stage('c', after=['a'])]
+        try:
+            stages.run_stages(pipeline)
+        except SystemExit as e:
+            self.assertEqual(e.code, 3)
+        else:
+            self.fail("SystemExit not raised")
+        self.assertEqual(self.ran, ['a'])
+        self.assertEqual(self.states(pipeline),
+                         {'a': stages.FAILED, 'b': stages.ABORTED, 'c': stages.ABORTED})
+        self.assertIsNotNone(pipeline[0].end)
+
+    def test_exit_stops_unrelated_stages(self):
+        pipeline = [self.stage('a', error=KeyboardInterrupt()),
+                    self.stage('b', sleep=0.2), self.stage('c', after=['b'])]
+        self.assertRaises(KeyboardInterrupt, stages.run_stages, pipeline)
+        self.assertEqual(sorted(self.ran), ['a', 'b'])
+        self.assertEqual(self.states(pipeline),
+                         {'a': stages.FAILED, 'b': stages.DONE, 'c': stages.ABORTED})
+
+    def test_cycle(self):
+        pipeline = [self.stage('a', after=['b']), self.stage('b', after=['a'])]
+        self.assertRaises(ValueError, stages.run_stages, pipeline)
+
+
+if __name__ == '__main__':
+    unittest.main()
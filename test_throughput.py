@@ -0,0 +1,184 @@
+import unittest
+
+import results
+import throughput
+
+PORT_STATS = '''
+  ######################## NIC statistics for port 0  ########################
+  RX-packets: %d      RX-missed: 0          RX-bytes:  0
+  RX-errors: 0
+  RX-nombuf:  0
+  TX-packets: %d      TX-errors: 0          TX-bytes:  0
+
+  Throughput (since last show)
+  Rx-pps:            0          Rx-bps:            0
+  ############################################################################
+
+  ######################## NIC statistics for port 1  ########################
+  RX-packets: %d      RX-missed: 0          RX-bytes:  0
+  RX-errors: 0
+  RX-nombuf:  0
+  TX-packets: %d      TX-errors: 0          TX-bytes:  0
+  ############################################################################
+'''
+
+PMD_STATS = '''pmd thread numa_id 0 core_id 2:
+  packets received: 3000
+  packet recirculations: 0
+  avg. datapath passes per packet: 1.00
+  emc hits: 2990
+  megaflow hits: 10
+  miss with success upcall: 0
+  idle cycles: 500000 (40.00%)
+  processing cycles: 150000 (60.00%)
+  avg cycles per packet: 216.67 (650000/3000)
+  avg processing cycles per packet: 50.00 (150000/3000)
+pmd thread numa_id 0 core_id 3:
+  packets received: 1000
+  emc hits: 1000
+  idle cycles: 100000 (50.00%)
+  processing cycles: 50000 (50.00%)
+main thread:
+  packets received: 77
+  processing cycles: 99999
+'''
+
+# before packets received was reported
+OLD_PMD_STATS = '''main thread:
+	emc hits:0
+	megaflow hits:0
+	miss:0
+pmd thread numa_id 0 core_id 2:
+	emc hits:900
+	megaflow hits:50
+	miss:50
+	lost:0
+	polling cycles:80000 (40.00%)
+	processing cycles:120000 (60.00%)
+'''
+
+
+class FakeTestpmd(object):
+    '''
+    testpmd forwarding rates[i] packets per second, split over two
+    ports, during interval i of a fake clock that only sleep moves.
+    '''
+    def __init__(self, rates, interval):
+        self.rates = rates
+        self.interval = interval
+        self.now = 1000.0
+        self.start = self.now
+        self.cleared = 0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def packets(self):
+        intervals = int(round((self.now - self.start) / self.interval))
+        return sum(rate * self.interval for rate in self.rates[:intervals])
+
+    def port_stats(self):
+        half = self.packets() // 2
+        return PORT_STATS % (half, half, self.packets() - half, self.packets() - half)
+
+    def pmd_stats(self):
+        return PMD_STATS
+
+    def clear_pmd_stats(self):
+        self.cleared += 1
+
+    def measure(self, **kwargs):
+        return throughput.measure(self.port_stats, self.pmd_stats, self.clear_pmd_stats,
+                                  window=self.interval * len(self.rates),
+                                  interval=self.interval,
+                                  sleep=self.sleep, clock=self.clock, **kwargs)
+
+
+class ParseTest(unittest.TestCase):
+    def test_port_stats(self):
+        self.assertEqual(throughput.parse_port_stats(PORT_STATS % (10, 11, 12, 13)),
+                         {0: {'rx': 10, 'tx': 11}, 1: {'rx': 12, 'tx': 13}})
+
+    def test_no_port_stats(self):
+        self.assertRaises(throughput.MeasurementError, throughput.parse_port_stats,
+                          'Invalid port 0\n')
+
+    def test_pmd_stats_summed_over_pmd_threads(self):
+        self.assertEqual(throughput.parse_pmd_stats(PMD_STATS),
+                         {'packets': 4000, 'cycles': 800000, 'processing_cycles': 200000})
+
+    def test_old_pmd_stats(self):
+        self.assertEqual(throughput.parse_pmd_stats(OLD_PMD_STATS),
+                         {'packets': 1000, 'cycles': 200000, 'processing_cycles': 120000})
+
+    def test_no_pmd_threads(self):
+        self.assertRaises(throughput.MeasurementError, throughput.parse_pmd_stats,
+                          'main thread:\n  packets received: 0\n')
+
+
+class MeasureTest(unittest.TestCase):
+    def test_steady_rate(self):
+        testpmd = FakeTestpmd([2000000] * 6, 5.0)
+        measurement = testpmd.measure()
+        self.assertEqual(measurement.rates, [2000000.0] * 6)
+        self.assertAlmostEqual(measurement.mpps, 2.0)
+        self.assertEqual(measurement.spread, 0.0)
+        self.assertEqual(measurement.cycles_per_packet, 50.0)
+        self.assertEqual(testpmd.cleared, 1)
+
+    def test_varying_rate(self):
+        measurement = FakeTestpmd([1000000, 3000000], 5.0).measure()
+        self.assertEqual(measurement.rates, [1000000.0, 3000000.0])
+        self.assertAlmostEqual(measurement.mpps, 2.0)
+        self.assertAlmostEqual(measurement.spread, 1.0)
+
+    def test_nothing_forwarded(self):
+        measurement = FakeTestpmd([0, 0, 0], 5.0).measure()
+        self.assertEqual(measurement.mpps, 0.0)
+        self.assertEqual(measurement.spread, float('inf'))
+
+    def test_bad_stats_fail_the_measurement(self):
+        testpmd = FakeTestpmd([1000000] * 3, 5.0)
+        testpmd.port_stats = lambda: 'testpmd> '
+        self.assertRaises(throughput.MeasurementError, testpmd.measure)
+
+
+class JudgeTest(unittest.TestCase):
+    SETUP = ('-O2', 'system', 'cores 4,5')
+
+    def setUp(self):
+        self.db = results.ResultsDB(':memory:')
+        self.addCleanup(self.db.close)
+        self.commits = 0
+
+    def judge(self, trials, reference, margin=0.03, max_spread=0.1):
+        self.commits += 1
+        commit = 'c0ffee%d' % self.commits
+        for rates in trials:
+            self.db.add(commit, self.SETUP, FakeTestpmd(rates, 5.0).measure())
+        return results.judge(self.db.trials(commit, self.SETUP), reference,
+                             margin, max_spread)
+
+    def test_within_margin_is_good(self):
+        self.assertEqual(self.judge([[2000000] * 6], [2.05]), throughput.GOOD)
+        self.assertEqual(self.judge([[2000000] * 6] * 3, [1.5]), throughput.GOOD)
+
+    def test_below_margin_is_bad(self):
+        self.assertEqual(self.judge([[2000000] * 6] * 3, [2.2]), throughput.BAD)
+
+    def test_noisy_trial_is_skipped(self):
+        self.assertEqual(self.judge([[1000000, 3000000]], [1.0]), throughput.SKIP)
+        self.assertEqual(self.judge([[2000000] * 2, [1000000, 3000000], [2000000] * 2],
+                                    [1.0]),
+                         throughput.SKIP)
+
+    def test_dead_trials_are_skipped(self):
+        self.assertEqual(self.judge([[0, 0, 0]], [1.0]), throughput.SKIP)
+        self.assertEqual(self.judge([[0, 0, 0]] * 3, [10.0]), throughput.SKIP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+
+import tracing
+
+# about a fifth of a second of CPU in a child
+BUSY = [sys.executable, '-c', 'import os\nwhile sum(os.times()[:2]) < 0.2: pass']
+
+
+class TracerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+        previous = tracing.TRACER
+        tracing.TRACER = self.tracer
+        self.addCleanup(setattr, tracing, 'TRACER', previous)
+        self.dir = tempfile.mkdtemp(prefix='tracing-')
+        self.addCleanup(shutil.rmtree, self.dir)
+
+
+class RunTest(TracerTestCase):
+    def test_status(self):
+        self.assertEqual(self.tracer.run('exit 3', shell=True), (3, None))
+        self.assertEqual(tracing.call(['true']), 0)
+        self.assertEqual(tracing.call('kill -TERM $$', shell=True), -15)
+        self.assertEqual([c['status'] for c in self.tracer.commands], [3, 0, -15])
+        self.assertEqual(self.tracer.commands[1]['cmd'], 'true')
+
+    def test_check_output(self):
+        self.assertEqual(tracing.check_output(['echo', 'hello']), b'hello\n')
+        self.assertEqual(tracing.check_output('echo oops >&2', shell=True,
+                                              stderr=subprocess.STDOUT), b'oops\n')
+        try:
+            tracing.check_output('echo partial; kill -KILL $$', shell=True)
+        except subprocess.CalledProcessError as e:
+            self.assertEqual(e.returncode, -9)
+            self.assertEqual(e.output, b'partial\n')
+        else:
+            self.fail("CalledProcessError not raised")
+        self.assertRaises(subprocess.CalledProcessError, tracing.check_call, 'exit 1', shell=True)
+        self.assertEqual([c['status'] for c in self.tracer.commands], [0, 0, -9, 1])
+
+    def test_output_bytes(self):
+        path = os.path.join(self.dir, 'output')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100000)
+        self.assertEqual(len(tracing.check_output(['cat', path])), 100000)
+        tracing.call('true', shell=True)
+        self.assertEqual([c['output_bytes'] for c in self.tracer.commands], [100000, None])
+
+    def test_cpu_is_the_childs(self):
+        tracing.check_call(BUSY)
+        tracing.check_call(['sleep', '0.2'])
+        busy, sleep = self.tracer.commands
+        self.assertGreater(busy['cpu'], 0.1)
+        self.assertLess(sleep['cpu'], 0.1)
+        self.assertGreater(sleep['wall'], 0.15)
+
+
+class StageTest(TracerTestCase):
+    def test_commands_recorded_against_the_calling_threads_stage(self):
+        started = [threading.Event(), threading.Event()]
+
+        def stage(n):
+            started[n].set()
+            for event in started:
+                event.wait(5)
+            tracing.check_output(['echo', 'stage %d' % n])
+
+        threads = [threading.Thread(target=self.tracer.stage('stage%d' % n, stage),
+                                    args=(n,), name='thread%d' % n)
+                   for n in range(2)]
+        for thread in threads:
+            thread.start()
+        tracing.call(['true'])
+        for thread in threads:
+            thread.join()
+
+        for command in self.tracer.commands:
+            if command['cmd'] == 'true':
+                self.assertIsNone(command['stage'])
+            else:
+                n = command['cmd'][-1]
+                self.assertEqual((command['stage'], command['thread']),
+                                 ('stage' + n, 'thread' + n))
+        summary = self.tracer.summary()
+        self.assertEqual(sorted((s['name'], [c['cmd'] for c in s['commands']])
+                                for s in summary['stages']),
+                         [('stage0', ['echo stage 0']), ('stage1', ['echo stage 1'])])
+        self.assertEqual([c['cmd'] for c in summary['commands']], ['true'])
+
+    def test_stage_totals_and_status(self):
+        def busy():
+            tracing.check_call(BUSY)
+            tracing.check_output(['echo', 'done'])
+
+        def failing():
+            tracing.check_call('exit 2', shell=True)
+
+        def exiting():
+            raise SystemExit(4)
+
+        self.tracer.stage('busy', busy)()
+        self.assertRaises(subprocess.CalledProcessError, self.tracer.stage('failing', failing))
+        self.assertRaises(SystemExit, self.tracer.stage('exiting', exiting))
+        busy, failing, exiting = self.tracer.stages
+        self.assertEqual((busy['status'], failing['status'], exiting['status']),
+                         ('ok', 'failed', 'exit 4'))
+        self.assertGreater(busy['cpu'], 0.1)
+        self.assertGreaterEqual(busy['wall'], busy['cpu'] - 0.05)
+        self.assertEqual(busy['output_bytes'], 5)
+        self.assertIsNone(getattr(self.tracer.local, 'stage', None))
+
+    def test_nested_stage(self):
+        def inner():
+            tracing.call(['true'])
+
+        def outer():
+            self.tracer.stage('inner', inner)()
+            tracing.call(['false'])
+
+        self.tracer.stage('outer', outer)()
+        self.assertEqual([(c['cmd'], c['stage']) for c in self.tracer.commands],
+                         [('true', 'inner'), ('false', 'outer')])
+
+
+class WriteTest(TracerTestCase):
+    def test_summary_and_chrome_trace(self):
+        self.tracer.stage('build', lambda: tracing.call(['true']))()
+        summary_path, trace_path = self.tracer.write(os.path.join(self.dir, 'runs'), 'run')
+        with open(summary_path) as f:
+            summary = json.load(f)
+        self.assertEqual([s['name'] for s in summary['stages']], ['build'])
+        with open(trace_path) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(sorted((e['ph'], e['name']) for e in events),
+                         [('M', 'thread_name'), ('X', 'build'), ('X', 'true')])
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='tracing-')
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def summary(self, n, stages):
+        path = os.path.join(self.dir, 'run-%d.json' % n)
+        with open(path, 'w') as f:
+            json.dump({'start': 0, 'end': 1, 'commands': [],
+                       'stages': [{'name': name, 'wall': wall, 'cpu': cpu}
+                                  for name, wall, cpu in stages]}, f)
+        return path
+
+    def test_percentile(self):
+        self.assertIsNone(tracing.percentile([], 0.5))
+        self.assertEqual(tracing.percentile([3], 0.9), 3)
+        self.assertEqual(tracing.percentile([4, 1, 3, 2], 0.5), 3)
+        self.assertEqual(tracing.percentile(range(1, 11), 0.9), 10)
+
+    def test_aggregate(self):
+        paths = [self.summary(n, [('build', 10.0 * n, 2.0 * n)] +
+                              ([('test', 1.0, 0.5)] if n % 2 else []))
+                 for n in range(1, 11)]
+        result = tracing.aggregate(paths)
+        self.assertEqual(result['build'], {
+            'runs': 10,
+            'wall': {'p50': 60.0, 'p90': 100.0, 'max': 100.0},
+            'cpu': {'p50': 12.0, 'p90': 20.0, 'max': 20.0},
+        })
+        self.assertEqual(result['test']['runs'], 5)
+        self.assertEqual(result['test']['wall'], {'p50': 1.0, 'p90': 1.0, 'max': 1.0})
+        lines = tracing.format_aggregate(result).splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ['stage', 'build', 'test'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+'''
+Throughput measurement, and the verdicts a bisect step can give.
+
+The forwarding rate is taken from testpmd's port counters in the guest,
+sampled at the start and at every interval of a window; OVS's PMD
+statistics over the same window give cycles per packet. Verdicts from
+the measurements are up to results.judge.
+
+Parsing works on text, so it can be run against canned output.
+'''
+from __future__ import division
+import re
+import time
+
+GOOD = 'good'
+BAD = 'bad'
+SKIP = 'skip'
+
+PORT_STATS_HEADER = re.compile(r'NIC statistics for port (\d+)')
+PORT_COUNTER = re.compile(r'(RX|TX)-packets:\s*(\d+)')
+PMD_THREAD = re.compile(r'^pmd thread\b')
+PMD_COUNTER = re.compile(r'^\s*([a-z. ]+?):\s*(\d+)')
+
+
+class MeasurementError(RuntimeError):
+    pass
+
+
+def parse_port_stats(text):
+    '''
+    testpmd's "show port stats all" output to {port: {'rx': packets,
+    'tx': packets}}
+    '''
+    ports = {}
+    port = None
+    for line in text.splitlines():
+        header = PORT_STATS_HEADER.search(line)
+        if header:
+            port = int(header.group(1))
+            ports[port] = {}
+            continue
+        if port is None:
+            continue
+        for direction, count in PORT_COUNTER.findall(line):
+            ports[port][direction.lower()] = int(count)
+    if not ports or not all('rx' in counters for counters in ports.values()):
+        raise MeasurementError("no port statistics in %r" % text[:200])
+    return ports
+
+
+def parse_pmd_stats(text):
+    '''
+    ovs-appctl dpif-netdev/pmd-stats-show output, summed over the PMD
+    threads (the main thread is left out), to {'packets': n, 'cycles': n,
+    'processing_cycles': n}. Packets are "packets received" where OVS
+    reports it and emc hits + megaflow hits + miss where it doesn't.
+    '''
+    totals = {}
+    threads = 0
+    in_pmd = False
+    for line in text.splitlines():
+        if not line.startswith((' ', '\t')):
+            in_pmd = bool(PMD_THREAD.match(line))
+            threads += in_pmd
+            continue
+        if not in_pmd:
+            continue
+        counter = PMD_COUNTER.match(line)
+        if counter:
+            name = counter.group(1).strip()
+            totals[name] = totals.get(name, 0) + int(counter.group(2))
+    if not threads:
+        raise MeasurementError("no pmd threads in %r" % text[:200])
+
+    if 'packets received' in totals:
+        packets = totals['packets received']
+    else:
+        packets = sum(totals.get(name, 0) for name in ('emc hits', 'megaflow hits', 'miss'))
+    processing = totals.get('processing cycles', 0)
+    idle = totals.get('idle cycles', totals.get('polling cycles', 0))
+    return {'packets': packets, 'cycles': processing + idle, 'processing_cycles': processing}
+
+
+class Measurement(object):
+    def __init__(self, rates, cycles_per_packet):
+        '''
+        rates: packets per second forwarded in each interval
+        '''
+        self.rates = rates
+        self.cycles_per_packet = cycles_per_packet
+
+    @property
+    def mpps(self):
+        return sum(self.rates) / len(self.rates) / 1e6 if self.rates else 0.0
+
+    @property
+    def spread(self):
+        '''
+        (max - min) / mean of the interval rates
+        '''
+        mean = sum(self.rates) / len(self.rates) if self.rates else 0.0
+        if not mean:
+            return float('inf')
+        return (max(self.rates) - min(self.rates)) / mean
+
+    def __str__(self):
+        return "%.3f Mpps over %d intervals (spread %.1f%%), %s cycles/packet" % (
+            self.mpps, len(self.rates), self.spread * 100,
+            '%.1f' % self.cycles_per_packet if self.cycles_per_packet is not None else 'unknown')
+
+
+def forwarded(ports):
+    return sum(counters['rx'] for counters in ports.values())
+
+
+def measure(port_stats, pmd_stats=None, clear_pmd_stats=None,
+            window=30.0, interval=5.0, sleep=time.sleep, clock=time.time):
+    '''
+    Sample port_stats() (returning testpmd's stats text) every interval
+    seconds over window seconds. pmd_stats() and clear_pmd_stats(), when
+    given, read and clear OVS's PMD stats around the window.
+    '''
+    if clear_pmd_stats is not None:
+        clear_pmd_stats()
+    start = clock()
+    previous = (start, forwarded(parse_port_stats(port_stats())))
+    rates = []
+    while previous[0] - start < window - 1e-9:
+        sleep(interval)
+        now = clock()
+        count = forwarded(parse_port_stats(port_stats()))
+        rates.append((count - previous[1]) / (now - previous[0]))
+        previous = (now, count)
+
+    cycles_per_packet = None
+    if pmd_stats is not None:
+        stats = parse_pmd_stats(pmd_stats())
+        if stats['packets']:
+            cycles_per_packet = stats['processing_cycles'] / stats['packets']
+    return Measurement(rates, cycles_per_packet)
@@ -0,0 +1,227 @@
+'''
+Timing of stages and of the commands they run.
+
+Stage functions are wrapped with Tracer.stage(); commands are run with
+this module's check_output/check_call/call, which work like subprocess's
+but record wall time, the child's CPU time (from its own rusage, so
+commands of concurrent stages don't mix), exit status and output size,
+against the stage running on the calling thread.
+
+A run is written as a JSON summary and as a Chrome trace (chrome://tracing
+or ui.perfetto.dev). aggregate() turns several summaries into per-stage
+percentiles.
+'''
+from __future__ import print_function
+import os
+import json
+import time
+import threading
+import subprocess
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Tracer(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.end = None
+        self.stages = []
+        self.commands = []
+        self.local = threading.local()
+
+    def stage(self, name, function):
+        '''
+        function, recorded as stage name whenever it's called
+        '''
+        def traced(*args, **kwargs):
+            record = {
+                'name': name,
+                'thread': threading.current_thread().name,
+                'start': time.time(),
+                'commands': [],
+            }
+            previous = getattr(self.local, 'stage', None)
+            self.local.stage = record
+            record['status'] = 'failed'
+            try:
+                result = function(*args, **kwargs)
+                record['status'] = 'ok'
+                return result
+            except SystemExit as e:
+                record['status'] = 'exit %s' % (e.code,)
+                raise
+            finally:
+                self.local.stage = previous
+                record['end'] = time.time()
+                record['wall'] = record['end'] - record['start']
+                record['cpu'] = sum(c['cpu'] for c in record['commands'])
+                record['output_bytes'] = sum(c['output_bytes'] or 0 for c in record['commands'])
+                with self.lock:
+                    self.stages.append(record)
+        return traced
+
+    def run(self, cmd, shell=False, capture=False, stderr=None):
+        '''
+        Run cmd, returns (exit status, output or None). A status below
+        zero is the signal that killed it.
+        '''
+        start = time.time()
+        proc = subprocess.Popen(cmd, shell=shell,
+                                stdout=subprocess.PIPE if capture else None,
+                                stderr=stderr)
+        output = None
+        if capture:
+            output = proc.stdout.read()
+            proc.stdout.close()
+        # reaped here rather than by Popen.wait for the child's own rusage
+        _, wait_status, usage = os.wait4(proc.pid, 0)
+        if os.WIFSIGNALED(wait_status):
+            returncode = -os.WTERMSIG(wait_status)
+        else:
+            returncode = os.WEXITSTATUS(wait_status)
+        proc.returncode = returncode
+        end = time.time()
+
+        stage = getattr(self.local, 'stage', None)
+        record = {
+            'cmd': cmd if isinstance(cmd, str) else ' '.join(cmd),
+            'stage': stage['name'] if stage else None,
+            'thread': threading.current_thread().name,
+            'start': start,
+            'end': end,
+            'wall': end - start,
+            'cpu': usage.ru_utime + usage.ru_stime,
+            'status': returncode,
+            'output_bytes': len(output) if output is not None else None,
+        }
+        with self.lock:
+            self.commands.append(record)
+            if stage is not None:
+                stage['commands'].append(record)
+        return returncode, output
+
+    def summary(self):
+        with self.lock:
+            return {
+                'start': self.start,
+                'end': self.end or time.time(),
+                'stages': sorted(self.stages, key=lambda stage: stage['start']),
+                'commands': [c for c in self.commands if c['stage'] is None],
+            }
+
+    def chrome_trace(self):
+        '''
+        complete events for every stage and command, one track per thread
+        '''
+        events = []
+        tids = {}
+        pid = os.getpid()
+
+        def event(name, category, record, args):
+            thread = record['thread']
+            if thread not in tids:
+                tids[thread] = len(tids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                               'tid': tids[thread], 'args': {'name': thread}})
+            events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'pid': pid,
+                'tid': tids[thread],
+                'ts': int((record['start'] - self.start) * 1e6),
+                'dur': int(record['wall'] * 1e6),
+                'args': args,
+            })
+
+        with self.lock:
+            for stage in sorted(self.stages, key=lambda stage: stage['start']):
+                event(stage['name'], 'stage', stage,
+                      {'status': stage['status'], 'cpu': stage['cpu'],
+                       'output_bytes': stage['output_bytes']})
+            for command in self.commands:
+                event(command['cmd'][:80], 'command', command,
+                      {'cmd': command['cmd'], 'status': command['status'],
+                       'cpu': command['cpu'], 'output_bytes': command['output_bytes']})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, directory, name=None):
+        '''
+        Write <name>.json and <name>.trace.json to directory, name
+        defaulting to the run's start time. Returns both paths.
+        '''
+        if self.end is None:
+            self.end = time.time()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if name is None:
+            name = 'run-%s' % time.strftime('%Y%m%d-%H%M%S', time.localtime(self.start))
+        paths = []
+        for suffix, content in (('.json', self.summary()),
+                                ('.trace.json', self.chrome_trace())):
+            path = os.path.join(directory, name + suffix)
+            with open(path, 'w') as out:
+                json.dump(content, out, indent=1, sort_keys=True)
+            paths.append(path)
+        return paths
+
+
+TRACER = Tracer()
+
+
+def check_output(cmd, shell=False, stderr=None):
+    returncode, output = TRACER.run(cmd, shell=shell, capture=True, stderr=stderr)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=output)
+    return output
+
+
+def check_call(cmd, shell=False):
+    returncode, _ = TRACER.run(cmd, shell=shell)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return 0
+
+
+def call(cmd, shell=False):
+    return TRACER.run(cmd, shell=shell)[0]
+
+
+def aggregate(paths):
+    '''
+    Per-stage wall and CPU time percentiles over the run summaries in
+    paths, as {stage: {'runs': n, 'wall': {...}, 'cpu': {...}}}.
+    '''
+    samples = {}
+    for path in paths:
+        with open(path) as f:
+            run = json.load(f)
+        for stage in run['stages']:
+            values = samples.setdefault(stage['name'], {'wall': [], 'cpu': []})
+            values['wall'].append(stage['wall'])
+            values['cpu'].append(stage['cpu'])
+    result = {}
+    for name, values in samples.items():
+        result[name] = {'runs': len(values['wall'])}
+        for kind in ('wall', 'cpu'):
+            result[name][kind] = {
+                'p50': percentile(values[kind], 0.50),
+                'p90': percentile(values[kind], 0.90),
+                'max': max(values[kind]),
+            }
+    return result
+
+
+def format_aggregate(result):
+    lines = ["%-20s %5s %9s %9s %9s %9s" % ('stage', 'runs', 'wall p50', 'wall p90', 'wall max', 'cpu p50')]
+    for name, stats in sorted(result.items(), key=lambda item: -item[1]['wall']['p50']):
+        lines.append("%-20s %5d %9.1f %9.1f %9.1f %9.1f" % (
+            name, stats['runs'], stats['wall']['p50'], stats['wall']['p90'],
+            stats['wall']['max'], stats['cpu']['p50']))
+    return '\n'.join(lines)